@@ -0,0 +1,171 @@
+"""
+审查文档分窗：按大纲（doc_outline_node）章节边界把文档切成 token 有界的上下文窗口，
+每个窗口携带章节路径（如“3 项目概况 > 3.2 工程占地”），表格渲染为紧凑的 TSV。
+规则批次逐窗口执行（map），各窗口结果经运行内问题去重合并（reduce），任意长度的文档都能完整审查。
+"""
+import re
+from dataclasses import dataclass, field
+
+from .rule_engine_prompt import estimate_tokens
+
+# 单个表格单元格在 TSV 中保留的最大字符数
+TABLE_CELL_CHARS = 120
+# 章节路径分隔符
+PATH_SEP = " > "
+
+_WS_RE = re.compile(r"\s+")
+
+
+@dataclass
+class DocWindow:
+    """一个上下文窗口：窗口序号、首个章节路径、包含的 block 与渲染后的正文。"""
+    index: int
+    heading_path: list[str]
+    block_ids: list[int] = field(default_factory=list)
+    text: str = ""
+    tokens: int = 0
+
+
+def heading_paths(outline_nodes: list[dict]) -> dict[int, list[str]]:
+    """outline_node_id -> 从顶层到该节点的标题列表（含编号）。"""
+    by_id = {n["id"]: n for n in outline_nodes}
+    paths: dict[int, list[str]] = {}
+
+    def _path(node_id: int, depth: int = 0) -> list[str]:
+        if node_id in paths:
+            return paths[node_id]
+        node = by_id.get(node_id)
+        if node is None or depth > 32:
+            return []
+        title = " ".join(p for p in (node.get("node_no"), node.get("title")) if p).strip()
+        parent = node.get("parent_id")
+        path = (_path(parent, depth + 1) if parent else []) + [title]
+        paths[node_id] = path
+        return path
+
+    for node_id in by_id:
+        _path(node_id)
+    return paths
+
+
+def render_table(table: dict, cells: list[dict]) -> str:
+    """表格渲染为 TSV：首行为表号与标题，其后每行一行，单元格以制表符分隔、去除换行。"""
+    grid: dict[int, dict[int, str]] = {}
+    for cell in cells:
+        text = _WS_RE.sub(" ", str(cell.get("text") or "")).strip()[:TABLE_CELL_CHARS]
+        grid.setdefault(cell["r"], {})[cell["c"]] = text
+    n_cols = max((c for row in grid.values() for c in row), default=-1) + 1
+    title = " ".join(p for p in (table.get("table_no"), table.get("title")) if p).strip()
+    lines = [f"【表格】{title}" if title else "【表格】"]
+    for r in sorted(grid):
+        row = grid[r]
+        if any(row.values()):
+            lines.append("\t".join(row.get(c, "") for c in range(n_cols)))
+    return "\n".join(lines)
+
+
+def render_block(block: dict) -> str:
+    """单个 block 的正文：[block_id][page] 标注 + 文本（表格为 TSV）。"""
+    body = block.get("rendered") or (block.get("text") or "").strip()
+    if not body:
+        return ""
+    return f"[block_id={block.get('id', 0)}][page={block.get('page_no', 1)}]\n{body}"
+
+
+def render_outline(outline_nodes: list[dict]) -> str:
+    """文档目录：每个大纲节点一行，按层级缩进（编号 + 标题）。"""
+    lines = []
+    for n in outline_nodes:
+        title = " ".join(p for p in (n.get("node_no"), n.get("title")) if p).strip()
+        if title:
+            lines.append("  " * max((n.get("level") or 1) - 1, 0) + title)
+    return "\n".join(lines)
+
+
+def _section_header(path: list[str]) -> str:
+    return f"【章节：{PATH_SEP.join(path) or '（无章节）'}】"
+
+
+def _sections(blocks: list[dict]) -> list[tuple[int | None, list[dict]]]:
+    """按 outline_node_id 把连续 block 分组为章节（保持文档顺序）。"""
+    sections: list[tuple[int | None, list[dict]]] = []
+    for b in blocks:
+        node_id = b.get("outline_node_id")
+        if sections and sections[-1][0] == node_id:
+            sections[-1][1].append(b)
+        else:
+            sections.append((node_id, [b]))
+    return sections
+
+
+def build_windows(blocks: list[dict], outline_nodes: list[dict], max_tokens: int) -> list[DocWindow]:
+    """
+    按章节装窗：连续章节装入同一窗口直到超过 max_tokens；单个章节超限时在 block 边界拆开，
+    续窗的章节标题标注“（续）”。每个章节正文前加 【章节：路径】 行。单个 block 超限时截断到窗口上限。
+    """
+    paths = heading_paths(outline_nodes)
+    # 按全中文估算（约 1.5 字/token）的单个 block 字符上限
+    max_chars = int(max_tokens * 1.5)
+    windows: list[DocWindow] = []
+    current: DocWindow | None = None
+
+    def _flush():
+        nonlocal current
+        if current is not None and current.text:
+            windows.append(current)
+        current = None
+
+    def _add(path: list[str], header: str, units: list[tuple[int, str, int]]):
+        nonlocal current
+        text = header + "\n" + "\n\n".join(u[1] for u in units)
+        tokens = estimate_tokens(text)
+        if current is None:
+            current = DocWindow(index=len(windows), heading_path=path)
+        current.text = f"{current.text}\n\n{text}" if current.text else text
+        current.tokens += tokens
+        current.block_ids.extend(u[0] for u in units)
+
+    for node_id, section_blocks in _sections(blocks):
+        path = paths.get(node_id, []) if node_id else []
+        header = _section_header(path)
+        units = []
+        for b in section_blocks:
+            text = render_block(b)
+            if not text:
+                continue
+            if len(text) > max_chars:
+                text = text[:max_chars]
+            units.append((b["id"], text, estimate_tokens(text)))
+        if not units:
+            continue
+        section_tokens = estimate_tokens(header) + sum(u[2] for u in units)
+        if current is not None and current.tokens + section_tokens > max_tokens:
+            _flush()
+        if section_tokens <= max_tokens:
+            _add(path, header, units)
+            continue
+        # 单个章节超过窗口上限：在 block 边界拆成多段，续段标注（续）
+        piece, piece_tokens, first = [], estimate_tokens(header), True
+        for unit in units:
+            if piece and piece_tokens + unit[2] > max_tokens:
+                _add(path, header if first else header[:-1] + "（续）】", piece)
+                _flush()
+                piece, piece_tokens, first = [], estimate_tokens(header), False
+            piece.append(unit)
+            piece_tokens += unit[2]
+        if piece:
+            _add(path, header if first else header[:-1] + "（续）】", piece)
+    _flush()
+    return windows
+
+
+def render_document(blocks: list[dict], outline_nodes: list[dict]) -> str:
+    """整篇文档按与分窗相同的格式渲染（章节标题行 + block 正文，表格为 TSV），不截断。"""
+    paths = heading_paths(outline_nodes)
+    parts = []
+    for node_id, section_blocks in _sections(blocks):
+        body = [t for t in (render_block(b) for b in section_blocks) if t]
+        if body:
+            path = paths.get(node_id, []) if node_id else []
+            parts.append(_section_header(path) + "\n" + "\n\n".join(body))
+    return "\n\n".join(parts)
@@ -0,0 +1,124 @@
+"""
+证据定位索引：将一次审查运行的全部 block 文本去空白后拼接，建立 n-gram 倒排索引与 block 偏移表。
+AI 返回的原文片段（snippet / anchor_text）据此定位到具体 block_id、块内字符偏移与页码，
+替代逐 block 线性扫描（且不再只匹配每个 block 的前 100 字）。
+"""
+import re
+from bisect import bisect_right
+from collections import Counter
+from dataclasses import dataclass
+
+_WS_RE = re.compile(r"\s+")
+
+# n-gram 长度：中文 3 字即有较好区分度
+NGRAM = 3
+# 模糊定位时参与投票的 n-gram 采样上限
+MAX_VOTE_GRAMS = 64
+# 模糊定位最少命中比例（命中 n-gram 数 / 采样 n-gram 数）
+MIN_VOTE_RATIO = 0.5
+
+
+@dataclass
+class EvidenceMatch:
+    """片段定位结果：起止 block、块内原文偏移（含空白的原始字符位置）与页码。"""
+    block_ids: list[int]
+    block_id: int
+    char_start: int
+    char_end: int
+    page_no: int | None
+    exact: bool
+
+
+class EvidenceIndex:
+    """
+    blocks: [{"id", "text", "page_no"}, ...]（按文档顺序）
+    文本坐标：去空白后的拼接串 self._text；_starts 为每个 block 在拼接串中的起点（二分定位 block）；
+    _orig_pos 记录拼接串每个字符在其 block 原文中的位置，用于还原块内偏移。
+    """
+
+    def __init__(self, blocks: list[dict], n: int = NGRAM):
+        self.n = n
+        self._blocks: list[dict] = []
+        self._starts: list[int] = []
+        parts: list[str] = []
+        orig_pos: list[int] = []
+        offset = 0
+        for b in blocks:
+            text = b.get("text") or ""
+            kept = [(i, ch) for i, ch in enumerate(text) if not ch.isspace()]
+            if not kept:
+                continue
+            self._blocks.append(b)
+            self._starts.append(offset)
+            parts.append("".join(ch for _, ch in kept))
+            orig_pos.extend(i for i, _ in kept)
+            offset += len(kept)
+        self._text = "".join(parts)
+        self._orig_pos = orig_pos
+        self._grams: dict[str, list[int]] = {}
+        text = self._text
+        for i in range(len(text) - n + 1):
+            self._grams.setdefault(text[i : i + n], []).append(i)
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def locate(self, snippet: str) -> EvidenceMatch | None:
+        """定位片段：先精确匹配（以最稀有 n-gram 为锚点校验），失败再按 n-gram 投票做模糊定位。"""
+        needle = _WS_RE.sub("", snippet or "")
+        if not needle or not self._text:
+            return None
+        n = self.n
+        if len(needle) < n:
+            pos = self._text.find(needle)
+            return self._match(pos, len(needle), True) if pos >= 0 else None
+
+        # 精确：取片段中出现次数最少的 n-gram，候选位置逐一校验
+        best_i, best_postings = -1, None
+        for i in range(len(needle) - n + 1):
+            postings = self._grams.get(needle[i : i + n])
+            if postings is None:
+                best_i = -1
+                break
+            if best_postings is None or len(postings) < len(best_postings):
+                best_i, best_postings = i, postings
+        if best_i >= 0 and best_postings is not None:
+            for p in best_postings:
+                start = p - best_i
+                if start >= 0 and self._text.startswith(needle, start):
+                    return self._match(start, len(needle), True)
+
+        # 模糊：各 n-gram 对“片段起点”投票，票数最多且达到比例阈值的起点即为定位结果
+        step = max(1, (len(needle) - n + 1) // MAX_VOTE_GRAMS)
+        votes: Counter = Counter()
+        sampled = 0
+        for i in range(0, len(needle) - n + 1, step):
+            sampled += 1
+            postings = self._grams.get(needle[i : i + n])
+            if not postings or len(postings) > 1000:
+                continue
+            for p in postings:
+                votes[p - i] += 1
+        if not votes:
+            return None
+        start, cnt = votes.most_common(1)[0]
+        if cnt < max(1, int(sampled * MIN_VOTE_RATIO)):
+            return None
+        start = max(0, start)
+        return self._match(start, min(len(needle), len(self._text) - start), False)
+
+    def _match(self, start: int, length: int, exact: bool) -> EvidenceMatch:
+        end = start + max(1, length) - 1  # 末字符（含）
+        first = bisect_right(self._starts, start) - 1
+        last = bisect_right(self._starts, end) - 1
+        block_ids = [self._blocks[k]["id"] for k in range(first, last + 1)]
+        first_block = self._blocks[first]
+        last_block = self._blocks[last]
+        return EvidenceMatch(
+            block_ids=block_ids,
+            block_id=first_block["id"],
+            char_start=self._orig_pos[start],
+            char_end=self._orig_pos[end] + 1 if last == first else len(first_block.get("text") or ""),
+            page_no=first_block.get("page_no") if first_block.get("page_no") is not None else last_block.get("page_no"),
+            exact=exact,
+        )
@@ -0,0 +1,202 @@
+"""
+审查运行内的问题去重合并：不同规则批次、重试轮或本地规则对同一处问题的重复报告，
+按“证据位置（block + 块内偏移区间）+ issue_type + 标题相似度”聚类，合并为一条问题，
+并在 provenance 中保留各来源（规则 ID、原标题、证据位置）。
+证据位置须是双方都有的真实偏移区间且重叠，或证据原文完全相同；只有 block_id 的退化位置
+（表格问题、未能定位的片段）不作为合并依据，否则同一表格内的不同问题会被误合并。
+
+标题相似度用字符 2-gram 的 MinHash 签名估计 Jaccard；候选只取证据落在同一 block 的已有问题。
+"""
+import re
+import zlib
+from dataclasses import dataclass, field
+
+# MinHash 签名长度
+MINHASH_PERMUTATIONS = 32
+# 标题相似度（估计 Jaccard）阈值
+TITLE_SIMILARITY = 0.5
+# 块内偏移区间允许的间隙（字符），小于此距离视为同一处证据
+SPAN_SLACK = 20
+
+_NOISE_RE = re.compile(r"[\s【】\[\]（）()“”\"'‘’：:，,。.、；;！!？?]+")
+_SEEDS = [zlib.crc32(f"minhash-{i}".encode()) for i in range(MINHASH_PERMUTATIONS)]
+
+
+def _shingles(title: str) -> set[str]:
+    text = _NOISE_RE.sub("", title or "")
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i : i + 2] for i in range(len(text) - 1)}
+
+
+def minhash(title: str) -> tuple[int, ...]:
+    shingles = _shingles(title)
+    if not shingles:
+        return tuple([0] * MINHASH_PERMUTATIONS)
+    encoded = [s.encode("utf-8") for s in shingles]
+    return tuple(min(zlib.crc32(e, seed) for e in encoded) for seed in _SEEDS)
+
+
+def similarity(a: tuple[int, ...], b: tuple[int, ...]) -> float:
+    return sum(1 for x, y in zip(a, b) if x == y) / MINHASH_PERMUTATIONS
+
+
+def _spans(row: dict) -> list[tuple[int, int | None, int | None]]:
+    """问题的证据位置：evidence_quotes 中带 block_id 的偏移区间；没有时退回 evidence_block_ids。"""
+    spans = [
+        (q["block_id"], q.get("char_start"), q.get("char_end"))
+        for q in row.get("evidence_quotes") or []
+        if isinstance(q, dict) and q.get("block_id") is not None
+    ]
+    if not spans:
+        spans = [(bid, None, None) for bid in (row.get("evidence_block_ids") or [])[:1]]
+    return spans
+
+
+def _spans_overlap(a: tuple, b: tuple) -> bool:
+    """同一 block 内的两个偏移区间是否重叠；任一方没有偏移（退化位置）时不算重叠。"""
+    if a[0] != b[0]:
+        return False
+    if None in (a[1], a[2], b[1], b[2]):
+        return False
+    return a[1] <= b[2] + SPAN_SLACK and b[1] <= a[2] + SPAN_SLACK
+
+
+def _quotes(row: dict) -> frozenset[str]:
+    """证据原文（去空白），用于没有偏移区间时的精确比对。"""
+    return frozenset(
+        q
+        for q in (
+            re.sub(r"\s+", "", str(item.get("quote") or "")) if isinstance(item, dict) else ""
+            for item in row.get("evidence_quotes") or []
+        )
+        if q
+    )
+
+
+def provenance_entry(row: dict, source: str) -> dict:
+    span = (_spans(row) or [(None, None, None)])[0]
+    return {
+        "rule_id": row.get("checkpoint_code"),
+        "title": row.get("title"),
+        "source": source,
+        "block_id": span[0],
+        "char_start": span[1],
+        "char_end": span[2],
+    }
+
+
+@dataclass
+class IssueCluster:
+    """一组被判定为同一问题的报告；row 为首次报告（写库行），issue_id 写库后回填。"""
+    row: dict
+    issue_type: str
+    signature: tuple[int, ...]
+    spans: list[tuple]
+    quotes: frozenset[str] = frozenset()
+    provenance: list[dict] = field(default_factory=list)
+    issue_id: int | None = None
+    dirty: bool = False
+
+
+class IssueDeduper:
+    """单次运行内的问题聚类器（非线程安全，由调用方加锁）。"""
+
+    def __init__(self):
+        self._by_block: dict[int, list[IssueCluster]] = {}
+
+    def add(self, row: dict, source: str) -> tuple[IssueCluster, bool]:
+        """
+        加入一条待写库问题，返回 (所属簇, 是否新簇)。
+        命中已有簇时合并来源（provenance 追加、置信度取高），调用方据 dirty 标记回写已落库的问题。
+        """
+        spans = _spans(row)
+        signature = minhash(row.get("title") or "")
+        entry = provenance_entry(row, source)
+        cluster = self._match(row, spans, signature)
+        if cluster is not None:
+            self._merge_into(cluster, [entry], row.get("confidence"))
+            return cluster, False
+        cluster = IssueCluster(
+            row=row,
+            issue_type=row.get("issue_type"),
+            signature=signature,
+            spans=spans,
+            quotes=_quotes(row),
+            provenance=[entry],
+        )
+        row["provenance"] = cluster.provenance
+        self._index(cluster)
+        return cluster, True
+
+    def restore(self, row: dict, issue_id: int) -> IssueCluster:
+        """载入已落库的问题（续跑时），后续相同问题合并到该行而非新增。"""
+        cluster = IssueCluster(
+            row=row,
+            issue_type=row.get("issue_type"),
+            signature=minhash(row.get("title") or ""),
+            spans=_spans(row),
+            quotes=_quotes(row),
+            provenance=list(row.get("provenance") or [provenance_entry(row, "ai")]),
+            issue_id=issue_id,
+        )
+        self._index(cluster)
+        return cluster
+
+    def absorb(self, row: dict, issue_id: int) -> IssueCluster | None:
+        """
+        载入已落库的问题；与已载入的某簇重复时把本行来源并入该簇并返回该簇（本行应删除），
+        否则作为新簇载入并返回 None。用于多个 worker 并行写入后的整体去重。
+        """
+        cluster = self._match(row, _spans(row), minhash(row.get("title") or ""))
+        if cluster is None:
+            self.restore(row, issue_id)
+            return None
+        self._merge_into(
+            cluster, row.get("provenance") or [provenance_entry(row, "ai")], row.get("confidence")
+        )
+        return cluster
+
+    def discard(self, cluster: IssueCluster) -> None:
+        """移除一个簇（写库失败的新簇），后续相同问题不再并入这条未落库的记录。"""
+        for block_id in {s[0] for s in cluster.spans}:
+            clusters = self._by_block.get(block_id)
+            if clusters is None:
+                continue
+            clusters[:] = [c for c in clusters if c is not cluster]
+            if not clusters:
+                del self._by_block[block_id]
+
+    def _match(self, row: dict, spans: list[tuple], signature: tuple[int, ...]) -> IssueCluster | None:
+        quotes = _quotes(row)
+        for cluster in self._candidates(spans):
+            if cluster.issue_type != row.get("issue_type"):
+                continue
+            located = any(_spans_overlap(a, b) for a in spans for b in cluster.spans)
+            if not located and not (quotes & cluster.quotes):
+                continue
+            if similarity(signature, cluster.signature) < TITLE_SIMILARITY:
+                continue
+            return cluster
+        return None
+
+    @staticmethod
+    def _merge_into(cluster: IssueCluster, entries: list[dict], confidence) -> None:
+        for entry in entries:
+            if entry not in cluster.provenance:
+                cluster.provenance.append(entry)
+        cluster.row["confidence"] = max(cluster.row.get("confidence") or 0, confidence or 0)
+        cluster.dirty = True
+
+    def _index(self, cluster: IssueCluster) -> None:
+        for block_id in {s[0] for s in cluster.spans}:
+            self._by_block.setdefault(block_id, []).append(cluster)
+
+    def _candidates(self, spans: list[tuple]) -> list[IssueCluster]:
+        seen, out = set(), []
+        for block_id in {s[0] for s in spans}:
+            for c in self._by_block.get(block_id, []):
+                if id(c) not in seen:
+                    seen.add(id(c))
+                    out.append(c)
+        return out
@@ -0,0 +1,250 @@
+"""
+worker 进程内的规范知识库 BM25 索引：由 READY 知识库的 kb_chunk 构建（中文 bigram 分词，见 kb_tokenizer），
+倒排表存为 numpy 数组并持久化到 KB_INDEX_DIR/<内容哈希>/，各进程以 mmap 只读加载、共享页缓存。
+chunk 正文与元数据一并存入索引文件，检索全程不访问 PostgreSQL。
+
+版本：内容哈希 = 所有 READY chunk 的 (id, hash) 摘要。知识库置为 READY / PROCESSING / FAILED 后
+投递 rebuild_kb_bm25_task 重建索引，并把新哈希写入 Redis；各进程每 KB_INDEX_CHECK_SECONDS 秒比对一次，
+版本变化时加载新目录（本机尚无该目录时自行从库构建）。
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from .. import db
+from ..settings import settings
+from ..utils.redis_client import get_redis
+from .kb_tokenizer import query_terms, tokenize
+
+logger = logging.getLogger(__name__)
+_schema = settings.DB_SCHEMA
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 保留的历史索引目录数（当前版本之外）
+KEEP_VERSIONS = 1
+# 构建时分批读取 chunk 的行数
+FETCH_BATCH = 2000
+
+_VERSION_KEY = "sws:kb:bm25:version"
+
+_ARRAYS = (
+    "doc_ids", "doc_sources", "doc_lens",
+    "term_offsets", "post_docs", "post_tfs",
+    "store_offsets", "store",
+)
+
+
+class Bm25Index:
+    """只读 BM25 索引（数组均为 mmap）。"""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.path = path
+        self.version = meta["version"]
+        self.avgdl = meta["avgdl"]
+        self.term_ids = {t: i for i, t in enumerate(meta["terms"])}
+        for name in _ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        self.n_docs = len(self.doc_ids)
+
+    def search(self, query: str, top_k: int = 10, kb_source_ids: list[int] | None = None) -> list[dict]:
+        """返回 [{id, kb_source_id, chunk_text, meta_json, hash, score}]，按 BM25 分数降序。"""
+        terms = [t for t in query_terms(query) if t in self.term_ids]
+        if not terms or not self.n_docs:
+            return []
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for t in terms:
+            tid = self.term_ids[t]
+            a, b = self.term_offsets[tid], self.term_offsets[tid + 1]
+            docs = self.post_docs[a:b]
+            tf = self.post_tfs[a:b].astype(np.float32)
+            idf = np.log(1 + (self.n_docs - (b - a) + 0.5) / ((b - a) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lens[docs] / (self.avgdl or 1))
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        if kb_source_ids:
+            scores[~np.isin(self.doc_sources, kb_source_ids)] = 0
+        hits = np.flatnonzero(scores)
+        if len(hits) > top_k:
+            hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [{**self._doc(int(i)), "score": round(float(scores[i]), 4)} for i in hits]
+
+    def _doc(self, i: int) -> dict:
+        raw = bytes(self.store[self.store_offsets[i]:self.store_offsets[i + 1]])
+        doc = json.loads(raw.decode("utf-8"))
+        return {"id": int(self.doc_ids[i]), "kb_source_id": int(self.doc_sources[i]), **doc}
+
+
+def content_version() -> str | None:
+    """READY 知识库的内容哈希；无 chunk 时返回 None。"""
+    row = db.fetch_one(
+        f"""
+        SELECT count(*) AS n, md5(string_agg(c.id::text || ':' || c.hash, ',' ORDER BY c.id)) AS version
+        FROM {_schema}.kb_chunk c
+        JOIN {_schema}.kb_source s ON s.id = c.kb_source_id AND s.status = 'READY'
+        """
+    )
+    return row["version"] if row and row["n"] else None
+
+
+def _index_path(version: str) -> str:
+    return os.path.join(settings.KB_INDEX_DIR, version)
+
+
+def build_index(version: str) -> str:
+    """从库中构建指定版本的索引目录（已存在则直接返回），写临时目录后原子改名。"""
+    path = _index_path(version)
+    if os.path.exists(os.path.join(path, "meta.json")):
+        return path
+    t0 = time.perf_counter()
+    os.makedirs(settings.KB_INDEX_DIR, exist_ok=True)
+    vocab: dict[str, int] = {}
+    doc_ids, doc_sources, doc_lens = [], [], []
+    post_terms, post_docs, post_tfs = [], [], []
+    store, store_offsets = bytearray(), [0]
+    last_id = 0
+    while True:
+        rows = db.fetch_all(
+            f"""
+            SELECT c.id, c.kb_source_id, c.chunk_text, c.meta_json, c.hash
+            FROM {_schema}.kb_chunk c
+            JOIN {_schema}.kb_source s ON s.id = c.kb_source_id AND s.status = 'READY'
+            WHERE c.id > %(last_id)s
+            ORDER BY c.id
+            LIMIT %(limit)s
+            """,
+            {"last_id": last_id, "limit": FETCH_BATCH},
+        )
+        if not rows:
+            break
+        for r in rows:
+            doc = len(doc_ids)
+            tokens = tokenize(r["chunk_text"])
+            for term, tf in Counter(tokens).items():
+                post_terms.append(vocab.setdefault(term, len(vocab)))
+                post_docs.append(doc)
+                post_tfs.append(min(tf, 65535))
+            doc_ids.append(r["id"])
+            doc_sources.append(r["kb_source_id"])
+            doc_lens.append(len(tokens))
+            store += json.dumps(
+                {"chunk_text": r["chunk_text"], "meta_json": r["meta_json"], "hash": r["hash"]},
+                ensure_ascii=False,
+            ).encode("utf-8")
+            store_offsets.append(len(store))
+        last_id = rows[-1]["id"]
+
+    # 倒排表按 (term, doc) 排序，term_offsets[t]:term_offsets[t+1] 为词 t 的区间
+    terms_arr = np.asarray(post_terms, dtype=np.int32)
+    order = np.lexsort((np.asarray(post_docs, dtype=np.int32), terms_arr))
+    arrays = {
+        "doc_ids": np.asarray(doc_ids, dtype=np.int64),
+        "doc_sources": np.asarray(doc_sources, dtype=np.int64),
+        "doc_lens": np.asarray(doc_lens, dtype=np.float32),
+        "term_offsets": np.concatenate(([0], np.cumsum(np.bincount(terms_arr, minlength=len(vocab))))).astype(np.int64),
+        "post_docs": np.asarray(post_docs, dtype=np.int32)[order],
+        "post_tfs": np.asarray(post_tfs, dtype=np.uint16)[order],
+        "store_offsets": np.asarray(store_offsets, dtype=np.int64),
+        "store": np.frombuffer(bytes(store), dtype=np.uint8),
+    }
+    tmp = tempfile.mkdtemp(prefix=f".{version}.", dir=settings.KB_INDEX_DIR)
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), arr)
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "version": version,
+                "n_docs": len(doc_ids),
+                "avgdl": float(np.mean(doc_lens)) if doc_lens else 0.0,
+                "terms": sorted(vocab, key=vocab.get),
+            },
+            f,
+            ensure_ascii=False,
+        )
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # 其他进程已先构建好同一版本
+        shutil.rmtree(tmp, ignore_errors=True)
+    logger.info(
+        f"KB BM25 索引构建完成：版本 {version}，{len(doc_ids)} 个 chunk、{len(vocab)} 个词，"
+        f"耗时 {time.perf_counter() - t0:.1f}s"
+    )
+    return path
+
+
+def _prune(keep: str) -> None:
+    """删除当前版本之外较旧的索引目录，保留最近 KEEP_VERSIONS 个。"""
+    base = settings.KB_INDEX_DIR
+    dirs = [
+        d for d in os.listdir(base)
+        if d != keep and not d.startswith(".") and os.path.isdir(os.path.join(base, d))
+    ]
+    dirs.sort(key=lambda d: os.path.getmtime(os.path.join(base, d)), reverse=True)
+    for d in dirs[KEEP_VERSIONS:]:
+        shutil.rmtree(os.path.join(base, d), ignore_errors=True)
+
+
+def rebuild() -> str | None:
+    """按当前内容哈希构建索引并发布版本（Redis），返回版本；知识库为空时返回 None。"""
+    version = content_version()
+    if version is None:
+        # 已没有 READY 的 chunk：撤下已发布的版本，各进程退回数据库检索
+        try:
+            get_redis().delete(_VERSION_KEY)
+        except Exception as e:
+            logger.warning(f"撤下 KB BM25 索引版本失败: {e}")
+        return None
+    build_index(version)
+    try:
+        get_redis().set(_VERSION_KEY, version)
+    except Exception as e:
+        logger.warning(f"发布 KB BM25 索引版本失败: {e}")
+    _prune(version)
+    return version
+
+
+_current: Bm25Index | None = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_index() -> Bm25Index | None:
+    """
+    当前进程的索引（按 KB_INDEX_CHECK_SECONDS 间隔比对 Redis 中的版本）。
+    尚未发布版本或加载失败时返回 None，由调用方退回数据库检索。
+    """
+    global _current, _checked_at
+    if not settings.KB_LOCAL_INDEX:
+        return None
+    now = time.monotonic()
+    if _current is not None and now - _checked_at < settings.KB_INDEX_CHECK_SECONDS:
+        return _current
+    with _lock:
+        if _current is not None and now - _checked_at < settings.KB_INDEX_CHECK_SECONDS:
+            return _current
+        _checked_at = now
+        try:
+            version = get_redis().get(_VERSION_KEY)
+        except Exception as e:
+            logger.warning(f"读取 KB BM25 索引版本失败: {e}")
+            return _current
+        if not version:
+            # 版本已撤下（知识库全部离开 READY）：丢弃旧索引
+            _current = None
+            return None
+        if _current is None or _current.version != version:
+            try:
+                _current = Bm25Index(build_index(version))
+            except Exception as e:
+                logger.error(f"加载 KB BM25 索引 {version} 失败: {e}", exc_info=True)
+        return _current
@@ -0,0 +1,194 @@
+"""
+规范知识库分块：按条款/标题边界流式切分规范文本。
+标题行识别沿用知识库包构建脚本（docs/kb_package_*/tools/build_kb_package_v2.py）的 HEADING_RES：
+章/节/条、多级条款号（如 5.2.3）、附录。遇到标题时结束当前 chunk（过短的相邻条款合并为一个），
+单个条款超过 chunk_size 时优先在句末（。；）处切开，并保留 overlap 个字符的重叠。
+chunk 的 meta 带页码范围、标题路径与条款号。输入为 (行, 页码) 流（全文用 text_lines，PDF 逐页用 page_lines）、
+输出为生成器，耗时与文本长度线性相关。
+"""
+import bisect
+import re
+from typing import Iterable, Iterator
+
+HEADING_RES = [
+    re.compile(r"^(第[一二三四五六七八九十百千0-9]+[章节])\s*.*$"),
+    re.compile(r"^(第[一二三四五六七八九十百千0-9]+条)\s*.*$"),
+    re.compile(r"^(\d{1,2}(?:\.\d{1,2}){0,4})\s+[一-鿿].{0,60}$"),
+    re.compile(r"^(附录|附表|附件)\s*[一-鿿A-Za-z0-9（）()]{0,40}$"),
+]
+_NUM_HEADING_RE = re.compile(r"^(\d{1,2}(?:\.\d{1,2}){0,4})\s+")
+_NOISE_RES = [
+    re.compile(r"\d{1,4}"),
+    re.compile(r"第\s*\d+\s*页"),
+    re.compile(r"[-—–]{3,}"),
+]
+_ROMAN_RE = re.compile(r"[0-9IVXivx\-—–_ ]{1,10}")
+
+# 句末切分点（按优先级）；都找不到时在换行处切，再找不到则按长度硬切
+SENTENCE_ENDS = ("。", "；", ";", "！", "？")
+# 条款不足 chunk_size * MERGE_RATIO 时与下一条款合并
+MERGE_RATIO = 0.25
+# 切分点不早于 chunk_size * CUT_RATIO
+CUT_RATIO = 0.6
+
+
+def filter_line(line: str) -> str | None:
+    """去掉空行、页码行（“12”“第 3 页”）与分隔线，返回去空白后的行。"""
+    s = (line or "").strip()
+    if not s or any(r.fullmatch(s) for r in _NOISE_RES):
+        return None
+    return s
+
+
+def heading_clause(line: str) -> str | None:
+    """标题行返回其编号（如“5.2.3”“第三章”“附录”），非标题行返回 None。"""
+    if len(line) > 80 or _ROMAN_RE.fullmatch(line):
+        return None
+    for r in HEADING_RES:
+        m = r.match(line)
+        if m:
+            return m.group(1)
+    return None
+
+
+def _update_path(path: list[str], line: str) -> None:
+    """
+    按标题层级更新标题路径（章重置路径，条挂在章下）。多级编号按前缀定层级：弹出编号不是新编号真前缀的标题，
+    跳级编号（如“1 总则”下直接是 1.0.1、1.0.2）挂在最近的上级下，同级条款不会叠进路径；
+    一级编号（无点）重置路径，多级编号挂在章等非编号标题下。
+    """
+    m = _NUM_HEADING_RE.match(line)
+    if m:
+        number = m.group(1)
+        while path:
+            parent = _NUM_HEADING_RE.match(path[-1])
+            if parent is None and "." in number:
+                break
+            if parent is not None and number.startswith(parent.group(1) + "."):
+                break
+            path.pop()
+        path.append(line)
+    elif re.match(r"^第.*章", line):
+        path[:] = [line]
+    elif re.match(r"^第.*条", line) and path and re.match(r"^第.*章", path[0]):
+        path[:] = [path[0], line]
+    else:
+        path[:] = [line]
+
+
+def text_lines(text: str, page_boundaries: list[tuple[int, int, int]] | None = None) -> Iterator[tuple[str, int | None]]:
+    """
+    全文按行输出 (行, 页码)。page_boundaries 为 [(char_start, char_end, page_no), ...]，
+    起点数组只构建一次，每行二分查找所在页。
+    """
+    starts = [b[0] for b in page_boundaries] if page_boundaries else []
+    pos = 0
+    for line in text.split("\n"):
+        page = None
+        if starts:
+            i = bisect.bisect_right(starts, pos) - 1
+            if i >= 0:
+                page = page_boundaries[i][2]
+        yield line, page
+        pos += len(line) + 1
+
+
+def page_lines(pages: Iterable[tuple[int, str]]) -> Iterator[tuple[str, int]]:
+    """逐页文本流 [(page_no, text), ...] 按行输出 (行, 页码)，全文不拼接。"""
+    for page_no, page_text in pages:
+        for line in (page_text or "").split("\n"):
+            yield line, page_no
+
+
+def _cut_point(text: str, start: int, end: int, min_end: int) -> int:
+    """text[start:end] 内最后一个句末（其次换行）之后的位置；不晚于 min_end 时按 end 硬切。"""
+    for marks in (SENTENCE_ENDS, ("\n",)):
+        cut = max(text.rfind(m, start, end) for m in marks)
+        if cut + 1 > min_end:
+            return cut + 1
+    return end
+
+
+def iter_chunks(
+    lines: Iterable[tuple[str, int | None]],
+    chunk_size: int = 800,
+    overlap: int = 100,
+) -> Iterator[tuple[str, dict]]:
+    """
+    (行, 页码) 流切分为 (chunk_text, meta)。meta：chunk_index、page_start/page_end、
+    heading/heading_path（chunk 内首个条款所在标题，无条款时为起始处标题）、clause_no（首个条款号）与 clause_nos（chunk 内全部条款号）。
+    """
+    overlap = max(0, min(overlap, int(chunk_size * CUT_RATIO) // 2))
+    path: list[str] = []
+    current_clause: str | None = None
+    buf: list[str] = []
+    size = 0
+    first_page = last_page = None
+    chunk_path: list[str] = []
+    clauses: list[str] = []
+    index = 0
+
+    def make(text: str) -> tuple[str, dict]:
+        nonlocal index
+        meta: dict = {"chunk_index": index}
+        if first_page is not None:
+            meta["page_start"] = first_page
+            meta["page_end"] = last_page if last_page is not None else first_page
+        if chunk_path:
+            meta["heading"] = chunk_path[-1]
+            meta["heading_path"] = list(chunk_path)
+        if clauses:
+            meta["clause_no"] = clauses[0]
+            meta["clause_nos"] = list(dict.fromkeys(clauses))
+        index += 1
+        return text, meta
+
+    for raw, page in lines:
+        line = filter_line(raw)
+        if line is None:
+            continue
+        clause = heading_clause(line)
+        if clause is not None:
+            # 条款边界：当前 chunk 足够长时在此结束，不带重叠
+            if buf and size >= chunk_size * MERGE_RATIO:
+                text = "\n".join(buf).strip()
+                if text:
+                    yield make(text)
+                buf, size = [], 0
+            _update_path(path, line)
+            current_clause = clause
+        if not buf:
+            chunk_path = list(path)
+            clauses = [current_clause] if current_clause and clause is None else []
+            first_page = page
+        if clause is not None:
+            if not clauses:
+                chunk_path = list(path)
+            clauses.append(clause)
+        buf.append(line)
+        size += len(line) + 1
+        if page is not None:
+            last_page = page
+            if first_page is None:
+                first_page = page
+
+        if size > chunk_size:
+            # 条款内超长：在句末切开，后一段带 overlap 重叠继续累积
+            text = "\n".join(buf)
+            start = 0
+            while len(text) - start > chunk_size:
+                end = _cut_point(text, start, start + chunk_size, start + int(chunk_size * CUT_RATIO))
+                piece = text[start:end].strip()
+                if piece:
+                    yield make(piece)
+                start = end - overlap
+                first_page = last_page
+                chunk_path = list(path)
+                clauses = clauses[-1:]
+            buf = [text[start:]]
+            size = len(buf[0])
+
+    if buf:
+        text = "\n".join(buf).strip()
+        if text:
+            yield make(text)
@@ -0,0 +1,184 @@
+"""
+规范知识库本地向量化（CPU、离线）：用 ONNX 格式的句向量模型（如 bge-m3 / bge-large-zh 的量化导出）
+为 kb_chunk 计算 embedding，不依赖外部 API。
+
+模型目录 KB_EMBED_MODEL_DIR 需包含 model.onnx 与 tokenizer.json（HuggingFace tokenizers 格式）。
+句向量 = 最后一层隐状态按 KB_EMBED_POOLING 池化（cls 取首个 token，bge 系列的训练方式；mean 按 attention_mask 平均）后 L2 归一化。
+写库经 COPY 进临时表再一次 UPDATE，维度在写入前与 kb_chunk.embedding 列的 vector(N) 校验。
+
+index_kb_source_task 在 celery 子进程中运行（不能再派生进程池），由 onnxruntime 的算子内多线程并行；
+回填脚本（回填知识库向量.py）在普通进程中运行，按批次分发到进程池（每次回填只建一次池，子进程启动时加载模型）。
+"""
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+import numpy as np
+
+from .. import db
+from ..services.kb_service import bump_generation
+from ..settings import settings
+
+logger = logging.getLogger(__name__)
+_schema = settings.DB_SCHEMA
+
+_session = None
+_tokenizer = None
+
+
+def _load_model():
+    """加载 ONNX 会话与分词器（每个进程一次）。"""
+    global _session, _tokenizer
+    if _session is None:
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_dir = settings.KB_EMBED_MODEL_DIR
+        opts = ort.SessionOptions()
+        if settings.KB_EMBED_THREADS > 0:
+            opts.intra_op_num_threads = settings.KB_EMBED_THREADS
+        _session = ort.InferenceSession(
+            os.path.join(model_dir, "model.onnx"), sess_options=opts, providers=["CPUExecutionProvider"]
+        )
+        tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        tokenizer.enable_truncation(max_length=settings.KB_EMBED_MAX_TOKENS)
+        tokenizer.enable_padding()
+        _tokenizer = tokenizer
+    return _session, _tokenizer
+
+
+def encode(texts: list[str]) -> np.ndarray:
+    """一批文本的句向量，形状 (len(texts), dim)，float32、已 L2 归一化。"""
+    session, tokenizer = _load_model()
+    encodings = tokenizer.encode_batch(texts)
+    input_ids = np.asarray([e.ids for e in encodings], dtype=np.int64)
+    mask = np.asarray([e.attention_mask for e in encodings], dtype=np.int64)
+    feeds = {"input_ids": input_ids, "attention_mask": mask}
+    input_names = {i.name for i in session.get_inputs()}
+    if "token_type_ids" in input_names:
+        feeds["token_type_ids"] = np.zeros_like(input_ids)
+    hidden = session.run(None, {k: v for k, v in feeds.items() if k in input_names})[0]
+    if hidden.ndim == 3:
+        if settings.KB_EMBED_POOLING == "mean":
+            weights = mask[..., None].astype(np.float32)
+            hidden = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+        else:
+            hidden = hidden[:, 0]
+    norms = np.linalg.norm(hidden, axis=1, keepdims=True)
+    return (hidden / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+
+def embed_pool(workers: int) -> ProcessPoolExecutor:
+    """推理进程池：子进程启动时加载一次模型（spawn 启动，不继承父进程已加载的 onnxruntime 会话）。"""
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=_load_model
+    )
+
+
+def embed_texts(texts: list[str], pool: Executor | None = None) -> np.ndarray:
+    """按 KB_EMBED_BATCH 分批向量化；给定 pool（见 embed_pool）时各批分发到进程池，否则在本进程执行。"""
+    size = settings.KB_EMBED_BATCH
+    batches = [texts[i : i + size] for i in range(0, len(texts), size)]
+    if not batches:
+        return np.zeros((0, settings.KB_EMBED_DIM), dtype=np.float32)
+    if pool is None or len(batches) == 1:
+        return np.vstack([encode(b) for b in batches])
+    return np.vstack(list(pool.map(encode, batches)))
+
+
+def column_dimension() -> int | None:
+    """kb_chunk.embedding 列声明的维度（pgvector 的 atttypmod）；列不存在时返回 None。"""
+    row = db.fetch_one(
+        """
+        SELECT a.atttypmod AS dim
+        FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %(schema)s AND c.relname = 'kb_chunk' AND a.attname = 'embedding' AND NOT a.attisdropped
+        """,
+        {"schema": _schema},
+    )
+    return row["dim"] if row and row["dim"] > 0 else None
+
+
+def validate_dimension() -> None:
+    """KB_EMBED_DIM 与 embedding 列维度不一致（或列不存在）时抛 ValueError。"""
+    dim = column_dimension()
+    if dim is None:
+        raise ValueError("kb_chunk.embedding 列不存在，请先执行 005 迁移")
+    if dim != settings.KB_EMBED_DIM:
+        raise ValueError(f"KB_EMBED_DIM={settings.KB_EMBED_DIM} 与 kb_chunk.embedding vector({dim}) 不一致")
+
+
+def _vector_literal(vec: np.ndarray) -> str:
+    return "[" + ",".join(f"{x:.6f}" for x in vec.tolist()) + "]"
+
+
+def write_embeddings(ids: list[int], vectors: np.ndarray) -> int:
+    """COPY 写入临时表后一次 UPDATE kb_chunk.embedding，返回更新行数。"""
+    if not ids:
+        return 0
+    if vectors.shape[1] != settings.KB_EMBED_DIM:
+        raise ValueError(f"模型输出维度 {vectors.shape[1]} 与 KB_EMBED_DIM={settings.KB_EMBED_DIM} 不一致")
+    with db.pool.connection() as conn:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"CREATE TEMP TABLE _kb_embedding (id bigint, embedding vector({settings.KB_EMBED_DIM})) ON COMMIT DROP"
+                )
+                with cur.copy("COPY _kb_embedding (id, embedding) FROM STDIN") as copy:
+                    for chunk_id, vec in zip(ids, vectors):
+                        copy.write_row((chunk_id, _vector_literal(vec)))
+                cur.execute(
+                    f"""
+                    UPDATE {_schema}.kb_chunk c SET embedding = e.embedding, updated_at = now()
+                    FROM _kb_embedding e WHERE c.id = e.id
+                    """
+                )
+                return cur.rowcount
+
+
+def pending_chunks(source_id: int | None = None, after_id: int = 0, limit: int = 1000) -> list[dict]:
+    """尚无 embedding 的 chunk（按 id 分页）；source_id 为空时为全部知识库。"""
+    where = ["c.embedding IS NULL", "c.id > %(after_id)s"]
+    params = {"after_id": after_id, "limit": limit}
+    if source_id is not None:
+        where.append("c.kb_source_id = %(source_id)s")
+        params["source_id"] = source_id
+    return db.fetch_all(
+        f"""
+        SELECT c.id, c.chunk_text FROM {_schema}.kb_chunk c
+        WHERE {' AND '.join(where)}
+        ORDER BY c.id
+        LIMIT %(limit)s
+        """,
+        params,
+    )
+
+
+def embed_pending(source_id: int | None = None, workers: int = 1, page_size: int = 1000, on_progress=None) -> int:
+    """
+    为尚无 embedding 的 chunk 计算并写入向量，返回写入条数；on_progress(已写入条数) 每页回调一次。
+    workers > 1 时整个回填共用一个进程池，模型在各子进程中只加载一次。
+    """
+    validate_dimension()
+    total, after_id = 0, 0
+    pool = embed_pool(workers) if workers > 1 else None
+    try:
+        while True:
+            rows = pending_chunks(source_id, after_id, page_size)
+            if not rows:
+                break
+            after_id = rows[-1]["id"]
+            vectors = embed_texts([r["chunk_text"] for r in rows], pool)
+            total += write_embeddings([r["id"] for r in rows], vectors)
+            if on_progress:
+                on_progress(total)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    if total:
+        # 向量检索结果变化，检索缓存失效
+        bump_generation()
+    return total
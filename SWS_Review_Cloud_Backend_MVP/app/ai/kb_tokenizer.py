@@ -0,0 +1,34 @@
+"""
+知识库检索分词：中文按相邻字二元组（bigram）切分，英文/数字按词（小写），条款号与标准号整体保留（如 5.2.3、gb50433-2018）。
+入库时写入 kb_chunk.search_terms（空格分隔，由 to_tsvector('simple', ...) 建全文索引），查询时用同样的切分。
+"""
+import re
+
+_TOKEN_RE = re.compile(r"[一-鿿]+|[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+_CJK_RE = re.compile(r"[一-鿿]")
+
+
+def tokenize(text: str) -> list[str]:
+    """文本切分为检索词（保留重复，供词频统计）。"""
+    tokens = []
+    for m in _TOKEN_RE.finditer((text or "").lower()):
+        run = m.group(0)
+        if _CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def query_terms(query: str, limit: int = 32) -> list[str]:
+    """查询词：去重后保持出现顺序，最多 limit 个。"""
+    return list(dict.fromkeys(tokenize(query)))[:limit]
+
+
+def search_terms(text: str) -> tuple[str, int]:
+    """入库用：(空格分隔的检索词, 词数)。"""
+    tokens = tokenize(text)
+    return " ".join(tokens), len(tokens)
@@ -0,0 +1,312 @@
+"""
+本地 Mock LLM 服务（OpenAI 兼容 /chat/completions），用于 AI 审查压测与回放，不消耗 DashScope 额度。
+
+启动：
+    python -m uvicorn app.ai.mock_llm:app --port 8001
+并在 .env 中设置：
+    DASHSCOPE_BASE=http://localhost:8001/v1
+    QWEN_API_KEY=mock
+
+模式（环境变量 MOCK_LLM_MODE）：
+- synth：按请求中的本批规则 ID 与文档 [block_id=xx][page=N] 段落，合成符合“规则校验结果”结构的返回
+- replay：按请求 messages 的哈希从 MOCK_LLM_DATA_DIR 读取录制的返回；未录制的请求回退为 synth
+- record：转发到 MOCK_LLM_UPSTREAM（真实 DashScope）并把返回写入 MOCK_LLM_DATA_DIR，供之后 replay
+
+其余环境变量：
+- MOCK_LLM_LATENCY_MEDIAN 首字节前延迟中位数（秒，对数正态分布），默认 2.0
+- MOCK_LLM_LATENCY_SIGMA 对数正态 sigma，默认 0.5
+- MOCK_LLM_RATE_429 返回 429 的概率，默认 0
+- MOCK_LLM_RATE_MALFORMED 返回非法 JSON（截断）的概率，默认 0
+- MOCK_LLM_ISSUES_PER_RULE 合成时每条规则的平均问题数，默认 0.5
+- MOCK_LLM_SEED 随机种子，默认 0（同一请求 + 同一种子 → 同一返回，便于确定性回放）
+
+前缀缓存模拟：同一进程内再次出现相同的“系统提示 + 文档前缀”（显式 cache_control 段，
+或“【本批校验规则】”之前的文本）时，usage.prompt_tokens_details.cached_tokens 返回该前缀的 token 数。
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+MODE = os.getenv("MOCK_LLM_MODE", "synth")
+DATA_DIR = Path(os.getenv("MOCK_LLM_DATA_DIR", "mock_llm_data"))
+UPSTREAM = os.getenv("MOCK_LLM_UPSTREAM", "https://dashscope.aliyuncs.com/compatible-mode/v1")
+LATENCY_MEDIAN = float(os.getenv("MOCK_LLM_LATENCY_MEDIAN", "2.0"))
+LATENCY_SIGMA = float(os.getenv("MOCK_LLM_LATENCY_SIGMA", "0.5"))
+RATE_429 = float(os.getenv("MOCK_LLM_RATE_429", "0"))
+RATE_MALFORMED = float(os.getenv("MOCK_LLM_RATE_MALFORMED", "0"))
+ISSUES_PER_RULE = float(os.getenv("MOCK_LLM_ISSUES_PER_RULE", "0.5"))
+SEED = int(os.getenv("MOCK_LLM_SEED", "0"))
+
+# 流式返回时每个 delta 的字符数与间隔（秒）
+STREAM_CHUNK_CHARS = 40
+STREAM_CHUNK_DELAY = 0.02
+
+_RULE_IDS_RE = re.compile(r"规则 ID 列表：([^\n]+)")
+_BATCH_MARKER = "【本批校验规则】"
+_BLOCK_RE = re.compile(r"\[block_id=(\d+)\]\[page=(\d+)\]\n([^\n]+)")
+
+ISSUE_TYPES = ["一致性", "格式", "表内计算", "业务逻辑", "规范引用", "信息缺失", "标点", "单位不一致"]
+SEVERITIES = ["致命", "高", "中", "低"]
+
+app = FastAPI(title="Mock LLM (OpenAI compatible)")
+
+_stats_lock = threading.Lock()
+_stats = {
+    "requests": 0,
+    "stream_requests": 0,
+    "rate_limited": 0,
+    "malformed": 0,
+    "replayed": 0,
+    "recorded": 0,
+    "synthesized": 0,
+    "prompt_chars": 0,
+    "completion_chars": 0,
+    "cached_prompt_chars": 0,
+    "started_at": time.time(),
+}
+_prefix_seen: set[str] = set()
+
+
+def _bump(key: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats[key] += n
+
+
+def _text(content) -> str:
+    """消息 content 可能是字符串或 [{type: text, text, cache_control?}] 内容段列表。"""
+    if isinstance(content, list):
+        return "".join(p.get("text") or "" for p in content if isinstance(p, dict))
+    return content or ""
+
+
+def _cache_prefix(messages: list[dict]) -> str:
+    """可缓存前缀：系统提示 + 显式 cache_control 内容段；无显式标注时取批次标记之前的文本。"""
+    parts = []
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, list):
+            marked = [p.get("text") or "" for p in content if isinstance(p, dict) and p.get("cache_control")]
+            parts.extend(marked)
+            if len(marked) < len(content):
+                break
+        else:
+            text = content or ""
+            idx = text.find(_BATCH_MARKER)
+            parts.append(text if idx < 0 else text[:idx])
+            if idx >= 0:
+                break
+    return "".join(parts)
+
+
+def _request_key(messages: list[dict]) -> str:
+    """请求指纹：只看 messages，便于跨模型回放同一批规则。"""
+    raw = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _rng(key: str) -> random.Random:
+    return random.Random(f"{SEED}:{key}")
+
+
+def _synthesize(messages: list[dict], rng: random.Random) -> dict:
+    """按本批规则与文档段落合成结构合法的规则校验结果。"""
+    user = next((_text(m.get("content")) for m in reversed(messages) if m.get("role") == "user"), "")
+    m = _RULE_IDS_RE.search(user)
+    rule_ids = [r.strip() for r in m.group(1).split(",") if r.strip()] if m else []
+    blocks = _BLOCK_RE.findall(user)
+    issues = []
+    for rule_id in rule_ids:
+        # 泊松近似：每条规则命中 0..n 个问题
+        n = 0
+        threshold, p = math.exp(-ISSUES_PER_RULE), 1.0
+        while True:
+            p *= rng.random()
+            if p <= threshold:
+                break
+            n += 1
+        for _ in range(n):
+            if blocks:
+                block_id, page, text = rng.choice(blocks)
+                start = rng.randrange(0, max(1, len(text) - 20))
+                snippet = text[start : start + 30]
+            else:
+                block_id, page, snippet = "0", "1", ""
+            issues.append({
+                "issue_id": len(issues) + 1,
+                "issue_title": f"{rule_id} 校验发现问题",
+                "issue_type": rng.choice(ISSUE_TYPES),
+                "severity": rng.choice(SEVERITIES),
+                "location": {"section": "", "page": int(page), "anchor_text": snippet},
+                "evidence": {"snippets": [snippet], "page_refs": [int(page)]},
+                "rule_definition": {
+                    "rule_id": rule_id,
+                    "rule_name": rule_id,
+                    "rule_logic": "mock",
+                    "can_auto_check": True,
+                    "auto_check_method": "mock",
+                },
+                "norm_basis": {"doc": "-", "clause_or_section": "-", "basis_text": "-"},
+                "fix_suggestion": {"suggested_text": "按规范修改", "fix_steps": ["核对原文"], "verification_after_fix": []},
+                "dependencies": [],
+            })
+    return {
+        "规则校验结果": issues,
+        "规则库沉淀清单": [{"rule_id": r, "rule_summary": "mock"} for r in rule_ids],
+    }
+
+
+def _load_replay(key: str) -> str | None:
+    path = DATA_DIR / f"{key}.json"
+    if not path.is_file():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))["content"]
+
+
+def _save_record(key: str, messages: list[dict], content: str) -> None:
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    path = DATA_DIR / f"{key}.json"
+    path.write_text(json.dumps({"messages": messages, "content": content}, ensure_ascii=False), encoding="utf-8")
+
+
+async def _record_upstream(body: dict, authorization: str) -> str:
+    upstream_body = {k: v for k, v in body.items() if k != "stream"}
+    async with httpx.AsyncClient(timeout=300.0) as client:
+        r = await client.post(
+            f"{UPSTREAM}/chat/completions",
+            headers={"Authorization": authorization},
+            json=upstream_body,
+        )
+        r.raise_for_status()
+        data = r.json()
+    return data.get("choices", [{}])[0].get("message", {}).get("content", "")
+
+
+def _usage(messages: list[dict], content: str, cached_chars: int = 0) -> dict:
+    # 粗略按 1.5 字符/token 估算，足够用于压测统计
+    prompt_tokens = int(sum(len(_text(m.get("content"))) for m in messages) / 1.5)
+    completion_tokens = int(len(content) / 1.5)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": int(cached_chars / 1.5)},
+    }
+
+
+@app.post("/v1/chat/completions")
+@app.post("/compatible-mode/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body.get("messages") or []
+    model = body.get("model") or "mock"
+    stream = bool(body.get("stream"))
+    key = _request_key(messages)
+    # 每次请求独立随机：同一请求的多次重试可能得到不同的 429/截断结果
+    with _stats_lock:
+        _stats["requests"] += 1
+        nth = _stats["requests"]
+    rng = _rng(f"{key}:{nth}")
+    if stream:
+        _bump("stream_requests")
+    _bump("prompt_chars", sum(len(_text(m.get("content"))) for m in messages))
+    prefix = _cache_prefix(messages)
+    prefix_key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+    with _stats_lock:
+        cached_chars = len(prefix) if prefix_key in _prefix_seen else 0
+        _prefix_seen.add(prefix_key)
+        _stats["cached_prompt_chars"] += cached_chars
+
+    await asyncio.sleep(rng.lognormvariate(math.log(max(LATENCY_MEDIAN, 1e-3)), LATENCY_SIGMA))
+
+    if rng.random() < RATE_429:
+        _bump("rate_limited")
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "Requests rate limit exceeded (mock)", "type": "rate_limit"}},
+        )
+
+    content = None
+    if MODE in ("replay", "record"):
+        content = _load_replay(key)
+        if content is not None:
+            _bump("replayed")
+        elif MODE == "record":
+            content = await _record_upstream(body, request.headers.get("authorization", ""))
+            _save_record(key, messages, content)
+            _bump("recorded")
+    if content is None:
+        content = json.dumps(_synthesize(messages, _rng(key)), ensure_ascii=False)
+        _bump("synthesized")
+
+    if rng.random() < RATE_MALFORMED:
+        _bump("malformed")
+        content = content[: max(1, int(len(content) * rng.uniform(0.3, 0.9)))]
+
+    _bump("completion_chars", len(content))
+    usage = _usage(messages, content, cached_chars)
+    created = int(time.time())
+    completion_id = f"chatcmpl-mock-{key[:12]}-{nth}"
+
+    if not stream:
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    async def events():
+        for i in range(0, len(content), STREAM_CHUNK_CHARS):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": content[i : i + STREAM_CHUNK_CHARS]}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(STREAM_CHUNK_DELAY)
+        final = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+        yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+def get_stats():
+    with _stats_lock:
+        data = dict(_stats)
+    data["uptime_seconds"] = round(time.time() - data.pop("started_at"), 3)
+    data["mode"] = MODE
+    return data
+
+
+@app.post("/stats/reset")
+def reset_stats():
+    with _stats_lock:
+        for k in _stats:
+            _stats[k] = 0
+        _stats["started_at"] = time.time()
+        _prefix_seen.clear()
+    return {"ok": True}
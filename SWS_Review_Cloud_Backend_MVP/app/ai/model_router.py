@@ -0,0 +1,102 @@
+"""
+规则批次的模型路由：按规则 compare.mode / review_type / priority 选择小模型或大模型。
+- 格式、标点、正则、单位写法等模式化规则 -> 小模型（低延迟、低成本）
+- ai_gap_check、业务逻辑、公式/交叉核对及高优先级规则 -> 大模型
+小模型返回非法 JSON 或低置信度结果时，由调用方升级到大模型重跑本批（见 output_problem）。
+未配置 QWEN_MODEL_SMALL 时全部使用 QWEN_MODEL。
+"""
+from ..settings import settings
+
+TIER_SMALL = "small"
+TIER_LARGE = "large"
+
+# 模式化、可由小模型可靠完成的校验模式
+SMALL_MODES = frozenset({
+    "regex_match",
+    "regex_not_match",
+    "forbidden_token",
+    "punctuation_check",
+    "unit_check",
+    "missing_section_check",
+})
+# 需要语义理解或跨表推理的校验模式
+LARGE_MODES = frozenset({
+    "ai_gap_check",
+    "formula_balance_check",
+    "key_field_crosscheck",
+    "catalog_match",
+    "sum_check",
+})
+# 需要大模型的 review_type 前缀
+LARGE_REVIEW_TYPE_PREFIXES = ("BUSINESS_LOGIC", "AI_COMPLIANCE_GAP", "FORMULA")
+
+
+def rule_tier(rule: dict) -> str:
+    """单条规则应使用的模型档位。"""
+    if not settings.QWEN_MODEL_SMALL:
+        return TIER_LARGE
+    mode = (rule.get("compare") or {}).get("mode")
+    review_type = rule.get("review_type") or ""
+    if mode in LARGE_MODES or review_type.startswith(LARGE_REVIEW_TYPE_PREFIXES):
+        return TIER_LARGE
+    try:
+        priority = int(rule.get("priority") or 0)
+    except (TypeError, ValueError):
+        priority = 0
+    if priority >= settings.AI_ROUTE_LARGE_PRIORITY:
+        return TIER_LARGE
+    return TIER_SMALL if mode in SMALL_MODES or review_type in ("FORMAT", "CONTENT") else TIER_LARGE
+
+
+def tier_model(tier: str) -> str:
+    if tier == TIER_SMALL and settings.QWEN_MODEL_SMALL:
+        return settings.QWEN_MODEL_SMALL
+    return settings.QWEN_MODEL
+
+
+def batch_tier(rules_batch: list[dict]) -> str:
+    """一批中只要有一条规则需要大模型，整批走大模型。"""
+    return TIER_LARGE if any(rule_tier(r) == TIER_LARGE for r in rules_batch) else TIER_SMALL
+
+
+def split_by_tier(rules: list[dict]) -> dict[str, list[dict]]:
+    tiers: dict[str, list[dict]] = {}
+    for r in rules:
+        tiers.setdefault(rule_tier(r), []).append(r)
+    return tiers
+
+
+def output_problem(out, rules_batch: list[dict], issues_key: str) -> str | None:
+    """
+    检查小模型输出是否需要升级到大模型：结构不对、引用了本批以外的规则、
+    关键字段缺失的条目过多，或自评置信度（confidence）均值低于 AI_ESCALATE_MIN_CONFIDENCE。
+    返回问题描述，合格时返回 None。
+    """
+    if not isinstance(out, dict):
+        return "输出不是 JSON 对象"
+    items = out.get(issues_key)
+    if items is None:
+        items = out.get("issues")
+    if not isinstance(items, list):
+        return f"缺少数组 {issues_key}"
+    if not items:
+        return None
+    batch_ids = {r.get("rule_id") for r in rules_batch}
+    bad = 0
+    confidences = []
+    for item in items:
+        if not isinstance(item, dict):
+            bad += 1
+            continue
+        rule_id = (item.get("rule_definition") or {}).get("rule_id")
+        snippets = (item.get("evidence") or {}).get("snippets")
+        if rule_id not in batch_ids or not item.get("issue_title") or not snippets:
+            bad += 1
+        conf = item.get("confidence")
+        if isinstance(conf, (int, float)):
+            confidences.append(float(conf))
+    if bad * 2 > len(items):
+        return f"{bad}/{len(items)} 条结果缺少规则 ID、标题或证据"
+    if confidences and sum(confidences) / len(confidences) < settings.AI_ESCALATE_MIN_CONFIDENCE:
+        return f"平均置信度 {sum(confidences) / len(confidences):.2f} 过低"
+    return None
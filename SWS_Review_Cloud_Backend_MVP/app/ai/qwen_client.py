@@ -1,12 +1,53 @@
 import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
 import httpx
 from ..settings import settings
+from ..utils.cancellation import RUN, Canceled, is_canceled, raise_if_canceled
+from . import telemetry
+from .stream_json import IncrementalArrayParser
 
-DASHSCOPE_BASE = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+DASHSCOPE_BASE = settings.DASHSCOPE_BASE.rstrip("/")
 
 
 # 单次请求超时（秒），大文档+多规则时适当放宽
 CHAT_TIMEOUT = 120.0
+# 请求进行中检查所属审查运行是否被取消的间隔（秒）
+CANCEL_POLL_SECONDS = 0.5
+
+
+@contextmanager
+def _abort_on_cancel(client: httpx.Client):
+    """
+    当前线程所属审查运行（telemetry.call_context 的 run_id）被取消时关闭连接，
+    中断进行中的请求（流式与非流式均可），并以 Canceled 抛出。
+    """
+    run_id = (telemetry.current_context() or {}).get("run_id")
+    if run_id is None:
+        yield
+        return
+    raise_if_canceled(RUN, run_id)
+    done = threading.Event()
+    canceled = threading.Event()
+
+    def _watch():
+        while not done.wait(CANCEL_POLL_SECONDS):
+            if is_canceled(RUN, run_id):
+                canceled.set()
+                client.close()
+                return
+
+    threading.Thread(target=_watch, daemon=True).start()
+    try:
+        yield
+    except Exception as e:
+        if canceled.is_set():
+            raise Canceled(f"审查运行 {run_id} 已取消，中断 AI 请求") from e
+        raise
+    finally:
+        done.set()
 
 
 def chat_completion(messages: list[dict], model: str | None = None, response_format: dict | None = None) -> str:
@@ -17,18 +58,30 @@ def chat_completion(messages: list[dict], model: str | None = None, response_for
     body = {"model": model, "messages": messages}
     if response_format:
         body["response_format"] = response_format
-    with httpx.Client(timeout=CHAT_TIMEOUT) as client:
-        r = client.post(
-            f"{DASHSCOPE_BASE}/chat/completions",
-            headers={"Authorization": f"Bearer {settings.QWEN_API_KEY}"},
-            json=body,
-        )
-        r.raise_for_status()
-        data = r.json()
+    t0 = time.perf_counter()
+    status = None
+    try:
+        with httpx.Client(timeout=CHAT_TIMEOUT) as client, _abort_on_cancel(client):
+            r = client.post(
+                f"{DASHSCOPE_BASE}/chat/completions",
+                headers={"Authorization": f"Bearer {settings.QWEN_API_KEY}"},
+                json=body,
+            )
+            status = r.status_code
+            r.raise_for_status()
+            data = r.json()
+    except Exception as e:
+        telemetry.record_call(model, False, _elapsed_ms(t0), status, None, error=str(e))
+        raise
+    telemetry.record_call(data.get("model") or model, False, _elapsed_ms(t0), status, data.get("usage"))
     content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
     return content
 
 
+def _elapsed_ms(t0: float) -> int:
+    return int((time.perf_counter() - t0) * 1000)
+
+
 def chat_json(messages: list[dict], model: str | None = None) -> dict:
     """Call Qwen and parse response as JSON. Retries once on parse error."""
     content = chat_completion(messages, model=model, response_format={"type": "json_object"})
@@ -37,3 +90,72 @@ def chat_json(messages: list[dict], model: str | None = None) -> dict:
     except json.JSONDecodeError:
         content2 = chat_completion(messages, model=model)
         return json.loads(content2)
+
+
+def chat_completion_stream(messages: list[dict], model: str | None = None, response_format: dict | None = None) -> Iterator[str]:
+    """Call Qwen chat API with stream=true. Yields content deltas as they arrive (SSE)."""
+    if not settings.QWEN_API_KEY:
+        raise ValueError("QWEN_API_KEY not set")
+    model = model or settings.QWEN_MODEL
+    body = {"model": model, "messages": messages, "stream": True, "stream_options": {"include_usage": True}}
+    if response_format:
+        body["response_format"] = response_format
+    t0 = time.perf_counter()
+    status = None
+    usage = None
+    resp_model = model
+    try:
+        with httpx.Client(timeout=CHAT_TIMEOUT) as client, _abort_on_cancel(client):
+            with client.stream(
+                "POST",
+                f"{DASHSCOPE_BASE}/chat/completions",
+                headers={"Authorization": f"Bearer {settings.QWEN_API_KEY}"},
+                json=body,
+            ) as r:
+                status = r.status_code
+                r.raise_for_status()
+                for line in r.iter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line[5:].strip()
+                    if payload == "[DONE]":
+                        break
+                    try:
+                        data = json.loads(payload)
+                    except json.JSONDecodeError:
+                        continue
+                    # include_usage 时最后一个 chunk 携带 usage（choices 可能为空）
+                    if data.get("usage"):
+                        usage = data["usage"]
+                    resp_model = data.get("model") or resp_model
+                    delta = (data.get("choices") or [{}])[0].get("delta") or {}
+                    content = delta.get("content")
+                    if content:
+                        yield content
+    except Exception as e:
+        telemetry.record_call(resp_model, True, _elapsed_ms(t0), status, usage, error=str(e))
+        raise
+    telemetry.record_call(resp_model, True, _elapsed_ms(t0), status, usage)
+
+
+def chat_json_stream(messages: list[dict], array_key: str, on_item: Callable[[dict], None], model: str | None = None) -> dict:
+    """
+    流式调用 Qwen 并增量解析：array_key 数组中的每个对象一旦完整即回调 on_item。
+    流结束后整体解析返回完整 JSON；若整体解析失败但已输出过元素，则以已输出元素兜底，
+    避免已落库的部分结果被整批重试。
+    """
+    items: list[dict] = []
+
+    def _collect(item: dict) -> None:
+        items.append(item)
+        on_item(item)
+
+    parser = IncrementalArrayParser(array_key, _collect)
+    for delta in chat_completion_stream(messages, model=model, response_format={"type": "json_object"}):
+        parser.feed(delta)
+    try:
+        return json.loads(parser.text)
+    except json.JSONDecodeError:
+        if items:
+            return {array_key: items}
+        raise
@@ -1,11 +1,314 @@
+"""
+规范知识库检索（混合检索）：
+- 词法：优先使用 worker 进程内的 BM25 索引（kb_bm25，mmap，不访问数据库）；索引未发布时由 kb_chunk 全文索引
+  （search_tsv，GIN）召回候选，按 BM25 重新打分排序。018 迁移未执行时退回 ILIKE 子串匹配（无排序）。
+- 向量：KB_EMBED_ENABLED 时查询经本地模型向量化，按 pgvector 余弦距离取 top-k。
+两路并行检索后按倒数排名融合（RRF）排序。
+结果两级缓存：进程内 LRU + Redis（KB_CACHE_TTL），键为知识库代号 + 本地索引版本 + 规范化查询 + 过滤条件；
+kb_source 状态变化或写入向量时代号加一（kb_service.bump_generation），旧缓存不再命中。
+审查运行开始时按规则预取条文检索（prefetch_rule_refs），批次执行时直接命中缓存。
+"""
+import hashlib
+import json
+import logging
+import math
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 from .. import db
 from ..settings import settings
+from ..services import kb_service, vector_index_service
+from ..utils.redis_client import get_redis
+from ..services.kb_service import kb_chunk_columns
+from . import kb_bm25
+from .kb_tokenizer import query_terms
 
 _schema = settings.DB_SCHEMA
+logger = logging.getLogger(__name__)
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 全文索引召回的候选数（再按 BM25 取 top_k）
+CANDIDATE_MULTIPLIER = 20
+MIN_CANDIDATES = 200
+# 语料统计（文档数、平均长度）缓存时长（秒）
+STATS_TTL = 300
+# 每条结果返回的命中区间上限
+MAX_HIGHLIGHTS = 20
+# RRF 常数：score = Σ 1 / (RRF_K + rank)
+RRF_K = 60
+# 每路召回数 = max(top_k * FUSION_DEPTH, MIN_FUSION_CANDIDATES)
+FUSION_DEPTH = 4
+MIN_FUSION_CANDIDATES = 20
+# 进程内查询结果缓存：条数上限与有效期（秒）；Redis 层有效期见 KB_CACHE_TTL
+CACHE_SIZE = 2048
+CACHE_TTL = 300
+
+_CACHE_PREFIX = "sws:kb:q"
+
+# 单次检索内的词法 / 向量两路并行；池内任务不得再等待本池的 future（会占满线程互相等待）
+_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="kb-search")
+# 运行开始时的批量预取：每个任务是一次完整检索（内部再向 _pool 提交两路召回），须用独立的池
+_prefetch_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="kb-prefetch")
+_cache: OrderedDict = OrderedDict()
+_cache_lock = threading.Lock()
+_typed_ids: dict[tuple[str, str], set[int]] = {}
+
+_stats: tuple[float, int, float] | None = None
+_stats_lock = threading.Lock()
+
+
+def normalize_query(query: str) -> str:
+    """缓存键用的规范化查询：NFKC（全角转半角）、小写、合并空白。"""
+    return " ".join(unicodedata.normalize("NFKC", query or "").lower().split())
+
+
+def search_chunks(
+    query: str,
+    top_k: int = 10,
+    kb_source_ids: list[int] | None = None,
+    kb_type: str | None = None,
+) -> list[dict]:
+    """
+    混合检索规范 chunk，按 RRF 融合分数降序返回 top_k 条：
+    {id, kb_source_id, chunk_text, meta_json, hash, score, lexical_rank, vector_rank, highlights}，
+    highlights 为 chunk_text 内的 [start, end) 区间；kb_type 过滤知识库类型（如 NORM）。
+    """
+    query = normalize_query(query)
+    if not query:
+        return []
+    index = kb_bm25.get_index()
+    key = (
+        kb_service.kb_generation(),
+        index.version if index is not None else "",
+        query,
+        top_k,
+        tuple(sorted(kb_source_ids or [])),
+        kb_type,
+    )
+    now = time.monotonic()
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit is not None and now - hit[0] < CACHE_TTL:
+            _cache.move_to_end(key)
+            return [dict(r) for r in hit[1]]
+    results = _shared_get(key)
+    if results is None:
+        results = _hybrid_search(query, top_k, kb_source_ids, kb_type)
+        _shared_set(key, results)
+    with _cache_lock:
+        _cache[key] = (now, results)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return [dict(r) for r in results]
+
+
+def _shared_key(key: tuple) -> str:
+    digest = hashlib.sha1(json.dumps(key[2:], ensure_ascii=False).encode("utf-8")).hexdigest()
+    return f"{_CACHE_PREFIX}:{key[0]}:{key[1]}:{digest}"
+
+
+def _shared_get(key: tuple) -> list[dict] | None:
+    """Redis 层缓存；未命中或 Redis 不可用时返回 None。"""
+    if settings.KB_CACHE_TTL <= 0:
+        return None
+    try:
+        raw = get_redis().get(_shared_key(key))
+    except Exception as e:
+        logger.debug(f"读取检索缓存失败: {e}")
+        return None
+    return json.loads(raw) if raw else None
 
 
-def search_chunks(query: str, top_k: int = 10, kb_source_ids: list[int] | None = None) -> list[dict]:
-    """Simple text search on kb_chunk (LIKE). MVP: no embedding."""
+def _shared_set(key: tuple, results: list[dict]) -> None:
+    if settings.KB_CACHE_TTL <= 0:
+        return
+    try:
+        get_redis().set(_shared_key(key), json.dumps(results, ensure_ascii=False, default=str), ex=settings.KB_CACHE_TTL)
+    except Exception as e:
+        logger.debug(f"写入检索缓存失败: {e}")
+
+
+def _typed_source_ids(kb_type: str | None) -> set[int]:
+    """指定类型（为空时不限类型）的 READY 知识库 ID（按知识库代号在进程内缓存）。"""
+    key = (kb_service.kb_generation(), kb_type)
+    ids = _typed_ids.get(key)
+    if ids is None:
+        ids = set(kb_service.list_source_ids(kb_type))
+        with _cache_lock:
+            # 代号变化后旧条目不再使用
+            for k in [k for k in _typed_ids if k[0] != key[0]]:
+                del _typed_ids[k]
+            _typed_ids[key] = ids
+    return ids
+
+
+def _hybrid_search(query: str, top_k: int, kb_source_ids: list[int] | None, kb_type: str | None) -> list[dict]:
+    if kb_type:
+        typed = _typed_source_ids(kb_type)
+        kb_source_ids = [i for i in kb_source_ids if i in typed] if kb_source_ids else sorted(typed)
+        if not kb_source_ids:
+            return []
+    depth = max(top_k * FUSION_DEPTH, MIN_FUSION_CANDIDATES)
+    lexical_f = _pool.submit(lexical_search, query, depth, kb_source_ids)
+    vector_f = _pool.submit(vector_search, query, depth, kb_source_ids) if settings.KB_EMBED_ENABLED else None
+    lexical = lexical_f.result()
+    vector = []
+    if vector_f is not None:
+        try:
+            vector = vector_f.result()
+        except Exception as e:
+            logger.warning(f"向量检索失败，仅用词法结果: {e}")
+    return fuse(lexical, vector, top_k, query_terms(query))
+
+
+def fuse(lexical: list[dict], vector: list[dict], top_k: int, terms: list[str]) -> list[dict]:
+    """倒数排名融合：两路结果按 id 合并，score = Σ 1 / (RRF_K + 名次)。"""
+    merged: dict[int, dict] = {}
+    for field, hits in (("lexical_rank", lexical), ("vector_rank", vector)):
+        for rank, hit in enumerate(hits, start=1):
+            row = merged.setdefault(
+                hit["id"], {**hit, "score": 0.0, "lexical_rank": None, "vector_rank": None}
+            )
+            row[field] = rank
+            row["score"] += 1 / (RRF_K + rank)
+    results = sorted(merged.values(), key=lambda r: r["score"], reverse=True)[:top_k]
+    for r in results:
+        r["score"] = round(r["score"], 6)
+        r.pop("distance", None)
+        if "highlights" not in r:
+            r["highlights"] = highlight_spans(r["chunk_text"], terms)
+    return results
+
+
+def vector_search(query: str, top_k: int, kb_source_ids: list[int] | None = None) -> list[dict]:
+    """
+    查询经本地模型向量化后按余弦距离检索（pgvector），返回带 distance 的结果；
+    索引参数（ef_search / probes）按 KB_VECTOR_LATENCY_MS 预算设置，见 vector_index_service。
+    """
+    from .kb_embedding import encode
+
+    vec = encode([query])[0]
+    return vector_index_service.search("[" + ",".join(f"{x:.6f}" for x in vec.tolist()) + "]", top_k, kb_source_ids)
+
+
+def lexical_search(query: str, top_k: int = 10, kb_source_ids: list[int] | None = None) -> list[dict]:
+    """
+    词法检索，按 BM25 分数降序返回 top_k 条：
+    {id, kb_source_id, chunk_text, meta_json, hash, score, highlights}。
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+    index = kb_bm25.get_index()
+    if index is not None:
+        # 索引在知识库状态变化后异步重建、各进程按间隔换版本，期间命中限定在当前 READY 的知识库
+        ready = _typed_source_ids(None)
+        kb_source_ids = [i for i in kb_source_ids if i in ready] if kb_source_ids else sorted(ready)
+        if not kb_source_ids:
+            return []
+        results = index.search(query, top_k, kb_source_ids)
+        for c in results:
+            c["highlights"] = highlight_spans(c["chunk_text"], terms)
+        return results
+    if "search_tsv" not in kb_chunk_columns():
+        return _search_chunks_like(query, top_k, kb_source_ids)
+
+    where = ["c.search_tsv @@ q.tsq"]
+    params = {
+        "q": " or ".join(terms),
+        "limit": max(top_k * CANDIDATE_MULTIPLIER, MIN_CANDIDATES),
+    }
+    if kb_source_ids:
+        where.append("c.kb_source_id = ANY(%(ids)s)")
+        params["ids"] = kb_source_ids
+    sql = f"""
+    SELECT c.id, c.kb_source_id, c.chunk_text, c.meta_json, c.hash, c.search_terms, c.term_count
+    FROM {_schema}.kb_chunk c
+    JOIN {_schema}.kb_source s ON s.id = c.kb_source_id AND s.status = 'READY'
+    CROSS JOIN websearch_to_tsquery('simple', %(q)s) AS q(tsq)
+    WHERE {' AND '.join(where)}
+    ORDER BY ts_rank_cd(c.search_tsv, q.tsq) DESC
+    LIMIT %(limit)s
+    """
+    candidates = db.fetch_all(sql, params)
+    if not candidates:
+        return []
+
+    n_docs, avgdl = _corpus_stats()
+    df = _document_frequencies(terms)
+    idf = {t: math.log(1 + (n_docs - df.get(t, 0) + 0.5) / (df.get(t, 0) + 0.5)) for t in terms}
+    for c in candidates:
+        tf = Counter((c.pop("search_terms") or "").split())
+        dl = c.pop("term_count") or sum(tf.values()) or 1
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * dl / (avgdl or dl))
+        c["score"] = round(
+            sum(idf[t] * tf[t] * (BM25_K1 + 1) / (tf[t] + norm) for t in terms if tf.get(t)), 4
+        )
+    candidates.sort(key=lambda c: c["score"], reverse=True)
+    results = candidates[:top_k]
+    for c in results:
+        c["highlights"] = highlight_spans(c["chunk_text"], terms)
+    return results
+
+
+def highlight_spans(text: str, terms: list[str]) -> list[list[int]]:
+    """查询词在原文中的命中区间（相邻 bigram 合并为一段），按位置排序。"""
+    lower = (text or "").lower()
+    spans = []
+    for t in terms:
+        start = lower.find(t)
+        while start >= 0:
+            spans.append((start, start + len(t)))
+            start = lower.find(t, start + 1)
+    merged: list[list[int]] = []
+    for s, e in sorted(spans):
+        if merged and s <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], e)
+        else:
+            merged.append([s, e])
+    return merged[:MAX_HIGHLIGHTS]
+
+
+def _corpus_stats() -> tuple[int, float]:
+    """READY 知识库的 chunk 数与平均检索词数（进程内缓存 STATS_TTL 秒）。"""
+    global _stats
+    now = time.monotonic()
+    if _stats is None or now - _stats[0] > STATS_TTL:
+        with _stats_lock:
+            if _stats is None or now - _stats[0] > STATS_TTL:
+                row = db.fetch_one(
+                    f"""
+                    SELECT count(*) AS n, avg(c.term_count) AS avgdl
+                    FROM {_schema}.kb_chunk c
+                    JOIN {_schema}.kb_source s ON s.id = c.kb_source_id AND s.status = 'READY'
+                    """
+                ) or {}
+                _stats = (now, int(row.get("n") or 0), float(row.get("avgdl") or 0))
+    return _stats[1], _stats[2]
+
+
+def _document_frequencies(terms: list[str]) -> dict[str, int]:
+    """各查询词的文档频率（每个词一次 GIN 索引查找）。"""
+    rows = db.fetch_all(
+        f"""
+        SELECT t.term, count(c.id) AS df
+        FROM unnest(%(terms)s::text[]) AS t(term)
+        LEFT JOIN {_schema}.kb_chunk c ON c.search_tsv @@ websearch_to_tsquery('simple', t.term)
+        GROUP BY t.term
+        """,
+        {"terms": terms},
+    )
+    return {r["term"]: r["df"] for r in rows}
+
+
+def _search_chunks_like(query: str, top_k: int, kb_source_ids: list[int] | None) -> list[dict]:
+    """未建全文索引时的子串匹配（ILIKE，无排序）。"""
     where = [f"c.kb_source_id IN (SELECT id FROM {_schema}.kb_source WHERE status = 'READY')", "c.chunk_text ILIKE %(q)s"]
     params = {"q": f"%{query}%", "top_k": top_k}
     if kb_source_ids:
@@ -18,3 +321,45 @@ def search_chunks(query: str, top_k: int = 10, kb_source_ids: list[int] | None =
     LIMIT %(top_k)s
     """
     return db.fetch_all(sql, params)
+
+
+def rule_norm_query(rule: dict) -> str:
+    """规范库规则对应的条文检索词：规则名称 + 字段名 + 各取值位置的提示词。"""
+    parts = [rule.get("name") or "", rule.get("field_label") or ""]
+    for target in rule.get("extract_targets") or []:
+        parts.extend(target.get("hints") or [])
+    return " ".join(dict.fromkeys(p for p in parts if p))
+
+
+def norm_refs_for_rules(rules: list[dict], per_rule: int, limit: int) -> list[dict]:
+    """一批规则的相关规范条文（每条规则取 per_rule 条，按 id 去重，最多 limit 条）；检索失败时返回 []。"""
+    refs: dict[int, dict] = {}
+    for rule in rules:
+        query = rule_norm_query(rule)
+        if not query:
+            continue
+        try:
+            hits = search_chunks(query, top_k=per_rule, kb_type="NORM")
+        except Exception as e:
+            logger.warning(f"规则 {rule.get('rule_id')} 检索规范条文失败: {e}")
+            return list(refs.values())[:limit]
+        for h in hits:
+            refs.setdefault(h["id"], h)
+    return list(refs.values())[:limit]
+
+
+def prefetch_rule_refs(rules: list[dict], per_rule: int) -> int:
+    """
+    审查运行开始时并行执行各规则的条文检索并写入缓存（与 norm_refs_for_rules 的查询一致），
+    批次执行时直接命中缓存。返回预取的查询数；单条失败只记日志。
+    """
+    queries = list(dict.fromkeys(q for q in (rule_norm_query(r) for r in rules) if q))
+
+    def _one(query: str) -> None:
+        try:
+            search_chunks(query, top_k=per_rule, kb_type="NORM")
+        except Exception as e:
+            logger.warning(f"预取规范条文失败（{query[:30]}）: {e}")
+
+    list(_prefetch_pool.map(_one, queries))
+    return len(queries)
@@ -4,6 +4,7 @@
 """
 import json
 import os
+import re
 
 # 规范库 JSON 路径（CONS-001..CONS-125，含 review_type 与 compare.mode）
 _NORM_LIB_PATH = os.path.join(os.path.dirname(__file__), "norm_lib_rules.json")
@@ -40,6 +41,7 @@ RULE_ENGINE_SYSTEM = """你是"生产建设项目水土保持方案报批稿"的
    - norm_basis: {doc, clause_or_section, basis_text摘要} 或 经验规则时 clause_or_section:"-", basis_text:"-"
    - fix_suggestion: {suggested_text, fix_steps: [], verification_after_fix: []}
    - dependencies: 本条规则依赖的字段/表格/附件
+   - confidence: 0～1 的自评置信度（证据不充分或判断把握不大时如实给出较低值）
 
 2) 对于"一致性问题"：必须列出所有冲突版本并给出建议的"主版本来源优先级"，给出统一后的标准写法。
 
@@ -52,7 +54,7 @@ RULE_ENGINE_SYSTEM = """你是"生产建设项目水土保持方案报批稿"的
 6) 最后输出"规则库沉淀清单"：按模块汇总可沉淀为自动规则的条目列表（rule_id + 一句话规则）。
 
 请仅输出一个合法 JSON 对象，包含且仅包含以下两个键：
-- "规则校验结果": 上述问题数组（英文键名：issue_id, issue_title, issue_type, severity, location, evidence, rule_definition, norm_basis, fix_suggestion, dependencies）
+- "规则校验结果": 上述问题数组（英文键名：issue_id, issue_title, issue_type, severity, location, evidence, rule_definition, norm_basis, fix_suggestion, dependencies, confidence）
 - "规则库沉淀清单": 数组，每项 {rule_id, rule_summary}
 
 若无问题，则 "规则校验结果" 为 []。"""
@@ -83,6 +85,100 @@ def _batch_rules(rules: list, batch_size: int = 6) -> list[list]:
     return [rules[i : i + size] for i in range(0, len(rules), size)]
 
 
+# 打包预算：每条规则预计输出的 token 数（校验结果 + 沉淀清单），用于约束单批输出长度
+RULE_OUTPUT_TOKENS = 400
+# 每条相关规范条文写入提示的最大字数，及其按全中文估算的 token 上限（含 chunk_id / 条款标注）
+NORM_REF_CHARS = 600
+NORM_REF_TOKENS = int(NORM_REF_CHARS / 1.5) + 40
+# 单批规则条数上限（即使预算充足，条数过多时模型易漏检）
+PACK_MAX_RULES = 20
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+_SECTION_NO_RE = re.compile(r"^\d+(\.\d+)*$")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估 token 数：中文约 1.5 字/token，其余约 4 字符/token（与 Qwen 分词量级一致，够用于分批）。"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return int(cjk / 1.5 + (len(text) - cjk) / 4) + 1
+
+
+def _rules_json(rules: list[dict]) -> str:
+    return json.dumps(rules, ensure_ascii=False, indent=2)
+
+
+def rule_target_key(rule: dict) -> tuple:
+    """规则的目标范围键：extract_targets 的 where + 章节号提示；相同键的规则看同一批上下文。"""
+    key = set()
+    for t in rule.get("extract_targets") or []:
+        where = t.get("where") or ""
+        numbers = [h for h in t.get("hints") or [] if _SECTION_NO_RE.match(h)]
+        if numbers:
+            key.update((where, n.split(".")[0]) for n in numbers)
+        else:
+            key.add((where, ""))
+    return tuple(sorted(key))
+
+
+def pack_rule_batches(
+    rules: list[dict],
+    prompt_budget: int,
+    fixed_tokens: int = 0,
+    output_budget: int = 6000,
+) -> list[list[dict]]:
+    """
+    按 token 预算装箱分批：每条规则成本 = 规则 JSON token + 预计输出 token。
+    - prompt_budget: 单次请求提示 token 上限（含 fixed_tokens：系统提示 + 文档内容等每批共有部分）
+    - output_budget: 单批预计输出 token 上限
+    目标范围相同（rule_target_key）的规则先成组，整组放入同一批（组本身超预算时才拆开），
+    组按成本降序首次适配（first-fit decreasing），批数少且每批尽量装满。
+    """
+    if not rules:
+        return []
+    rule_budget = max(prompt_budget - fixed_tokens, 1)
+
+    def cost(rule: dict) -> tuple[int, int]:
+        return estimate_tokens(_rules_json([rule])), RULE_OUTPUT_TOKENS
+
+    groups: dict[tuple, list[dict]] = {}
+    for r in rules:
+        groups.setdefault(rule_target_key(r), []).append(r)
+
+    # 超预算的组按规则顺序切成若干可装入的子组
+    units: list[tuple[int, int, list[dict]]] = []
+    for members in groups.values():
+        cur, cur_in, cur_out = [], 0, 0
+        for r in members:
+            c_in, c_out = cost(r)
+            if cur and (cur_in + c_in > rule_budget or cur_out + c_out > output_budget or len(cur) >= PACK_MAX_RULES):
+                units.append((cur_in, cur_out, cur))
+                cur, cur_in, cur_out = [], 0, 0
+            cur.append(r)
+            cur_in += c_in
+            cur_out += c_out
+        if cur:
+            units.append((cur_in, cur_out, cur))
+    units.sort(key=lambda u: (u[0] + u[1], len(u[2])), reverse=True)
+
+    bins: list[list] = []  # [used_in, used_out, rules]
+    for u_in, u_out, members in units:
+        for b in bins:
+            if (
+                b[0] + u_in <= rule_budget
+                and b[1] + u_out <= output_budget
+                and len(b[2]) + len(members) <= PACK_MAX_RULES
+            ):
+                b[0] += u_in
+                b[1] += u_out
+                b[2].extend(members)
+                break
+        else:
+            bins.append([u_in, u_out, list(members)])
+    return [b[2] for b in bins]
+
+
 def build_rule_engine_messages(doc_content: str, norm_lib_json: str) -> list[dict]:
     """
     构建规则引擎单次调用的消息。
@@ -102,40 +198,85 @@ def build_rule_engine_messages(doc_content: str, norm_lib_json: str) -> list[dic
     ]
 
 
+def build_doc_prefix(doc_content: str, window_label: str | None = None) -> str:
+    """
+    单次运行内各批次共用的文档前缀（只依赖文档内容）：与系统提示一起构成逐字节相同的请求前缀，
+    使 DashScope 的前缀缓存在第二批起命中；批次相关内容一律放在其后。
+    分窗审查时 window_label 为窗口说明（如“第 2/5 段”），同一窗口的各批前缀仍相同。
+    """
+    if window_label:
+        return f"""【文档内容】（{window_label}，仅为全文的一部分）
+{doc_content[:120000]}
+
+【分段审查说明】本段之外的章节、表格可能在其他段中，不得仅因本段未出现某内容就报告"信息缺失"或"缺失章节"；只校验本段内可以判断的问题。
+
+【重要】文档中每一段格式为：[block_id=xx][page=N] 换行 正文。你发现问题的原文来自某段时，location.page 和 evidence.page_refs 必须填该段的 N（真实页码），不要填 1 或留空。"""
+    return f"""【文档内容】
+{doc_content[:120000]}
+
+【重要】文档中每一段格式为：[block_id=xx][page=N] 换行 正文。你发现问题的原文来自某段时，location.page 和 evidence.page_refs 必须填该段的 N（真实页码），不要填 1 或留空。"""
+
+
 def build_rule_engine_messages_batch(
     doc_content: str,
     rules_batch: list[dict],
     batch_index: int,
     total_batches: int,
+    context_cache: bool = False,
+    window_label: str | None = None,
+    norm_chunks: list[dict] | None = None,
 ) -> list[dict]:
     """
-    构建单批规则（5～7 条）的请求消息。
-    本批仅校验 rules_batch 中的规则，返回也只针对这批规则的校验结果。
+    构建单批规则的请求消息。本批仅校验 rules_batch 中的规则，返回也只针对这批规则的校验结果。
+    消息布局：系统提示 + 文档前缀（各批相同）在前，本批规则与批次序号在最后。
+    context_cache=True 时文档前缀作为单独的内容段并标注 cache_control（DashScope 显式缓存），
+    否则拼成一段文本（仍可命中隐式前缀缓存）。
+    window_label 非空时 doc_content 为文档的一个上下文窗口（见 app/ai/doc_chunker.py）。
+    norm_chunks 为知识库中与本批规则相关的规范条文（rag.norm_refs_for_rules），放在本批规则之后供 norm_basis 引用。
     """
-    norm_lib_json = json.dumps(rules_batch, ensure_ascii=False, indent=2)
+    norm_lib_json = _rules_json(rules_batch)
     rule_ids = [r.get("rule_id") or r.get("name") or "" for r in rules_batch]
-    user_content = f"""【文档内容】
-{doc_content[:120000]}
+    prefix = build_doc_prefix(doc_content, window_label)
+    suffix = f"""
 
 【本批校验规则】（第 {batch_index + 1}/{total_batches} 批，共 {len(rules_batch)} 条）
 规则 ID 列表：{", ".join(rule_ids)}
 
 【规范库】（仅本批规则）
 {norm_lib_json}
-
-【重要】文档中每一段格式为：[block_id=xx][page=N] 换行 正文。你发现问题的原文来自某段时，location.page 和 evidence.page_refs 必须填该段的 N（真实页码），不要填 1 或留空。
-
+{_norm_chunks_text(norm_chunks)}
 请仅针对以上 {len(rules_batch)} 条规则，根据文档内容逐条校验。输出一个 JSON 对象：
-- "规则校验结果": 本批规则发现的问题数组（每条规则 0 或若干条），格式同前（issue_id, issue_title, issue_type, severity, location, evidence, rule_definition, norm_basis, fix_suggestion, dependencies）
+- "规则校验结果": 本批规则发现的问题数组（每条规则 0 或若干条），格式同前（issue_id, issue_title, issue_type, severity, location, evidence, rule_definition, norm_basis, fix_suggestion, dependencies, confidence）
 - "规则库沉淀清单": 本批规则的 rule_id + 一句话 rule_summary
 
 若无问题，则 "规则校验结果" 为 []。仅输出 JSON，不要其他解释。"""
+    if context_cache:
+        user_content = [
+            {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": suffix},
+        ]
+    else:
+        user_content = prefix + suffix
     return [
         {"role": "system", "content": RULE_ENGINE_SYSTEM},
         {"role": "user", "content": user_content},
     ]
 
 
+def _norm_chunks_text(norm_chunks: list[dict] | None) -> str:
+    """相关规范条文段落（每条前标注 chunk_id），无条文时为空串。"""
+    if not norm_chunks:
+        return ""
+    body = "\n\n".join(
+        f"[chunk_id={c['id']}] {str((c.get('meta_json') or {}).get('ref', ''))[:40]}\n{(c.get('chunk_text') or '')[:NORM_REF_CHARS]}"
+        for c in norm_chunks
+    )
+    return f"""
+【相关规范条文】（知识库检索结果，norm_basis 优先据此填写条款与摘要，不得编造条款号）
+{body}
+"""
+
+
 def get_rule_batches(rules: list, batch_size: int = 6) -> list[list]:
     """对外：将规则列表分成每批 5～7 条的列表。"""
     return _batch_rules(rules, batch_size)
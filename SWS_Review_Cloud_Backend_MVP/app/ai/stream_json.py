@@ -0,0 +1,103 @@
+"""
+流式 JSON 增量解析：从模型逐段返回的文本中，提取顶层对象里指定键（如 "规则校验结果"）数组的元素。
+每个元素（JSON 对象）一旦完整闭合即回调输出，无需等待整段 JSON 生成完毕。
+"""
+import json
+import logging
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalArrayParser:
+    """
+    增量解析器：feed() 逐段喂入文本，遇到 target_key 数组中完整的对象元素时调用 on_item(dict)。
+    仅识别顶层对象（深度 1）下的 target_key；非对象元素（字符串/数字）忽略。
+    """
+
+    def __init__(self, target_key: str, on_item: Callable[[dict], None]):
+        self.target_key = target_key
+        self.on_item = on_item
+        self.emitted = 0
+        self.done = False  # 目标数组已闭合
+        self._chunks: list[str] = []
+        self._window = ""  # 尚未处理完的尾部文本（已闭合的部分会被丢弃）
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = -1
+        self._last_key: str | None = None  # 深度 1 最近一次出现的字符串（遇到 '[' 时即为键名）
+        self._array_depth: int | None = None  # 目标数组打开后的深度
+        self._elem_start: int | None = None
+
+    @property
+    def text(self) -> str:
+        """已接收的完整文本（供流结束后整体解析）。"""
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> None:
+        if not chunk:
+            return
+        self._chunks.append(chunk)
+        start = len(self._window)
+        text = self._window + chunk
+        for i in range(start, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._array_depth is None:
+                        self._last_key = text[self._string_start + 1 : i]
+            elif c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c in "{[":
+                if (
+                    c == "["
+                    and self._depth == 1
+                    and self._array_depth is None
+                    and not self.done
+                    and self._last_key == self.target_key
+                ):
+                    self._array_depth = 2
+                self._depth += 1
+                if (
+                    c == "{"
+                    and self._array_depth is not None
+                    and self._depth == self._array_depth + 1
+                ):
+                    self._elem_start = i
+            elif c in "}]":
+                self._depth -= 1
+                if self._array_depth is not None:
+                    if c == "}" and self._depth == self._array_depth and self._elem_start is not None:
+                        self._emit(text[self._elem_start : i + 1])
+                        self._elem_start = None
+                    elif c == "]" and self._depth == self._array_depth - 1:
+                        self._array_depth = None
+                        self.done = True
+        # 仅保留仍需回看的尾部：未闭合元素的起点、或未闭合字符串的起点
+        keep_from = len(text)
+        if self._elem_start is not None:
+            keep_from = self._elem_start
+        if self._in_string:
+            keep_from = min(keep_from, self._string_start)
+        self._window = text[keep_from:]
+        if self._elem_start is not None:
+            self._elem_start -= keep_from
+        if self._in_string:
+            self._string_start -= keep_from
+
+    def _emit(self, raw: str) -> None:
+        try:
+            item = json.loads(raw)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Skip malformed streamed element: {e}")
+            return
+        if isinstance(item, dict):
+            self.emitted += 1
+            self.on_item(item)
@@ -0,0 +1,133 @@
+"""
+AI 请求遥测：记录每次 chat/completions 的 token 用量（含命中前缀缓存的 token）、耗时、HTTP 状态与重试序号，
+按审查运行（run_id）与规则批次（batch_key）落库 ai_request_log，并维护运行级 token 预算。
+
+调用方（如 ai_review_tasks）用 call_context() 声明当前线程所属的运行/批次/尝试序号，
+qwen_client 在每次请求结束后调用 record_call()，无上下文时仅打日志不落库。
+"""
+import logging
+import threading
+from contextlib import contextmanager
+
+from ..settings import settings
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_totals_lock = threading.Lock()
+# run_id -> {"total": 总 token, "prompt": 提示 token, "cached": 命中缓存的提示 token}
+_run_totals: dict[int, dict[str, int]] = {}
+
+
+class TokenBudgetExceeded(Exception):
+    """审查运行累计 token 超过 AI_RUN_TOKEN_BUDGET。"""
+
+
+@contextmanager
+def call_context(run_id: int | None, rule_ids: list | None = None, attempt: int = 1):
+    """声明当前线程后续 AI 请求所属的运行、规则批次与尝试序号。"""
+    prev = getattr(_local, "ctx", None)
+    rule_ids = [r for r in (rule_ids or []) if r]
+    _local.ctx = {
+        "run_id": run_id,
+        "rule_ids": rule_ids,
+        "batch_key": ",".join(rule_ids) or None,
+        "attempt": attempt,
+    }
+    try:
+        yield
+    finally:
+        _local.ctx = prev
+
+
+def current_context() -> dict | None:
+    return getattr(_local, "ctx", None)
+
+
+def record_call(
+    model: str | None,
+    stream: bool,
+    latency_ms: int,
+    http_status: int | None,
+    usage: dict | None,
+    error: str | None = None,
+) -> None:
+    """记录一次请求；失败不影响主流程。"""
+    ctx = current_context() or {}
+    usage = usage or {}
+    prompt_tokens = usage.get("prompt_tokens")
+    completion_tokens = usage.get("completion_tokens")
+    total_tokens = usage.get("total_tokens")
+    if total_tokens is None and (prompt_tokens is not None or completion_tokens is not None):
+        total_tokens = (prompt_tokens or 0) + (completion_tokens or 0)
+    # DashScope / OpenAI 兼容：命中前缀缓存的提示 token 在 prompt_tokens_details.cached_tokens
+    cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    run_id = ctx.get("run_id")
+    if run_id is not None and total_tokens:
+        with _totals_lock:
+            totals = _run_totals.setdefault(run_id, {"total": 0, "prompt": 0, "cached": 0})
+            totals["total"] += total_tokens
+            totals["prompt"] += prompt_tokens or 0
+            totals["cached"] += cached_tokens or 0
+    logger.info(
+        f"AI call run={run_id} batch={ctx.get('batch_key')} attempt={ctx.get('attempt', 1)} model={model} "
+        f"status={http_status} tokens={prompt_tokens}/{completion_tokens} cached={cached_tokens or 0} latency={latency_ms}ms"
+        + (f" error={error}" if error else "")
+    )
+    if run_id is None:
+        return
+    try:
+        from ..services.ai_usage_service import insert_request_log
+        insert_request_log(
+            run_id=run_id,
+            batch_key=ctx.get("batch_key"),
+            rule_ids=ctx.get("rule_ids"),
+            attempt=ctx.get("attempt", 1),
+            model=model,
+            stream=stream,
+            http_status=http_status,
+            success=error is None,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=total_tokens,
+            cached_tokens=cached_tokens,
+            latency_ms=latency_ms,
+            error_message=error,
+        )
+    except Exception as e:
+        logger.warning(f"Record AI call failed: {e}")
+
+
+def seed_run(run_id: int, total_tokens: int) -> None:
+    """以库内已记录的用量作为本进程该运行的起始 token（批次分发到多个 worker 时预算按全局用量检查）。"""
+    with _totals_lock:
+        _run_totals[run_id] = {"total": total_tokens, "prompt": 0, "cached": 0}
+
+
+def run_tokens(run_id: int) -> int:
+    """本进程内该运行已消耗的 token 数。"""
+    with _totals_lock:
+        return _run_totals.get(run_id, {}).get("total", 0)
+
+
+def run_cache_ratio(run_id: int) -> float:
+    """本进程内该运行提示 token 中命中前缀缓存的比例。"""
+    with _totals_lock:
+        totals = _run_totals.get(run_id) or {}
+    prompt = totals.get("prompt", 0)
+    return totals.get("cached", 0) / prompt if prompt else 0.0
+
+
+def check_budget(run_id: int | None) -> None:
+    """超过 AI_RUN_TOKEN_BUDGET（>0 时生效）则抛 TokenBudgetExceeded。"""
+    budget = settings.AI_RUN_TOKEN_BUDGET
+    if run_id is None or budget <= 0:
+        return
+    used = run_tokens(run_id)
+    if used >= budget:
+        raise TokenBudgetExceeded(f"审查运行 {run_id} 已消耗 {used} tokens，超过预算 {budget}")
+
+
+def clear_run(run_id: int) -> None:
+    with _totals_lock:
+        _run_totals.pop(run_id, None)
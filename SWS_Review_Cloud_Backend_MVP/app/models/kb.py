@@ -0,0 +1,8 @@
+from pydantic import BaseModel
+
+
+class KbImportRequest(BaseModel):
+    package: str  # KB_IMPORT_ROOT 下的知识库包目录名
+    defer_indexes: bool = False
+    strict: bool = False
+    restart: bool = False  # 忽略断点，从头导入
@@ -1,12 +1,15 @@
+import os
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Query, status, UploadFile, File
 
 from ..models.common import ok_data
-from ..services import kb_service, file_service
+from ..models.kb import KbImportRequest
+from ..ai import rag
+from ..services import kb_import_service, kb_service, file_service
 from ..storage import get_storage
 from ..core.deps import get_current_user
-from ..worker.kb_tasks import index_kb_source_task
+from ..worker.kb_tasks import import_kb_package_task, index_kb_source_task
 
 router = APIRouter(prefix="/api/kb", tags=["kb"])
 
@@ -39,14 +42,49 @@ def list_sources(current_user: Annotated[dict, Depends(get_current_user)]):
     return ok_data(rows)
 
 
+@router.get("/search", response_model=dict)
+def search_kb(
+    current_user: Annotated[dict, Depends(get_current_user)],
+    q: str = Query(..., min_length=1),
+    top_k: int = Query(10, ge=1, le=100),
+    kb_source_ids: Annotated[list[int] | None, Query()] = None,
+    kb_type: str | None = None,
+):
+    """规范知识库混合检索（BM25 + 向量，RRF 融合排序），highlights 为命中区间。"""
+    return ok_data(rag.search_chunks(q, top_k=top_k, kb_source_ids=kb_source_ids, kb_type=kb_type))
+
+
 @router.post("/sources/{source_id}/reindex", response_model=dict)
 def reindex_source(source_id: int, current_user: Annotated[dict, Depends(get_current_user)]):
     src = kb_service.get_kb_source(source_id)
     if not src:
         raise HTTPException(status_code=404, detail="Source not found")
-    from .. import db
-    from ..settings import settings
-    schema = settings.DB_SCHEMA
-    db.execute(f"UPDATE {schema}.kb_source SET status = 'PROCESSING', error_message = NULL, updated_at = now() WHERE id = %(id)s", {"id": source_id})
+    kb_service.set_kb_source_processing(source_id)
     index_kb_source_task.delay(source_id)
     return ok_data({"id": source_id, "status": "PROCESSING"})
+
+
+@router.post("/import", response_model=dict)
+def import_package(body: KbImportRequest, current_user: Annotated[dict, Depends(get_current_user)]):
+    """后台导入 KB_IMPORT_ROOT 下的知识库包（kb_sources.json + kb_chunks.jsonl），中断后重新提交即从断点续传。"""
+    try:
+        package_dir = kb_import_service.package_path(body.package)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if not os.path.isdir(package_dir):
+        raise HTTPException(status_code=404, detail="Package not found")
+    task = import_kb_package_task.delay(body.package, body.defer_indexes, body.strict, body.restart)
+    return ok_data({"package": body.package, "task_id": task.id})
+
+
+@router.get("/import/status", response_model=dict)
+def import_status(current_user: Annotated[dict, Depends(get_current_user)], package: str = Query(..., min_length=1)):
+    """导入进度（断点文件）：offset、done 与统计（rows、inserted、rows_per_sec 等）；未开始时为 null。"""
+    try:
+        package_dir = kb_import_service.package_path(package)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    state = kb_import_service.load_state(package_dir)
+    if state is not None:
+        state = {k: state[k] for k in ("offset", "done", "stats")}
+    return ok_data(state)
@@ -4,7 +4,7 @@ from fastapi import APIRouter, Depends, HTTPException, status
 
 from ..models.projects import ProjectCreate
 from ..models.common import ok_data
-from ..services import project_service
+from ..services import project_service, scheduler_service
 from ..core.deps import get_current_user, require_project_member
 
 router = APIRouter(prefix="/api", tags=["projects"])
@@ -31,3 +31,15 @@ def get_project(project_id: int, current_user: Annotated[dict, Depends(get_curre
     if not proj:
         raise HTTPException(status_code=404, detail="Project not found")
     return ok_data(proj)
+
+
+@router.get("/projects/{project_id}/queue", response_model=dict)
+def get_project_queue(project_id: int, current_user: Annotated[dict, Depends(get_current_user)]):
+    """项目调度状态：等待中的管道/审查作业数、最久等待、在跑作业数与最近等待时长 p50/p95。"""
+    if not require_project_member(project_id, current_user):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a project member")
+    try:
+        stats = scheduler_service.project_queue_stats(project_id)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Scheduler unavailable: {e}")
+    return ok_data(stats)
@@ -2,14 +2,15 @@ import json
 import asyncio
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query
 from fastapi.responses import StreamingResponse
 
 from ..models.common import ok_data
 from ..models.review import ReviewRunCreate
-from ..services.review_run_service import create_review_run, get_review_run
+from ..services.review_run_service import create_review_run, get_review_run, list_run_issues_since, cancel_run
+from ..services import ai_usage_service
 from ..core.deps import get_current_user, require_project_member, get_project_id_by_run_id
-from ..worker.ai_review_tasks import run_ai_review_task
+from ..services.scheduler_service import PRIORITY_INTERACTIVE, submit_review
 
 router = APIRouter(prefix="/api", tags=["review-runs"])
 
@@ -28,7 +29,8 @@ def create_run(
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a project member")
     # 当前全部使用 AI 规则校验引擎，不再执行旧规则引擎
     run_id = create_review_run(version_id, "AI")
-    run_ai_review_task.delay(version_id, run_id)
+    # 用户发起的审查按 interactive 优先级调度，先于批量上传的解析与自动审查
+    submit_review(project_id, version_id, run_id, PRIORITY_INTERACTIVE)
     run = get_review_run(run_id)
     return ok_data(run)
 
@@ -46,6 +48,46 @@ def get_run(run_id: int, current_user: Annotated[dict, Depends(get_current_user)
     return ok_data(run)
 
 
+@router.post("/review-runs/{run_id}/cancel", response_model=dict)
+def cancel_review_run(run_id: int, current_user: Annotated[dict, Depends(get_current_user)]):
+    """取消排队中或执行中的审查运行：未开始的批次不再请求 AI，进行中的 AI 请求被中断。"""
+    project_id = get_project_id_by_run_id(run_id)
+    if project_id is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if not require_project_member(project_id, current_user):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a project member")
+    run = get_review_run(run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if not cancel_run(run_id):
+        raise HTTPException(status_code=400, detail=f"Cannot cancel run with status: {run['status']}.")
+    return ok_data(get_review_run(run_id))
+
+
+@router.get("/review-runs/{run_id}/usage", response_model=dict)
+def get_run_usage(run_id: int, current_user: Annotated[dict, Depends(get_current_user)]):
+    """单次审查运行的 AI 用量：token、耗时、重试、HTTP 状态，按规则批次明细。"""
+    project_id = get_project_id_by_run_id(run_id)
+    if project_id is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if not require_project_member(project_id, current_user):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a project member")
+    return ok_data(ai_usage_service.get_run_usage(run_id))
+
+
+@router.get("/ai-usage/batches", response_model=dict)
+def list_ai_usage_batches(
+    current_user: Annotated[dict, Depends(get_current_user)],
+    limit: int = Query(20, ge=1, le=200),
+    order_by: str = Query("tokens", pattern="^(tokens|latency)$"),
+):
+    """
+    跨运行按规则批次聚合的 AI 用量，按平均 token 或平均耗时降序，用于定位最贵/最慢的规则组合。
+    只统计当前用户所属项目的审查运行。
+    """
+    return ok_data(ai_usage_service.list_batch_stats(current_user["id"], limit=limit, order_by=order_by))
+
+
 @router.get("/review-runs/{run_id}/events")
 async def run_events(run_id: int, current_user: Annotated[dict, Depends(get_current_user)]):
     project_id = get_project_id_by_run_id(run_id)
@@ -55,13 +97,28 @@ async def run_events(run_id: int, current_user: Annotated[dict, Depends(get_curr
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a project member")
 
     async def event_generator():
+        last_issue_id = 0
+        issue_count = 0
         while True:
             run = get_review_run(run_id)
             if not run:
                 break
-            payload = {"run_id": run_id, "progress": run.get("progress", 0), "message": run.get("status", "")}
+            # 流式审查时问题逐条落库，这里把新增问题逐条推给前端
+            new_issues = list_run_issues_since(run_id, last_issue_id)
+            for issue in new_issues:
+                last_issue_id = issue["id"]
+                issue_count += 1
+                yield f"event: issue\ndata: {json.dumps(issue, default=str, ensure_ascii=False)}\n\n"
+            payload = {
+                "run_id": run_id,
+                "progress": run.get("progress", 0),
+                "message": run.get("status", ""),
+                "issue_count": issue_count,
+            }
             yield f"event: run_progress\ndata: {json.dumps(payload, default=str)}\n\n"
             if run.get("status") in ("DONE", "FAILED", "CANCELED"):
+                if new_issues:
+                    continue  # 结束前把剩余问题推完
                 yield f"event: run_done\ndata: {json.dumps({'run_id': run_id}, default=str)}\n\n"
                 break
             await asyncio.sleep(1)
@@ -0,0 +1,827 @@
+"""
+规范库（norm_lib_rules.json）本地解释执行：
+按规则的 extract_targets 取文档片段 -> normalize 归一化 -> compare.mode 比对，
+命中时用 message_tpl / fix_hint_tpl 渲染问题，不经大模型。
+
+- 确定性模式（正则/禁用词/括号配对/缺失章节/单位写法/表内合计/字段取值比对）在本地执行
+- ai_gap_check 等语义模式，以及本地取不到足够输入的规则（如字段值只在一处出现）
+  返回给调用方，继续走 AI 批次请求
+"""
+import logging
+import re
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+
+from ..services.checkpoint_runner import ReviewContext
+from .base import IssueDraft
+
+logger = logging.getLogger(__name__)
+
+# 本地可解释的 compare.mode（其余模式一律交给大模型）
+LOCAL_MODES = frozenset({
+    "regex_match",
+    "regex_not_match",
+    "forbidden_token",
+    "punctuation_check",
+    "missing_section_check",
+    "unit_check",
+    "sum_check_row",
+    "sum_check_col",
+    "percentage_sum_check",
+    "all_equal",
+    "fuzzy_equal",
+    "numeric_equal",
+})
+
+# 单条规则最多输出的问题数，避免全书性写法问题刷屏
+MAX_ISSUES_PER_RULE = 20
+
+# 规范库 severity -> 库内 severity
+SEVERITY_MAP = {"high": "S2", "medium": "S3", "low": "INFO"}
+
+MODE_ISSUE_TYPE = {
+    "all_equal": "CONSISTENCY",
+    "fuzzy_equal": "CONSISTENCY",
+    "numeric_equal": "CONSISTENCY",
+    "sum_check_row": "SUM_MISMATCH_ROW",
+    "sum_check_col": "SUM_MISMATCH_COL",
+    "percentage_sum_check": "PERCENTAGE_SUM_MISMATCH",
+    "missing_section_check": "MISSING_SECTION",
+    "unit_check": "UNIT_INCONSISTENT",
+    "punctuation_check": "FORMAT",
+    "regex_match": "FORMAT",
+    "regex_not_match": "FORMAT",
+    "forbidden_token": "BUSINESS_LOGIC",
+}
+
+SUM_KEYWORDS = ("合计", "小计", "总计")
+
+# 封面/扉页等前置页：取首个标题块之前的内容（无标题时取前 FRONT_MATTER_BLOCKS 块）
+FRONT_MATTER_WHERE = frozenset({"cover", "title_page", "qualification_page", "responsibility_page", "task_sheet"})
+FRONT_MATTER_BLOCKS = 50
+
+WHERE_LABELS = {
+    "cover": "封面",
+    "title_page": "扉页",
+    "qualification_page": "资质页",
+    "responsibility_page": "责任页",
+    "task_sheet": "任务单",
+    "attachment": "附件",
+    "figure": "图题",
+    "toc": "目录",
+}
+
+_SECTION_NO_RE = re.compile(r"^\d+(\.\d+)*\.?$")
+_CJK_RE = re.compile(r"[一-鿿]")
+_FIGURE_CAPTION_RE = re.compile(r"^\s*(附)?图\s*[\d一二三四五六七八九十]")
+_ATTACHMENT_TITLE_RE = re.compile(r"^\s*附\s*(件|表|图)")
+_DATE_RE = re.compile(r"(\d{4})\s*[年\-./]\s*(\d{1,2})\s*(?:[月\-./]\s*(?:(\d{1,2})\s*日?)?)?")
+_NUMBER_UNIT_RE = re.compile(
+    r"(-?\d+(?:,\d{3})*(?:\.\d+)?)\s*(万m³|万m3|万立方米|m³|m3|立方米|hm²|hm2|公顷|km²|km2|m²|m2|平方米|亩|亿元|万元|元)?"
+)
+
+_FULLWIDTH_TABLE = {i: i - 0xFEE0 for i in range(0xFF01, 0xFF5F)}
+_FULLWIDTH_TABLE[0x3000] = 0x20
+_PUNCT_TABLE = str.maketrans({
+    "（": "(", "）": ")", "，": ",", "：": ":", "；": ";", "“": '"', "”": '"',
+    "‘": "'", "’": "'", "【": "[", "】": "]", "－": "-", "—": "-", "～": "~",
+})
+_UNIT_ALIASES = [
+    ("万立方米", "万m³"), ("立方米", "m³"), ("平方公里", "km²"), ("平方米", "m²"), ("公顷", "hm²"),
+    ("km2", "km²"), ("hm2", "hm²"), ("m3", "m³"), ("m2", "m²"),
+]
+_UNIT_FACTORS = {
+    "hm2": {"hm²": 1.0, "hm2": 1.0, "公顷": 1.0, "m²": 1e-4, "m2": 1e-4, "平方米": 1e-4,
+            "亩": 1 / 15, "km²": 100.0, "km2": 100.0},
+    "m3": {"m³": 1.0, "m3": 1.0, "立方米": 1.0, "万m³": 1e4, "万m3": 1e4, "万立方米": 1e4},
+    "万元": {"万元": 1.0, "元": 1e-4, "亿元": 1e4},
+}
+_NORMALIZE_UNIT_TARGET = {
+    "number_unit_to_hm2": "hm2",
+    "number_unit_to_m3": "m3",
+    "number_unit_to_wanyuan": "万元",
+}
+
+
+@dataclass
+class _Segment:
+    """一段可比对文本：来源位置（where + 可读位置名）、所在 block 与文本。"""
+    where: str
+    loc: str
+    block_id: int | None
+    text: str
+    table: dict | None = None
+
+
+class _TplValues(dict):
+    """模板缺少的占位符渲染为空串，避免 KeyError。"""
+
+    def __missing__(self, key):
+        return ""
+
+
+def render_template(tpl: str | None, values: dict) -> str:
+    if not tpl:
+        return ""
+    try:
+        return tpl.format_map(_TplValues(values))
+    except (ValueError, IndexError):
+        return tpl
+
+
+def normalize_value(text: str, ops: list[str]) -> str:
+    """按规范库 normalize 列表归一化字段值（数值换算类操作在 numeric_equal 比对时处理）。"""
+    s = text or ""
+    for op in ops or []:
+        if op == "trim":
+            s = s.strip()
+        elif op == "fullwidth2halfwidth":
+            s = s.translate(_FULLWIDTH_TABLE)
+        elif op == "remove_extra_spaces":
+            s = re.sub(r"\s+", " ", s).strip()
+        elif op == "remove_all_spaces":
+            s = re.sub(r"\s+", "", s)
+        elif op == "punct_unify":
+            s = s.translate(_PUNCT_TABLE)
+        elif op == "upper":
+            s = s.upper()
+        elif op == "date_to_iso":
+            s = _DATE_RE.sub(_iso_date, s)
+        elif op == "company_suffix_unify":
+            s = s.replace("有限责任公司", "有限公司")
+        elif op == "percent_unify":
+            s = re.sub(r"百分之\s*(\d+(?:\.\d+)?)", r"\1%", s.replace("％", "%"))
+        elif op in ("unit_unify", "number_unit_unify"):
+            for src, dst in _UNIT_ALIASES:
+                s = s.replace(src, dst)
+        elif op == "address_noise_remove":
+            s = re.sub(r"^(位于|地处)|境内$", "", s)
+    return s
+
+
+def _iso_date(m: re.Match) -> str:
+    y, mo, d = m.group(1), int(m.group(2)), m.group(3)
+    return f"{y}-{mo:02d}-{int(d):02d}" if d else f"{y}-{mo:02d}"
+
+
+def parse_number(text: str, unit: str | None = None) -> float | None:
+    """取文本中首个数值；给定目标单位（hm2/m3/万元）时按其后单位换算。"""
+    m = _NUMBER_UNIT_RE.search(text or "")
+    if not m:
+        return None
+    try:
+        value = float(m.group(1).replace(",", ""))
+    except ValueError:
+        return None
+    factors = _UNIT_FACTORS.get(unit or "")
+    if factors and m.group(2):
+        value *= factors.get(m.group(2), 1.0)
+    return value
+
+
+def _loose_unit_pattern(unit: str) -> re.Pattern:
+    """由标准单位写法生成宽松匹配：括号全/半角、中点与句点互换、字符间允许空白。"""
+    parts = []
+    for ch in unit:
+        if ch in "(（":
+            parts.append("[(（]")
+        elif ch in ")）":
+            parts.append("[)）]")
+        elif ch in "·.．•":
+            parts.append("[·.．•]")
+        else:
+            parts.append(re.escape(ch))
+    return re.compile(r"\s*".join(parts))
+
+
+def _is_label(hint: str) -> bool:
+    return len(hint) >= 2 and bool(_CJK_RE.search(hint)) and not _SECTION_NO_RE.match(hint)
+
+
+def _fmt(v: float) -> str:
+    return f"{round(v, 4):g}"
+
+
+class NormLibInterpreter:
+    """
+    单次审查运行内复用的规范库解释器：一次构建文档片段（前置页/正文章节/附件/表格/图题），
+    再逐条规则执行。run() 返回 (问题列表 [(IssueDraft, rule)], 需交给大模型的规则)。
+    """
+
+    def __init__(self, context: ReviewContext):
+        self.context = context
+        blocks = sorted(context.blocks_by_id.values(), key=lambda b: b.get("order_index") or 0)
+        self._text_blocks = [b for b in blocks if b.get("block_type") != "TABLE" and (b.get("text") or "").strip()]
+        self._table_block = {b["table_id"]: b["id"] for b in blocks if b.get("table_id")}
+
+        first_heading = next(
+            (i for i, b in enumerate(self._text_blocks) if b.get("block_type") == "HEADING"), None
+        )
+        front_end = first_heading if first_heading is not None else min(FRONT_MATTER_BLOCKS, len(self._text_blocks))
+        self._front = self._text_blocks[:front_end]
+
+        self._attachment_nodes = {nid for nid in context.outline_index if self._under_attachment(nid)}
+        self._body = [
+            b for b in self._text_blocks[front_end:]
+            if b.get("outline_node_id") not in self._attachment_nodes
+        ]
+        self._attachment = [
+            b for b in self._text_blocks[front_end:]
+            if b.get("outline_node_id") in self._attachment_nodes
+        ]
+        self._segments_cache: dict[tuple, list[_Segment]] = {}
+
+    # ---- 片段抽取 ----
+
+    def _under_attachment(self, node_id: int) -> bool:
+        seen = set()
+        node = self.context.outline_index.get(node_id)
+        while node and node["id"] not in seen:
+            seen.add(node["id"])
+            if _ATTACHMENT_TITLE_RE.match(node.get("title") or ""):
+                return True
+            node = self.context.outline_index.get(node.get("parent_id"))
+        return False
+
+    def _node_loc(self, node_id: int | None) -> str:
+        node = self.context.outline_index.get(node_id) if node_id else None
+        if not node:
+            return "正文"
+        return f"{node.get('node_no') or ''} {node.get('title') or ''}".strip() or "正文"
+
+    def _nodes_for_section_no(self, section_no: str) -> set[int]:
+        section_no = section_no.rstrip(".")
+        return {
+            nid for nid, n in self.context.outline_index.items()
+            if (n.get("node_no") or "").rstrip(".") == section_no
+            or (n.get("node_no") or "").startswith(section_no + ".")
+        }
+
+    def _table_segments(self, table: dict) -> list[_Segment]:
+        loc = f"表{table.get('table_no')}" if table.get("table_no") else (table.get("title") or f"表格{table['id']}")
+        block_id = self._table_block.get(table["id"])
+        segs = []
+        if table.get("title"):
+            caption = f"表{table['table_no']} {table['title']}" if table.get("table_no") else table["title"]
+            segs.append(_Segment("table", loc, block_id, caption, table))
+        by_row: dict[int, list[dict]] = {}
+        for c in table.get("cells") or []:
+            by_row.setdefault(c["r"], []).append(c)
+        for r in sorted(by_row):
+            row_text = "\t".join((c.get("text") or "") for c in sorted(by_row[r], key=lambda c: c["c"]))
+            if row_text.strip():
+                segs.append(_Segment("table", loc, block_id, row_text, table))
+        return segs
+
+    def _table_matches(self, table: dict, hints: list[str]) -> bool:
+        if not hints:
+            return True
+        head = f"{table.get('table_no') or ''} {table.get('title') or ''}"
+        cells_text = " ".join((c.get("text") or "") for c in table.get("cells") or [])
+        return any(h in head or h in cells_text for h in hints)
+
+    def segments(self, where: str, hints: list[str]) -> list[_Segment]:
+        """按 extract_targets 的 where/hints 取片段；页眉页脚/图纸等解析结果中没有的位置返回空。"""
+        key = (where, tuple(hints))
+        if key in self._segments_cache:
+            return self._segments_cache[key]
+        segs: list[_Segment] = []
+        if where in FRONT_MATTER_WHERE or where == "toc":
+            label = WHERE_LABELS.get(where, where)
+            segs = [_Segment(where, label, b["id"], b["text"]) for b in self._front]
+        elif where == "section":
+            numbers = [h for h in hints if _SECTION_NO_RE.match(h)]
+            blocks = self._body
+            if numbers:
+                nodes = set()
+                for no in numbers:
+                    nodes |= self._nodes_for_section_no(no)
+                blocks = [b for b in blocks if b.get("outline_node_id") in nodes]
+            segs = [_Segment(where, self._node_loc(b.get("outline_node_id")), b["id"], b["text"]) for b in blocks]
+        elif where == "attachment":
+            segs = [_Segment(where, WHERE_LABELS["attachment"], b["id"], b["text"]) for b in self._attachment]
+        elif where == "figure":
+            segs = [
+                _Segment(where, WHERE_LABELS["figure"], b["id"], b["text"])
+                for b in self._text_blocks if _FIGURE_CAPTION_RE.match(b["text"])
+            ]
+        elif where == "table":
+            for t in self.context.tables:
+                if self._table_matches(t, [h for h in hints if h.strip()]):
+                    segs.extend(self._table_segments(t))
+        self._segments_cache[key] = segs
+        return segs
+
+    def _rule_segments(self, rule: dict) -> list[_Segment]:
+        out, seen = [], set()
+        for target in rule.get("extract_targets") or []:
+            for seg in self.segments(target.get("where") or "", target.get("hints") or []):
+                k = (seg.block_id, seg.text)
+                if k not in seen:
+                    seen.add(k)
+                    out.append(seg)
+        return out
+
+    # ---- 执行 ----
+
+    def run(self, rules: list[dict]) -> tuple[list[tuple[IssueDraft, dict]], list[dict]]:
+        issues: list[tuple[IssueDraft, dict]] = []
+        deferred: list[dict] = []
+        for rule in rules:
+            mode = (rule.get("compare") or {}).get("mode")
+            handler = getattr(self, f"_mode_{mode}", None) if mode in LOCAL_MODES else None
+            if handler is None:
+                deferred.append(rule)
+                continue
+            try:
+                found = handler(rule, rule.get("compare") or {})
+            except re.error as e:
+                logger.warning(f"Norm rule {rule.get('rule_id')} pattern invalid, defer to AI: {e}")
+                found = None
+            except Exception as e:
+                logger.warning(f"Norm rule {rule.get('rule_id')} local check failed, defer to AI: {e}")
+                found = None
+            if found is None:
+                deferred.append(rule)
+                continue
+            issues.extend((d, rule) for d in found[:MAX_ISSUES_PER_RULE])
+        return issues, deferred
+
+    def _draft(
+        self,
+        rule: dict,
+        values: dict,
+        block_ids: list[int | None],
+        quotes: list[dict] | None = None,
+        confidence: float = 0.9,
+    ) -> IssueDraft:
+        mode = (rule.get("compare") or {}).get("mode")
+        values = {"field_label": rule.get("field_label") or rule.get("name") or "", **values}
+        title = render_template(rule.get("message_tpl"), values) or rule.get("name") or "规范库规则校验"
+        suggestion = render_template(rule.get("fix_hint_tpl"), values) or "请根据规范库规则核对修改。"
+        issue_type = MODE_ISSUE_TYPE.get(mode, "FORMAT")
+        if mode in ("regex_match", "regex_not_match") and rule.get("review_type") in ("CONTENT", "BUSINESS_LOGIC"):
+            issue_type = rule["review_type"]
+        description = f"{title}\n规则：{rule.get('name') or rule.get('rule_id')}"
+        if values.get("detail") and values["detail"] not in title:
+            description += f"\n详情：{values['detail']}"
+        return IssueDraft(
+            issue_type=issue_type,
+            severity=SEVERITY_MAP.get(rule.get("severity"), "S3"),
+            title=title[:255],
+            description=description[:2000],
+            suggestion=suggestion[:2000],
+            confidence=confidence,
+            evidence_block_ids=[b for b in dict.fromkeys(block_ids) if b is not None][:5],
+            page_no=None,
+            evidence_quotes=quotes or None,
+        )
+
+    @staticmethod
+    def _lines(seg: _Segment):
+        """按行切分片段，返回 (行首在片段中的偏移, 行文本)。"""
+        offset = 0
+        for line in seg.text.split("\n"):
+            yield offset, line
+            offset += len(line) + 1
+
+    def _quote(self, seg: _Segment, text: str, start: int | None = None) -> dict:
+        q = {"quote": text[:500]}
+        if seg.block_id is not None and seg.table is None and start is not None:
+            q.update({"block_id": seg.block_id, "char_start": start, "char_end": start + len(text)})
+        return q
+
+    def _pattern_hits(self, rule: dict, pattern: str, segs: list[_Segment]) -> list[IssueDraft]:
+        rx = re.compile(pattern)
+        drafts, seen = [], set()
+        for seg in segs:
+            for offset, line in self._lines(seg):
+                for m in rx.finditer(line):
+                    hit = m.group(0)
+                    if (hit, seg.block_id) in seen:
+                        continue
+                    seen.add((hit, seg.block_id))
+                    drafts.append(self._draft(
+                        rule,
+                        {"hit": hit, "line": line.strip()[:120], "cell": line.strip()[:120], "loc": seg.loc},
+                        [seg.block_id],
+                        [self._quote(seg, hit, offset + m.start())],
+                        confidence=0.85,
+                    ))
+                    if len(drafts) >= MAX_ISSUES_PER_RULE:
+                        return drafts
+        return drafts
+
+    def _form_violations(self, rule: dict, pattern: str, candidate: str, segs: list[_Segment]) -> list[IssueDraft]:
+        """pattern 为规范写法：在含提示词的行中按 candidate 找出待校验的写法（坐标、电话号码等），不符合 pattern 的才报。"""
+        rx, cand_rx = re.compile(pattern), re.compile(candidate)
+        hints = [h for t in rule.get("extract_targets") or [] for h in t.get("hints") or [] if h.strip()]
+        drafts, seen = [], set()
+        for seg in segs:
+            for offset, line in self._lines(seg):
+                if hints and not any(h in line for h in hints):
+                    continue
+                for m in cand_rx.finditer(line):
+                    hit = m.group(0).strip()
+                    if not hit or rx.fullmatch(hit) or (hit, seg.block_id) in seen:
+                        continue
+                    seen.add((hit, seg.block_id))
+                    drafts.append(self._draft(
+                        rule,
+                        {"hit": hit, "line": line.strip()[:120], "cell": line.strip()[:120], "loc": seg.loc},
+                        [seg.block_id],
+                        [self._quote(seg, hit, offset + m.start())],
+                        confidence=0.8,
+                    ))
+                    if len(drafts) >= MAX_ISSUES_PER_RULE:
+                        return drafts
+        return drafts
+
+    def _mode_regex_match(self, rule: dict, cmp: dict) -> list[IssueDraft] | None:
+        """
+        pattern 多为不规范写法，命中即报；带 candidate 的规则（如经纬度、手机号）pattern 为规范写法，
+        报告不符合 pattern 的候选写法。
+        """
+        if not cmp.get("pattern"):
+            return None
+        if cmp.get("candidate"):
+            return self._form_violations(rule, cmp["pattern"], cmp["candidate"], self._rule_segments(rule))
+        return self._pattern_hits(rule, cmp["pattern"], self._rule_segments(rule))
+
+    def _mode_forbidden_token(self, rule: dict, cmp: dict) -> list[IssueDraft] | None:
+        if not cmp.get("pattern"):
+            return None
+        hints = [h for t in rule.get("extract_targets") or [] for h in t.get("hints") or []]
+        segs = self._rule_segments(rule)
+        # 只看含提示词（如“工程师”“项目负责人”）的片段；都不含时退回整个范围
+        focused = [s for s in segs if any(h in s.text for h in hints)] or segs
+        return self._pattern_hits(rule, cmp["pattern"], focused)
+
+    def _mode_regex_not_match(self, rule: dict, cmp: dict) -> list[IssueDraft] | None:
+        """以提示词开头的“标签行”必须满足 pattern，不满足即报。"""
+        if not cmp.get("pattern"):
+            return None
+        rx = re.compile(cmp["pattern"])
+        drafts, seen = [], set()
+        for target in rule.get("extract_targets") or []:
+            labels = [h for h in target.get("hints") or [] if h.strip() and (_CJK_RE.search(h) or h.isalnum())]
+            for seg in self.segments(target.get("where") or "", target.get("hints") or []):
+                for offset, line in self._lines(seg):
+                    stripped = line.strip()
+                    if not stripped or len(stripped) > 120 or not any(stripped.startswith(h) for h in labels):
+                        continue
+                    if rx.search(stripped) or (seg.block_id, stripped) in seen:
+                        continue
+                    seen.add((seg.block_id, stripped))
+                    drafts.append(self._draft(
+                        rule,
+                        {"line": stripped, "hit": stripped, "loc": seg.loc},
+                        [seg.block_id],
+                        [self._quote(seg, stripped, offset + line.index(stripped))],
+                        confidence=0.8,
+                    ))
+        return drafts
+
+    def _mode_punctuation_check(self, rule: dict, cmp: dict) -> list[IssueDraft] | None:
+        segs = self._rule_segments(rule)
+        drafts = []
+        if cmp.get("pairs"):
+            for seg in segs:
+                for opening, closing in cmp["pairs"]:
+                    n_open, n_close = seg.text.count(opening), seg.text.count(closing)
+                    if n_open != n_close:
+                        detail = f"{seg.loc}：'{opening}' {n_open} 个，'{closing}' {n_close} 个：{seg.text.strip()[:60]}"
+                        drafts.append(self._draft(
+                            rule, {"detail": detail, "loc": seg.loc}, [seg.block_id],
+                            [self._quote(seg, seg.text.strip()[:120], 0)],
+                        ))
+                        break
+            return drafts
+        if cmp.get("style_unify"):
+            # 中文语境下的英文括号（紧邻汉字）与中文括号并存即视为混用
+            ascii_rx = re.compile(r"[一-鿿]\([^()]*\)|\([^()]*\)[一-鿿]")
+            ascii_segs = [s for s in segs if ascii_rx.search(s.text)]
+            full_count = sum(1 for s in segs if "（" in s.text)
+            if ascii_segs and full_count:
+                detail = f"中文括号 {full_count} 处段落，中文语境英文括号 {len(ascii_segs)} 处段落"
+                drafts.append(self._draft(
+                    rule, {"detail": detail},
+                    [s.block_id for s in ascii_segs],
+                    [self._quote(s, ascii_rx.search(s.text).group(0), ascii_rx.search(s.text).start()) for s in ascii_segs[:5]],
+                    confidence=0.8,
+                ))
+            return drafts
+        return None
+
+    def _mode_missing_section_check(self, rule: dict, cmp: dict) -> list[IssueDraft] | None:
+        required = cmp.get("required") or []
+        nodes = list(self.context.outline_index.values())
+        if not required or not nodes:
+            return None
+        missing = []
+        for req in required:
+            m = re.match(r"^\s*(\d+(?:\.\d+)*)\s*(.*)$", req)
+            number, title = (m.group(1), m.group(2).strip()) if m else (None, req.strip())
+            t = re.sub(r"\s+", "", title)
+            found = False
+            for n in nodes:
+                n_title = re.sub(r"\s+", "", n.get("title") or "")
+                if t and t in n_title:
+                    found = True
+                elif number and (n.get("node_no") or "").rstrip(".") == number:
+                    found = not t or SequenceMatcher(None, t, n_title).ratio() >= 0.6
+                if found:
+                    break
+            if not found:
+                missing.append(req)
+        if not missing:
+            return []
+        first = self._body[0]["id"] if self._body else (self._text_blocks[0]["id"] if self._text_blocks else None)
+        missing_list = "、".join(missing)
+        return [self._draft(rule, {"missing_list": missing_list, "missing_items": missing_list, "detail": missing_list}, [first])]
+
+    def _mode_unit_check(self, rule: dict, cmp: dict) -> list[IssueDraft] | None:
+        expected = cmp.get("expected_units") or []
+        forbidden = cmp.get("forbidden_units") or []
+        aliases = cmp.get("aliases") or []
+        if cmp.get("magnitude_infer") or cmp.get("cross_ref") or cmp.get("cross_section") or not expected:
+            # 量级推断、正文/表格口径互查需要语义判断，交给大模型
+            return None
+        if forbidden:
+            return self._unit_forbidden_in_headers(rule, expected, forbidden, cmp.get("value_range_hint"))
+        drafts, seen = [], set()
+        segs = self._rule_segments(rule)
+        for unit in expected:
+            rx = _loose_unit_pattern(unit)
+            for seg in segs:
+                for offset, line in self._lines(seg):
+                    hits = [(m.group(0), m.start()) for m in rx.finditer(line) if m.group(0) != unit]
+                    hits += [(a, line.find(a)) for a in aliases if a != unit and a in line]
+                    for hit, pos in hits:
+                        if (hit, seg.block_id) in seen:
+                            continue
+                        seen.add((hit, seg.block_id))
+                        detail = f"{seg.loc}：'{hit}' 应为 '{unit}'"
+                        drafts.append(self._draft(
+                            rule, {"hit": hit, "detail": detail, "unit": unit, "loc": seg.loc},
+                            [seg.block_id], [self._quote(seg, hit, offset + pos)], confidence=0.85,
+                        ))
+        return drafts
+
+    def _unit_forbidden_in_headers(self, rule, expected, forbidden, range_hint) -> list[IssueDraft]:
+        """表头写了禁用单位（扣除标准单位后仍出现），且该列数据量级落在 value_range_hint 内。"""
+        lo = hi = None
+        if range_hint:
+            m = re.match(r"^\s*([\d.]+)\s*[~～-]\s*([\d.]+)\s*$", str(range_hint))
+            if m:
+                lo, hi = float(m.group(1)), float(m.group(2))
+        hints = [h for t in rule.get("extract_targets") or [] if t.get("where") == "table" for h in t.get("hints") or []]
+        drafts = []
+        for t in self.context.tables:
+            if not self._table_matches(t, hints):
+                continue
+            cells = t.get("cells") or []
+            for h in cells:
+                if h["r"] > 1:
+                    continue
+                text = h.get("text") or ""
+                stripped = text
+                for u in expected:
+                    stripped = stripped.replace(u, "")
+                bad = next((u for u in forbidden if u in stripped), None)
+                if not bad:
+                    continue
+                values = [c["num_value"] for c in cells if c["c"] == h["c"] and c["r"] > h["r"] and c.get("num_value") is not None]
+                if not values or (lo is not None and not all(lo <= abs(v) <= hi for v in values)):
+                    continue
+                loc = f"表{t.get('table_no')}" if t.get("table_no") else (t.get("title") or f"表格{t['id']}")
+                detail = f"{loc} 第{h['c'] + 1}列表头单位 '{bad}'，数据 {_fmt(min(values))}~{_fmt(max(values))}"
+                drafts.append(self._draft(
+                    rule, {"header_unit": text.strip(), "detail": detail, "table_id": loc, "unit": bad},
+                    [self._table_block.get(t["id"])], [{"quote": text.strip()[:500]}],
+                ))
+        return drafts
+
+    # ---- 表内计算 ----
+
+    def _rule_tables(self, rule: dict) -> list[dict]:
+        hints = [h for t in rule.get("extract_targets") or [] if t.get("where") == "table" for h in t.get("hints") or []]
+        return [t for t in self.context.tables if t.get("cells") and self._table_matches(t, hints)]
+
+    @staticmethod
+    def _rows(table: dict) -> dict[int, dict[int, dict]]:
+        rows: dict[int, dict[int, dict]] = {}
+        for c in table.get("cells") or []:
+            rows.setdefault(c["r"], {})[c["c"]] = c
+        return rows
+
+    def _table_loc(self, table: dict) -> str:
+        return f"表{table.get('table_no')}" if table.get("table_no") else (table.get("title") or f"表格{table['id']}")
+
+    def _mode_sum_check_row(self, rule: dict, cmp: dict) -> list[IssueDraft] | None:
+        """合计行：每个数值列，合计行 = 上一合计行（或表头）之后各分项行之和。"""
+        tolerance = float(cmp.get("tolerance", 0.01))
+        drafts = []
+        for t in self._rule_tables(rule):
+            rows = self._rows(t)
+            start = None
+            for r in sorted(rows):
+                row = rows[r]
+                row_text = "".join((c.get("text") or "") for c in row.values())
+                if not any(kw in row_text for kw in SUM_KEYWORDS):
+                    if start is None:
+                        start = r
+                    continue
+                items = [rr for rr in sorted(rows) if start is not None and start <= rr < r and rr > 0]
+                start = None
+                for col, cell in row.items():
+                    total = cell.get("num_value")
+                    if total is None:
+                        continue
+                    vals = [rows[rr][col]["num_value"] for rr in items if col in rows[rr] and rows[rr][col].get("num_value") is not None]
+                    if len(vals) < 2:
+                        continue
+                    s = sum(vals)
+                    if abs(s - total) > tolerance:
+                        loc = self._table_loc(t)
+                        detail = f"{loc} 第{r + 1}行第{col + 1}列：合计={_fmt(total)}，分项和={_fmt(s)}，差值={_fmt(total - s)}"
+                        drafts.append(self._draft(
+                            rule,
+                            {"table_id": loc, "sum_val": _fmt(total), "items_sum": _fmt(s), "diff": _fmt(total - s), "detail": detail},
+                            [self._table_block.get(t["id"])], [{"quote": detail}], confidence=0.9,
+                        ))
+        return drafts
+
+    def _mode_sum_check_col(self, rule: dict, cmp: dict) -> list[IssueDraft] | None:
+        """合计列：表头含合计的列 = 同行其左侧各数值列之和（不含首列序号/名称）。"""
+        tolerance = float(cmp.get("tolerance", 0.01))
+        drafts = []
+        for t in self._rule_tables(rule):
+            rows = self._rows(t)
+            header = rows.get(0, {})
+            sum_cols = [c for c, cell in header.items() if any(kw in (cell.get("text") or "") for kw in SUM_KEYWORDS)]
+            skip_cols = {c for c, cell in header.items() if re.search(r"序号|编号|单价|比例|%|单位", cell.get("text") or "")}
+            for sc in sum_cols:
+                for r in sorted(rows):
+                    if r == 0:
+                        continue
+                    total = rows[r].get(sc, {}).get("num_value")
+                    if total is None:
+                        continue
+                    vals = [
+                        cell["num_value"] for c, cell in rows[r].items()
+                        if 0 < c < sc and c not in skip_cols and c not in sum_cols and cell.get("num_value") is not None
+                    ]
+                    if len(vals) < 2:
+                        continue
+                    s = sum(vals)
+                    if abs(s - total) > tolerance:
+                        loc = self._table_loc(t)
+                        detail = f"{loc} 第{r + 1}行：合计列={_fmt(total)}，各列和={_fmt(s)}，差值={_fmt(total - s)}"
+                        drafts.append(self._draft(
+                            rule,
+                            {"table_id": loc, "sum_val": _fmt(total), "items_sum": _fmt(s), "diff": _fmt(total - s), "detail": detail},
+                            [self._table_block.get(t["id"])], [{"quote": detail}], confidence=0.85,
+                        ))
+        return drafts
+
+    def _mode_percentage_sum_check(self, rule: dict, cmp: dict) -> list[IssueDraft] | None:
+        target = float(cmp.get("target", 100))
+        tolerance = float(cmp.get("tolerance", 0.5))
+        drafts = []
+        for t in self._rule_tables(rule):
+            rows = self._rows(t)
+            header = rows.get(0, {})
+            for col, cell in header.items():
+                if not re.search(r"%|％|百分比|比例|占比", cell.get("text") or ""):
+                    continue
+                vals = []
+                for r in sorted(rows):
+                    if r == 0 or col not in rows[r]:
+                        continue
+                    row_text = "".join((c.get("text") or "") for c in rows[r].values())
+                    if any(kw in row_text for kw in SUM_KEYWORDS):
+                        continue
+                    v = rows[r][col].get("num_value")
+                    if v is not None:
+                        vals.append(v)
+                if len(vals) < 2:
+                    continue
+                s = sum(vals)
+                if abs(s - target) > tolerance:
+                    loc = self._table_loc(t)
+                    detail = f"{loc} 第{col + 1}列百分比合计={_fmt(s)}%，应为{_fmt(target)}%"
+                    drafts.append(self._draft(
+                        rule, {"table_id": loc, "sum": _fmt(s), "diff": _fmt(s - target), "detail": detail},
+                        [self._table_block.get(t["id"])], [{"quote": detail}], confidence=0.85,
+                    ))
+        return drafts
+
+    # ---- 字段取值比对 ----
+
+    def _field_values(self, rule: dict, numeric: bool) -> list[dict]:
+        """
+        按标签抽取字段值：正文/前置页取“标签：值”（数值字段允许“标签为 12.3hm²”），
+        表格取标签单元格右侧单元格。返回 [{where, loc, block_id, raw, quote_start}]。
+        """
+        field_labels = [p.strip() for p in re.split(r"[/、]", rule.get("field_label") or "") if _is_label(p.strip())]
+        values = []
+        for target in rule.get("extract_targets") or []:
+            where = target.get("where") or ""
+            labels = sorted({*field_labels, *(h for h in target.get("hints") or [] if _is_label(h))}, key=len, reverse=True)
+            if not labels:
+                continue
+            alt = "|".join(re.escape(lb) for lb in labels)
+            sep = r"\s*(?:[：:]|为|是|约)\s*" if numeric else r"\s*[：:]\s*"
+            rx = re.compile(rf"(?:{alt}){sep}([^\n；;。，,]{{1,80}})")
+            for seg in self.segments(where, target.get("hints") or []):
+                if seg.table is not None:
+                    continue
+                for m in rx.finditer(seg.text):
+                    raw = m.group(1).strip()
+                    if raw and (not numeric or parse_number(raw) is not None):
+                        values.append({"where": where, "loc": seg.loc, "block_id": seg.block_id, "raw": raw, "start": m.start(1)})
+                        break
+            if where == "table":
+                for t in self.context.tables:
+                    if not self._table_matches(t, target.get("hints") or []):
+                        continue
+                    rows = self._rows(t)
+                    for row in rows.values():
+                        for c, cell in row.items():
+                            text = re.sub(r"\s+", "", cell.get("text") or "")
+                            if text in labels and c + 1 in row and (row[c + 1].get("text") or "").strip():
+                                raw = row[c + 1]["text"].strip()
+                                if not numeric or parse_number(raw) is not None:
+                                    values.append({"where": where, "loc": self._table_loc(t), "block_id": self._table_block.get(t["id"]), "raw": raw, "start": None})
+        return values
+
+    def _preferred(self, rule: dict, values: list[dict]) -> dict:
+        order = rule.get("source_priority") or []
+
+        def rank(v):
+            if v["where"] in order:
+                return order.index(v["where"])
+            return order.index("others") if "others" in order else len(order)
+
+        return min(values, key=rank)
+
+    def _compare_values(self, rule: dict, cmp: dict, values: list[dict], numeric: bool, same) -> list[IssueDraft] | None:
+        if len({v["loc"] for v in values}) < 2:
+            # 只在一处（或零处）取到字段值，无法本地比对，交给大模型
+            return None
+        ops = rule.get("normalize") or []
+        for v in values:
+            v["norm"] = normalize_value(v["raw"], ops)
+        ref = self._preferred(rule, values)
+        drafts, reported = [], set()
+        for v in values:
+            if v is ref or v["loc"] == ref["loc"] or same(ref, v) or (v["loc"], v["norm"]) in reported:
+                continue
+            reported.add((v["loc"], v["norm"]))
+            val_a, val_b = ref["raw"], v["raw"]
+            if numeric:
+                val_a, val_b = _fmt(ref["num"]), _fmt(v["num"])
+            detail = f"{ref['loc']}='{val_a}' vs {v['loc']}='{val_b}'"
+            quotes = [
+                {"quote": x["raw"][:500], **({"block_id": x["block_id"], "char_start": x["start"], "char_end": x["start"] + len(x["raw"])}
+                                            if x["start"] is not None and x["block_id"] is not None else {})}
+                for x in (ref, v)
+            ]
+            drafts.append(self._draft(
+                rule,
+                {
+                    "loc_a": ref["loc"], "loc_b": v["loc"], "val_a": val_a, "val_b": val_b,
+                    "detail": detail, "unit": cmp.get("unit") or "",
+                    "recommended_value": ref["raw"], "source_preferred": ref["loc"],
+                    "label": rule.get("field_label") or "", "value": val_b,
+                },
+                [v["block_id"], ref["block_id"]], quotes, confidence=0.8,
+            ))
+        return drafts
+
+    def _mode_all_equal(self, rule: dict, cmp: dict) -> list[IssueDraft] | None:
+        values = self._field_values(rule, False)
+        return self._compare_values(rule, cmp, values, False, lambda a, b: a["norm"] == b["norm"])
+
+    def _mode_fuzzy_equal(self, rule: dict, cmp: dict) -> list[IssueDraft] | None:
+        threshold = float(cmp.get("threshold", 0.95))
+        values = self._field_values(rule, False)
+        return self._compare_values(
+            rule, cmp, values, False, lambda a, b: SequenceMatcher(None, a["norm"], b["norm"]).ratio() >= threshold
+        )
+
+    def _mode_numeric_equal(self, rule: dict, cmp: dict) -> list[IssueDraft] | None:
+        if cmp.get("source_a") or cmp.get("source_b"):
+            # 计数类口径（正文“共布设X个” vs 表格行数）需要理解表格结构，交给大模型
+            return None
+        unit = cmp.get("unit")
+        if not unit:
+            unit = next((_NORMALIZE_UNIT_TARGET[op] for op in rule.get("normalize") or [] if op in _NORMALIZE_UNIT_TARGET), None)
+        tolerance = float(cmp.get("tolerance", 0.01))
+        values = []
+        for v in self._field_values(rule, True):
+            v["num"] = parse_number(v["raw"], unit)
+            if v["num"] is not None:
+                values.append(v)
+        return self._compare_values(rule, cmp, values, True, lambda a, b: abs(a["num"] - b["num"]) <= tolerance)
@@ -0,0 +1,141 @@
+import json
+
+from .. import db
+from ..settings import settings
+
+_schema = settings.DB_SCHEMA
+
+
+def insert_request_log(
+    run_id: int | None,
+    batch_key: str | None,
+    rule_ids: list | None,
+    attempt: int,
+    model: str | None,
+    stream: bool,
+    http_status: int | None,
+    success: bool,
+    prompt_tokens: int | None,
+    completion_tokens: int | None,
+    total_tokens: int | None,
+    latency_ms: int,
+    error_message: str | None = None,
+    cached_tokens: int | None = None,
+) -> None:
+    sql = f"""
+    INSERT INTO {_schema}.ai_request_log
+      (run_id, batch_key, rule_ids, attempt, model, stream, http_status, success,
+       prompt_tokens, completion_tokens, total_tokens, cached_tokens, latency_ms, error_message)
+    VALUES
+      (%(run_id)s, %(batch_key)s, %(rule_ids)s, %(attempt)s, %(model)s, %(stream)s, %(http_status)s, %(success)s,
+       %(prompt_tokens)s, %(completion_tokens)s, %(total_tokens)s, %(cached_tokens)s, %(latency_ms)s, %(error_message)s)
+    """
+    db.execute(sql, {
+        "run_id": run_id,
+        "batch_key": (batch_key or "")[:255] or None,
+        "rule_ids": json.dumps(rule_ids or []),
+        "attempt": attempt,
+        "model": model,
+        "stream": stream,
+        "http_status": http_status,
+        "success": success,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": total_tokens,
+        "cached_tokens": cached_tokens,
+        "latency_ms": latency_ms,
+        "error_message": (error_message or "")[:2000] or None,
+    })
+
+
+def _with_cache_ratio(row: dict | None) -> dict | None:
+    """cached_ratio = 命中前缀缓存的提示 token / 提示 token。"""
+    if row is not None:
+        prompt = row.get("prompt_tokens") or 0
+        row["cached_ratio"] = round((row.get("cached_tokens") or 0) / prompt, 4) if prompt else 0.0
+    return row
+
+
+def get_run_tokens(run_id: int) -> int:
+    """审查运行已消耗的 token（跨 worker 汇总，用于分发执行时的预算检查）。"""
+    row = db.fetch_one(
+        f"SELECT COALESCE(SUM(total_tokens), 0) AS total FROM {_schema}.ai_request_log WHERE run_id = %(run_id)s",
+        {"run_id": run_id},
+    )
+    return int(row["total"]) if row else 0
+
+
+def get_run_usage(run_id: int) -> dict:
+    """单次审查运行的用量汇总 + 按批明细（按 token 降序），含前缀缓存命中比例。"""
+    totals = db.fetch_one(
+        f"""
+        SELECT COUNT(*) AS requests,
+               COUNT(*) FILTER (WHERE attempt > 1) AS retries,
+               COUNT(*) FILTER (WHERE NOT success) AS failures,
+               COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,
+               COALESCE(SUM(completion_tokens), 0) AS completion_tokens,
+               COALESCE(SUM(total_tokens), 0) AS total_tokens,
+               COALESCE(SUM(cached_tokens), 0) AS cached_tokens,
+               COALESCE(SUM(latency_ms), 0) AS latency_ms_sum,
+               COALESCE(MAX(latency_ms), 0) AS latency_ms_max
+        FROM {_schema}.ai_request_log
+        WHERE run_id = %(run_id)s
+        """,
+        {"run_id": run_id},
+    )
+    batches = db.fetch_all(
+        f"""
+        SELECT batch_key,
+               COUNT(*) AS requests,
+               MAX(attempt) AS attempts,
+               BOOL_OR(success) AS success,
+               COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,
+               COALESCE(SUM(completion_tokens), 0) AS completion_tokens,
+               COALESCE(SUM(total_tokens), 0) AS total_tokens,
+               COALESCE(SUM(cached_tokens), 0) AS cached_tokens,
+               COALESCE(SUM(latency_ms), 0) AS latency_ms,
+               ARRAY_AGG(DISTINCT http_status) FILTER (WHERE http_status IS NOT NULL) AS http_statuses
+        FROM {_schema}.ai_request_log
+        WHERE run_id = %(run_id)s
+        GROUP BY batch_key
+        ORDER BY total_tokens DESC
+        """,
+        {"run_id": run_id},
+    )
+    return {
+        "run_id": run_id,
+        "totals": _with_cache_ratio(totals),
+        "batches": [_with_cache_ratio(b) for b in batches],
+    }
+
+
+def list_batch_stats(user_id: int, limit: int = 20, order_by: str = "tokens") -> list[dict]:
+    """跨运行按规则批聚合，找出最贵（tokens）或最慢（latency）的规则组合；只统计 user_id 所属项目的运行。"""
+    order = "avg_total_tokens" if order_by == "tokens" else "avg_latency_ms"
+    sql = f"""
+    SELECT batch_key,
+           COUNT(DISTINCT run_id) AS runs,
+           COUNT(*) AS requests,
+           COUNT(*) FILTER (WHERE attempt > 1) AS retries,
+           COUNT(*) FILTER (WHERE NOT success) AS failures,
+           ROUND(AVG(total_tokens))::int AS avg_total_tokens,
+           ROUND(AVG(prompt_tokens))::int AS avg_prompt_tokens,
+           ROUND(AVG(completion_tokens))::int AS avg_completion_tokens,
+           ROUND(SUM(COALESCE(cached_tokens, 0))::numeric / NULLIF(SUM(prompt_tokens), 0), 4) AS cached_ratio,
+           ROUND(AVG(latency_ms))::int AS avg_latency_ms,
+           MAX(latency_ms) AS max_latency_ms
+    FROM {_schema}.ai_request_log
+    WHERE batch_key IS NOT NULL
+      AND run_id IN (
+          SELECT rr.id
+          FROM {_schema}.review_run rr
+          JOIN {_schema}.document_version dv ON dv.id = rr.version_id
+          JOIN {_schema}.document d ON d.id = dv.document_id
+          JOIN {_schema}.project_member pm ON pm.project_id = d.project_id
+          WHERE pm.user_id = %(user_id)s
+      )
+    GROUP BY batch_key
+    ORDER BY {order} DESC NULLS LAST
+    LIMIT %(limit)s
+    """
+    return db.fetch_all(sql, {"limit": limit, "user_id": user_id})
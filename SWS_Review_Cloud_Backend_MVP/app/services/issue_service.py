@@ -1,13 +1,16 @@
 from .. import db
 from ..settings import settings
+from .review_run_service import review_issue_columns
 
 _schema = settings.DB_SCHEMA
 
 
 def get_issue(issue_id: int) -> dict | None:
+    # provenance（合并来源）列需迁移 015，未迁移时不查询
+    provenance = ", provenance" if "provenance" in review_issue_columns() else ""
     sql = f"""
     SELECT id, version_id, run_id, issue_type, severity, title, description, suggestion,
-           confidence, status, page_no, evidence_block_ids, evidence_quotes, anchor_rects, created_at, updated_at
+           confidence, status, page_no, evidence_block_ids, evidence_quotes, anchor_rects, created_at, updated_at{provenance}
     FROM {_schema}.review_issue
     WHERE id = %(issue_id)s
     """
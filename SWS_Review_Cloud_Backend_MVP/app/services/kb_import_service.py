@@ -0,0 +1,257 @@
+"""
+知识库包导入（docs/kb_package_*：kb_sources.json + kb_chunks.jsonl + manifest.json）：
+- kb_chunks.jsonl 按行流式读取（二进制逐行，内存占用与文件大小无关），校验每行 hash = sha256(chunk_text)
+- 每 batch_size 行 COPY 进临时表后一次 INSERT ... ON CONFLICT DO NOTHING（见 kb_service.copy_chunk_rows），每批单独提交
+- 每批提交后把已处理到的字节偏移写入包目录下的断点文件，中断后再次导入从断点继续（重复行由唯一约束跳过）
+- defer_indexes 时导入前删除 kb_chunk 的二级索引（唯一约束保留），导入完成后按原定义重建并 ANALYZE
+- 全部导入后将知识库置为 READY，并重建本地 BM25 索引
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Callable, Iterator
+
+from .. import db
+from ..settings import settings
+from . import file_service, kb_service
+
+logger = logging.getLogger(__name__)
+_schema = settings.DB_SCHEMA
+
+SOURCES_FILE = "kb_sources.json"
+CHUNKS_FILE = "kb_chunks.jsonl"
+MANIFEST_FILE = "manifest.json"
+STATE_FILE = ".kb_import_state.json"
+
+# 每批行数（每批一个事务、一次断点）
+IMPORT_BATCH = 5000
+# 单行 JSON 上限（字节），超过视为坏行
+MAX_LINE_BYTES = 1024 * 1024
+
+
+def package_path(package: str) -> str:
+    """API 传入的包名解析为 KB_IMPORT_ROOT 下的目录，不允许越出该目录。"""
+    root = os.path.realpath(settings.KB_IMPORT_ROOT)
+    path = os.path.realpath(os.path.join(root, package))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f"知识库包须位于 {settings.KB_IMPORT_ROOT} 下")
+    return path
+
+
+def _load_json(path: str, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_state(package_dir: str) -> dict | None:
+    return _load_json(os.path.join(package_dir, STATE_FILE))
+
+
+def _save_state(package_dir: str, state: dict) -> None:
+    """断点文件先写临时文件再改名，中断时不会留下半个文件。"""
+    path = os.path.join(package_dir, STATE_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def iter_jsonl(path: str, offset: int = 0) -> Iterator[tuple[int, dict | None]]:
+    """从字节偏移 offset 起逐行读取，产出 (本行结束处的偏移, 对象)；坏行（无法解析或超长）对象为 None。"""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while True:
+            raw = f.readline(MAX_LINE_BYTES + 1)
+            if not raw:
+                return
+            if len(raw) > MAX_LINE_BYTES and not raw.endswith(b"\n"):
+                # 超长行：跳到行尾
+                while raw and not raw.endswith(b"\n"):
+                    offset += len(raw)
+                    raw = f.readline(MAX_LINE_BYTES + 1)
+                offset += len(raw)
+                yield offset, None
+                continue
+            offset += len(raw)
+            if not raw.strip():
+                continue
+            try:
+                obj = json.loads(raw)
+            except ValueError:
+                obj = None
+            yield offset, obj
+
+
+def secondary_indexes() -> list[dict]:
+    """kb_chunk 上的非唯一索引（名称与定义），导入时可先删除、导入后重建。"""
+    return db.fetch_all(
+        """
+        SELECT i.indexname AS name, i.indexdef AS definition
+        FROM pg_indexes i
+        JOIN pg_class c ON c.relname = i.indexname
+        JOIN pg_namespace n ON n.oid = c.relnamespace AND n.nspname = i.schemaname
+        JOIN pg_index x ON x.indexrelid = c.oid
+        WHERE i.schemaname = %(schema)s AND i.tablename = 'kb_chunk' AND NOT x.indisunique
+        ORDER BY i.indexname
+        """,
+        {"schema": _schema},
+    )
+
+
+def _drop_indexes(indexes: list[dict]) -> None:
+    for idx in indexes:
+        db.execute(f"DROP INDEX IF EXISTS {_schema}.{idx['name']}")
+        logger.info(f"导入前删除索引 {idx['name']}")
+
+
+def _restore_indexes(indexes: list[dict]) -> None:
+    existing = {i["name"] for i in secondary_indexes()}
+    for idx in indexes:
+        if idx["name"] in existing:
+            continue
+        t0 = time.perf_counter()
+        db.execute(idx["definition"])
+        logger.info(f"重建索引 {idx['name']}，耗时 {time.perf_counter() - t0:.1f}s")
+    db.execute(f"ANALYZE {_schema}.kb_chunk")
+
+
+def _ensure_source(src: dict, storage: str, bucket: str) -> int:
+    """按 sha256 复用或创建 file_object（源文件不入存储），按 (name, file_id) 复用或创建 kb_source，返回 kb_source.id。"""
+    sha256 = src.get("sha256")
+    row = db.fetch_one(
+        f"SELECT id FROM {_schema}.file_object WHERE sha256 = %(sha256)s ORDER BY id LIMIT 1", {"sha256": sha256}
+    ) if sha256 else None
+    file_id = row["id"] if row else file_service.create_file_object(
+        storage, bucket, f"kb/{src['filename']}", src["filename"], "application/pdf", int(src.get("size") or 0), sha256
+    )
+    row = db.fetch_one(
+        f"SELECT id FROM {_schema}.kb_source WHERE name = %(name)s AND file_id = %(file_id)s ORDER BY id LIMIT 1",
+        {"name": src["name"], "file_id": file_id},
+    )
+    return row["id"] if row else kb_service.create_kb_source(src["name"], src.get("kb_type") or "NORM", file_id)
+
+
+def import_package(
+    package_dir: str,
+    batch_size: int = IMPORT_BATCH,
+    resume: bool = True,
+    defer_indexes: bool = False,
+    strict: bool = False,
+    storage: str = "local",
+    bucket: str = "kb",
+    on_progress: Callable[[dict], None] | None = None,
+) -> dict:
+    """
+    导入知识库包，返回统计 {sources, rows, inserted, duplicates, bad_hash, bad_lines, unknown_source, seconds, rows_per_sec}。
+    strict 时遇到 hash 不符或坏行直接抛 ValueError（已提交的批次保留，修正后可续传）；否则跳过并计数。
+    on_progress(stats) 每批提交后回调一次。
+    """
+    sources = _load_json(os.path.join(package_dir, SOURCES_FILE))
+    chunks_path = os.path.join(package_dir, CHUNKS_FILE)
+    if sources is None or not os.path.exists(chunks_path):
+        raise ValueError(f"{package_dir} 下缺少 {SOURCES_FILE} 或 {CHUNKS_FILE}")
+    manifest = _load_json(os.path.join(package_dir, MANIFEST_FILE), {})
+
+    saved = load_state(package_dir)
+    state = saved if resume else None
+    if state is None or state.get("done"):
+        state = {
+            "offset": 0,
+            "sources": {},
+            # 上次 defer_indexes 导入中断时，已删除索引的定义只保存在断点文件里：从头导入也要沿用，否则再也无法重建
+            "indexes": saved["indexes"] if saved and not saved.get("done") and saved.get("indexes") else [],
+            "done": False,
+            "stats": {"rows": 0, "inserted": 0, "duplicates": 0, "bad_hash": 0, "bad_lines": 0, "unknown_source": 0},
+        }
+    elif state["offset"]:
+        logger.info(f"从断点续传：偏移 {state['offset']}，已导入 {state['stats']['inserted']} 条")
+
+    for src in sources:
+        key = str(src["source_local_id"])
+        if key not in state["sources"]:
+            state["sources"][key] = _ensure_source(src, storage, bucket)
+    if defer_indexes and not state["indexes"]:
+        state["indexes"] = secondary_indexes()
+    _save_state(package_dir, state)
+    if defer_indexes:
+        _drop_indexes(state["indexes"])
+
+    stats = state["stats"]
+    stats["expected"] = manifest.get("chunk_count")
+    source_ids = {int(k): v for k, v in state["sources"].items()}
+    t0 = time.perf_counter()
+    rows_at_start = stats["rows"]
+    batch: list[dict] = []
+
+    def _flush(offset: int) -> None:
+        """提交当前批次并把断点推进到 offset。"""
+        nonlocal batch
+        if batch:
+            with db.pool.connection() as conn:
+                inserted = kb_service.copy_chunk_rows(conn, batch)
+            stats["inserted"] += inserted
+            stats["duplicates"] += len(batch) - inserted
+            batch = []
+        state["offset"] = offset
+        _save_state(package_dir, state)
+        elapsed = time.perf_counter() - t0
+        stats["rows_per_sec"] = round((stats["rows"] - rows_at_start) / elapsed, 1) if elapsed > 0 else 0.0
+        if on_progress:
+            on_progress(dict(stats))
+
+    line_start = state["offset"]
+    for offset, obj in iter_jsonl(chunks_path, state["offset"]):
+        if not isinstance(obj, dict) or not obj.get("chunk_text"):
+            if strict:
+                _flush(line_start)
+                raise ValueError(f"坏行：字节偏移 {line_start} 处的行无法解析或缺少 chunk_text")
+            stats["rows"] += 1
+            stats["bad_lines"] += 1
+            line_start = offset
+            continue
+        text = obj["chunk_text"]
+        h = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        if obj.get("hash") and obj["hash"] != h:
+            if strict:
+                _flush(line_start)
+                raise ValueError(f"hash 不符：字节偏移 {line_start} 处的行（{obj['hash'][:12]}… ≠ {h[:12]}…）")
+            stats["rows"] += 1
+            stats["bad_hash"] += 1
+            line_start = offset
+            continue
+        stats["rows"] += 1
+        line_start = offset
+        source_id = source_ids.get(obj.get("kb_source_local_id") or obj.get("source_local_id"))
+        if source_id is None:
+            stats["unknown_source"] += 1
+            continue
+        # 入库正文截断到 10000 字，哈希按截断后的正文计算，与 kb_service.insert_chunks_bulk 写入的哈希一致
+        if len(text) > 10000:
+            text = text[:10000]
+            h = kb_service.chunk_hash(text)
+        batch.append({"kb_source_id": source_id, "chunk_text": text, "meta_json": obj.get("meta_json"), "hash": h})
+        if len(batch) >= batch_size:
+            _flush(offset)
+    _flush(line_start)
+
+    if state["indexes"]:
+        _restore_indexes(state["indexes"])
+    for source_id in source_ids.values():
+        kb_service.set_kb_source_ready(source_id)
+    state["done"] = True
+    _save_state(package_dir, state)
+
+    from ..ai import kb_bm25
+    try:
+        kb_bm25.rebuild()
+    except Exception as e:
+        logger.warning(f"重建 KB BM25 索引失败（可稍后投递 rebuild_kb_bm25_task）: {e}")
+
+    stats["sources"] = len(source_ids)
+    stats["seconds"] = round(time.perf_counter() - t0, 1)
+    logger.info(f"知识库包导入完成：{json.dumps(stats, ensure_ascii=False)}")
+    return stats
@@ -1,7 +1,70 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Iterable
+
 from .. import db
+from ..ai.kb_tokenizer import search_terms
 from ..settings import settings
+from ..utils.redis_client import get_redis
 
 _schema = settings.DB_SCHEMA
+logger = logging.getLogger(__name__)
+
+# 批量入库每批行数（每批一个事务）
+INGEST_BATCH = 2000
+
+# 知识库代号（Redis 计数器）：任一 kb_source 状态变化或向量写入后加一，检索缓存键带代号，旧缓存自然失效
+_GENERATION_KEY = "sws:kb:generation"
+# 进程内读取代号的间隔（秒）
+GENERATION_CHECK = 5
+
+_generation: tuple[float, str] = (0.0, "0")
+
+_chunk_columns: frozenset[str] | None = None
+_chunk_columns_lock = threading.Lock()
+
+
+def kb_chunk_columns() -> frozenset[str]:
+    """kb_chunk 现有列集合（进程内只查一次），用于判断全文检索等迁移是否已执行。"""
+    global _chunk_columns
+    if _chunk_columns is None:
+        with _chunk_columns_lock:
+            if _chunk_columns is None:
+                rows = db.fetch_all(
+                    """
+                    SELECT column_name FROM information_schema.columns
+                    WHERE table_schema = %(schema)s AND table_name = 'kb_chunk'
+                    """,
+                    {"schema": _schema},
+                )
+                _chunk_columns = frozenset(r["column_name"] for r in rows)
+    return _chunk_columns
+
+
+def kb_generation() -> str:
+    """当前知识库代号（进程内缓存 GENERATION_CHECK 秒）；Redis 不可用时沿用上次读到的值。"""
+    global _generation
+    now = time.monotonic()
+    if now - _generation[0] < GENERATION_CHECK:
+        return _generation[1]
+    try:
+        _generation = (now, get_redis().get(_GENERATION_KEY) or "0")
+    except Exception as e:
+        logger.warning(f"读取知识库代号失败: {e}")
+        _generation = (now, _generation[1])
+    return _generation[1]
+
+
+def bump_generation() -> None:
+    """知识库内容变化：代号加一（本进程立即生效，其他进程 GENERATION_CHECK 秒内生效）。"""
+    global _generation
+    try:
+        _generation = (time.monotonic(), str(get_redis().incr(_GENERATION_KEY)))
+    except Exception as e:
+        logger.warning(f"更新知识库代号失败: {e}")
 
 
 def create_kb_source(name: str, kb_type: str, file_id: int) -> int:
@@ -13,7 +76,9 @@ def create_kb_source(name: str, kb_type: str, file_id: int) -> int:
     with db.pool.connection() as conn:
         with conn.cursor() as cur:
             cur.execute(sql, {"name": name, "kb_type": kb_type, "file_id": file_id})
-            return cur.fetchone()[0]
+            source_id = cur.fetchone()[0]
+    bump_generation()
+    return source_id
 
 
 def list_kb_sources() -> list[dict]:
@@ -25,6 +90,18 @@ def list_kb_sources() -> list[dict]:
     return db.fetch_all(sql, {})
 
 
+def list_source_ids(kb_type: str | None = None) -> list[int]:
+    """指定类型（为空时不限类型）的 READY 知识库 ID。"""
+    if kb_type is None:
+        rows = db.fetch_all(f"SELECT id FROM {_schema}.kb_source WHERE status = 'READY'")
+    else:
+        rows = db.fetch_all(
+            f"SELECT id FROM {_schema}.kb_source WHERE kb_type = %(kb_type)s AND status = 'READY'",
+            {"kb_type": kb_type},
+        )
+    return [r["id"] for r in rows]
+
+
 def get_kb_source(source_id: int) -> dict | None:
     sql = f"""
     SELECT id, name, kb_type, file_id, status, error_message
@@ -37,11 +114,32 @@ def get_kb_source(source_id: int) -> dict | None:
 def set_kb_source_ready(source_id: int) -> None:
     sql = f"UPDATE {_schema}.kb_source SET status = 'READY', updated_at = now() WHERE id = %(source_id)s"
     db.execute(sql, {"source_id": source_id})
+    bump_generation()
+
+
+def set_kb_source_processing(source_id: int) -> None:
+    sql = f"UPDATE {_schema}.kb_source SET status = 'PROCESSING', error_message = NULL, updated_at = now() WHERE id = %(source_id)s"
+    db.execute(sql, {"source_id": source_id})
+    bump_generation()
+    _queue_bm25_rebuild()
 
 
 def set_kb_source_failed(source_id: int, error_message: str) -> None:
     sql = f"UPDATE {_schema}.kb_source SET status = 'FAILED', error_message = %(msg)s, updated_at = now() WHERE id = %(source_id)s"
     db.execute(sql, {"source_id": source_id, "msg": error_message[:2000]})
+    bump_generation()
+    _queue_bm25_rebuild()
+
+
+def _queue_bm25_rebuild() -> None:
+    """知识库离开 READY（重新索引 / 失败）：投递 worker 本地 BM25 索引重建，索引中不再保留其 chunk。"""
+    if not settings.KB_LOCAL_INDEX:
+        return
+    from ..worker.kb_tasks import rebuild_kb_bm25_task
+    try:
+        rebuild_kb_bm25_task.delay()
+    except Exception as e:
+        logger.warning(f"投递 KB BM25 索引重建失败: {e}")
 
 
 def insert_chunk(kb_source_id: int, chunk_text: str, meta_json: dict | None, hash_val: str, embedding: list[float] | None = None) -> int | None:
@@ -64,6 +162,11 @@ def insert_chunk(kb_source_id: int, chunk_text: str, meta_json: dict | None, has
     if embedding is not None and has_embedding_col:
         fields.append("embedding")
         values.append("%(embedding)s")
+    # 全文检索词（018 迁移后）
+    with_terms = "search_terms" in kb_chunk_columns()
+    if with_terms:
+        fields += ["search_terms", "term_count"]
+        values += ["%(search_terms)s", "%(term_count)s"]
     
     sql = f"""
     INSERT INTO {_schema}.kb_chunk ({', '.join(fields)})
@@ -79,6 +182,8 @@ def insert_chunk(kb_source_id: int, chunk_text: str, meta_json: dict | None, has
                 "meta_json": json.dumps(meta_json or {}),
                 "hash": hash_val,
             }
+            if with_terms:
+                params["search_terms"], params["term_count"] = search_terms(params["chunk_text"])
             if embedding is not None and has_embedding_col:
                 # 将list转换为PostgreSQL的vector类型
                 params["embedding"] = str(embedding)  # psycopg会自动转换
@@ -102,3 +207,102 @@ def insert_chunk(kb_source_id: int, chunk_text: str, meta_json: dict | None, has
                     row = cur.fetchone()
                     return row[0] if row else None
                 raise
+
+
+def backfill_search_terms(batch_size: int = 500) -> int:
+    """为尚无检索词的 chunk（018 迁移前入库）补写 search_terms / term_count，返回处理条数。"""
+    if "search_terms" not in kb_chunk_columns():
+        return 0
+    total = 0
+    while True:
+        rows = db.fetch_all(
+            f"""
+            SELECT id, chunk_text FROM {_schema}.kb_chunk
+            WHERE search_terms IS NULL
+            ORDER BY id
+            LIMIT %(limit)s
+            """,
+            {"limit": batch_size},
+        )
+        if not rows:
+            return total
+        updates = []
+        for r in rows:
+            terms, count = search_terms(r["chunk_text"])
+            updates.append({"id": r["id"], "terms": terms, "count": count})
+        db.executemany(
+            f"UPDATE {_schema}.kb_chunk SET search_terms = %(terms)s, term_count = %(count)s WHERE id = %(id)s",
+            updates,
+        )
+        total += len(rows)
+
+
+def chunk_hash(chunk_text: str) -> str:
+    return hashlib.sha256(chunk_text.encode("utf-8")).hexdigest()
+
+
+def insert_chunks_bulk(
+    kb_source_id: int,
+    chunks: Iterable[tuple[str, dict | None]],
+    batch_size: int = INGEST_BATCH,
+    progress=None,
+) -> int:
+    """
+    批量写入 chunk：(正文, meta) 流在内存中计算哈希并去重，每 batch_size 条 COPY 进临时表后
+    一次 INSERT ... SELECT ... ON CONFLICT 写入 kb_chunk，每批单独提交。
+    progress 为 ProgressReporter（可选），每批 update 一次。返回新写入条数（已存在的哈希不计）。
+    """
+    seen: set[str] = set()
+    batch: list[dict] = []
+    inserted = 0
+    with db.pool.connection() as conn:
+        for chunk_text, meta in chunks:
+            chunk_text = chunk_text[:10000]
+            h = chunk_hash(chunk_text)
+            if h in seen:
+                continue
+            seen.add(h)
+            batch.append({"kb_source_id": kb_source_id, "chunk_text": chunk_text, "meta_json": meta, "hash": h})
+            if len(batch) >= batch_size:
+                inserted += copy_chunk_rows(conn, batch)
+                if progress is not None:
+                    progress.update(len(batch), f"新写入 {inserted} 条")
+                batch = []
+        if batch:
+            inserted += copy_chunk_rows(conn, batch)
+            if progress is not None:
+                progress.update(len(batch), f"新写入 {inserted} 条")
+    return inserted
+
+
+def copy_chunk_rows(conn, rows: list[dict]) -> int:
+    """
+    在一个事务内把 rows（kb_source_id, chunk_text, meta_json, hash）COPY 进临时表，
+    再 INSERT ... SELECT ... ON CONFLICT (kb_source_id, hash) DO NOTHING；有全文检索列时一并写入检索词。返回新写入条数。
+    """
+    with_terms = "search_terms" in kb_chunk_columns()
+    cols = ["kb_source_id", "chunk_text", "meta_json", "hash"] + (["search_terms", "term_count"] if with_terms else [])
+    with conn.transaction():
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                CREATE TEMP TABLE _kb_chunk_load (
+                  kb_source_id bigint, chunk_text text, meta_json jsonb, hash varchar(64),
+                  search_terms text, term_count int
+                ) ON COMMIT DROP
+                """
+            )
+            with cur.copy(f"COPY _kb_chunk_load ({', '.join(cols)}) FROM STDIN") as copy:
+                for r in rows:
+                    values = [r["kb_source_id"], r["chunk_text"], json.dumps(r.get("meta_json") or {}, ensure_ascii=False), r["hash"]]
+                    if with_terms:
+                        values.extend(search_terms(r["chunk_text"]))
+                    copy.write_row(values)
+            cur.execute(
+                f"""
+                INSERT INTO {_schema}.kb_chunk ({', '.join(cols)})
+                SELECT {', '.join(cols)} FROM _kb_chunk_load
+                ON CONFLICT (kb_source_id, hash) DO NOTHING
+                """
+            )
+            return cur.rowcount
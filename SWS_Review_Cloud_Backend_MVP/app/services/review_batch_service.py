@@ -0,0 +1,204 @@
+"""
+审查运行的规则批次检查点（review_run_batch）：每批一行，记录状态、执行次数与结果哈希，
+worker 中途退出后可从未完成的批次续跑，已完成批次不再请求 AI。
+round 0 为本地执行的规范库规则，1 为首轮 AI 批次，2 为失败规则重试轮；
+分窗审查时 window_no 为批次所审查的文档窗口序号（见 app/ai/doc_chunker.py），未分窗为空。
+"""
+import json
+
+from .. import db
+from ..settings import settings
+from .review_run_service import review_issue_columns
+
+_schema = settings.DB_SCHEMA
+
+ROUND_LOCAL = 0
+ROUND_FIRST = 1
+ROUND_RETRY = 2
+
+_BATCH_COLUMNS = """
+    id, run_id, round, batch_no, window_no, tier, rule_ids, status, attempts, result_hash, issue_count,
+    error_message, started_at, finished_at
+"""
+
+
+def claim_run(run_id: int, stall_seconds: int) -> bool:
+    """
+    将运行置为 RUNNING 并占用：PENDING / FAILED，或心跳（updated_at）超时的 RUNNING 可被占用。
+    同一运行被重复投递时只有一个 worker 能占用成功。
+    """
+    sql = f"""
+    UPDATE {_schema}.review_run
+    SET status = 'RUNNING', error_message = NULL, finished_at = NULL,
+        started_at = COALESCE(started_at, now()), updated_at = now()
+    WHERE id = %(run_id)s
+      AND (status IN ('PENDING', 'FAILED')
+           OR (status = 'RUNNING' AND updated_at < now() - make_interval(secs => %(stall)s)))
+    RETURNING id
+    """
+    return db.execute_returning(sql, {"run_id": run_id, "stall": stall_seconds}) is not None
+
+
+def touch_run(run_id: int) -> None:
+    """运行心跳：刷新 updated_at，避免长批次期间被 reaper 判定为停滞。"""
+    db.execute(
+        f"UPDATE {_schema}.review_run SET updated_at = now() WHERE id = %(run_id)s AND status = 'RUNNING'",
+        {"run_id": run_id},
+    )
+
+
+def list_run_batches(run_id: int) -> list[dict]:
+    sql = f"""
+    SELECT {_BATCH_COLUMNS}
+    FROM {_schema}.review_run_batch
+    WHERE run_id = %(run_id)s
+    ORDER BY round, batch_no
+    """
+    return db.fetch_all(sql, {"run_id": run_id})
+
+
+def get_run_batch(batch_id: int) -> dict | None:
+    sql = f"""
+    SELECT {_BATCH_COLUMNS}
+    FROM {_schema}.review_run_batch
+    WHERE id = %(id)s
+    """
+    return db.fetch_one(sql, {"id": batch_id})
+
+
+def create_run_batches(run_id: int, round_no: int, batches: list[dict]) -> list[dict]:
+    """
+    写入一轮的批次计划（batches 每项 {rule_ids, tier, window_no}），已存在的 (run_id, round, batch_no) 不覆盖。
+    返回该轮全部批次行。
+    """
+    if batches:
+        db.executemany(
+            f"""
+            INSERT INTO {_schema}.review_run_batch (run_id, round, batch_no, window_no, tier, rule_ids)
+            VALUES (%(run_id)s, %(round)s, %(batch_no)s, %(window_no)s, %(tier)s, %(rule_ids)s)
+            ON CONFLICT (run_id, round, batch_no) DO NOTHING
+            """,
+            [
+                {
+                    "run_id": run_id,
+                    "round": round_no,
+                    "batch_no": i,
+                    "window_no": b.get("window_no"),
+                    "tier": b.get("tier"),
+                    "rule_ids": json.dumps(b.get("rule_ids") or []),
+                }
+                for i, b in enumerate(batches)
+            ],
+        )
+    return [b for b in list_run_batches(run_id) if b["round"] == round_no]
+
+
+def mark_batch_running(batch_id: int) -> None:
+    db.execute(
+        f"""
+        UPDATE {_schema}.review_run_batch
+        SET status = 'RUNNING', attempts = attempts + 1, started_at = now(), updated_at = now()
+        WHERE id = %(id)s
+        """,
+        {"id": batch_id},
+    )
+
+
+def mark_batch_done(batch_id: int, result_hash: str | None, issue_count: int) -> None:
+    db.execute(
+        f"""
+        UPDATE {_schema}.review_run_batch
+        SET status = 'DONE', result_hash = %(result_hash)s, issue_count = %(issue_count)s,
+            error_message = NULL, finished_at = now(), updated_at = now()
+        WHERE id = %(id)s
+        """,
+        {"id": batch_id, "result_hash": result_hash, "issue_count": issue_count},
+    )
+
+
+def mark_batch_failed(batch_id: int, error_message: str | None = None) -> None:
+    db.execute(
+        f"""
+        UPDATE {_schema}.review_run_batch
+        SET status = 'FAILED', error_message = %(error_message)s, finished_at = now(), updated_at = now()
+        WHERE id = %(id)s
+        """,
+        {"id": batch_id, "error_message": (error_message or "")[:2000] or None},
+    )
+
+
+def reset_inflight_batches(run_id: int) -> list[dict]:
+    """
+    续跑前处理上次中断时仍在执行的批次：删除其已写入的部分问题并置回 PENDING。
+    被其他批次合并过来源（provenance 中含本批以外的规则）的问题保留，避免丢失其他批次的结论。
+    返回被重置的批次。
+    """
+    inflight = [b for b in list_run_batches(run_id) if b["status"] == "RUNNING"]
+    if not inflight:
+        return []
+    with_prov = "provenance" in review_issue_columns()
+    for b in inflight:
+        if with_prov:
+            db.execute(
+                f"""
+                DELETE FROM {_schema}.review_issue i
+                WHERE i.run_id = %(run_id)s AND i.batch_id = %(batch_id)s
+                  AND NOT EXISTS (
+                    SELECT 1 FROM jsonb_array_elements(COALESCE(i.provenance, '[]'::jsonb)) p
+                    WHERE NOT ((p ->> 'rule_id') = ANY(%(rule_ids)s))
+                  )
+                """,
+                {"run_id": run_id, "batch_id": b["id"], "rule_ids": list(b["rule_ids"] or [])},
+            )
+        else:
+            db.execute(
+                f"DELETE FROM {_schema}.review_issue WHERE run_id = %(run_id)s AND batch_id = %(batch_id)s",
+                {"run_id": run_id, "batch_id": b["id"]},
+            )
+    db.execute(
+        f"""
+        UPDATE {_schema}.review_run_batch SET status = 'PENDING', updated_at = now()
+        WHERE run_id = %(run_id)s AND status = 'RUNNING'
+        """,
+        {"run_id": run_id},
+    )
+    return inflight
+
+
+def list_run_issues_for_dedup(run_id: int) -> list[dict]:
+    """续跑时载入已落库问题，供 IssueDeduper 恢复聚类，避免重跑批次重复写入同一问题。"""
+    provenance = ", provenance" if "provenance" in review_issue_columns() else ""
+    sql = f"""
+    SELECT id, issue_type, title, confidence, checkpoint_code, evidence_block_ids, evidence_quotes{provenance}
+    FROM {_schema}.review_issue
+    WHERE run_id = %(run_id)s
+    ORDER BY id
+    """
+    return db.fetch_all(sql, {"run_id": run_id})
+
+
+def find_stalled_runs(stall_seconds: int, limit: int = 50) -> list[dict]:
+    """
+    心跳超时的 RUNNING 运行，附带其批次的最大执行次数（用于判定反复崩溃的运行）。
+    """
+    sql = f"""
+    SELECT r.id, r.version_id, r.updated_at,
+           COALESCE(MAX(b.attempts) FILTER (WHERE b.status = 'RUNNING'), 0) AS max_inflight_attempts
+    FROM {_schema}.review_run r
+    LEFT JOIN {_schema}.review_run_batch b ON b.run_id = r.id
+    WHERE r.status = 'RUNNING' AND r.updated_at < now() - make_interval(secs => %(stall)s)
+    GROUP BY r.id, r.version_id, r.updated_at
+    ORDER BY r.updated_at
+    LIMIT %(limit)s
+    """
+    return db.fetch_all(sql, {"stall": stall_seconds, "limit": limit})
+
+
+def requeue_run(run_id: int, stall_seconds: int) -> bool:
+    """将停滞的运行置回 PENDING（仍停滞时才生效，防止与刚恢复心跳的 worker 冲突）。"""
+    sql = f"""
+    UPDATE {_schema}.review_run SET status = 'PENDING', updated_at = now()
+    WHERE id = %(run_id)s AND status = 'RUNNING' AND updated_at < now() - make_interval(secs => %(stall)s)
+    RETURNING id
+    """
+    return db.execute_returning(sql, {"run_id": run_id, "stall": stall_seconds}) is not None
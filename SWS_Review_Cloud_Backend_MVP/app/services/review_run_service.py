@@ -1,8 +1,21 @@
+import json
+import threading
+
 from .. import db
 from ..settings import settings
 
 _schema = settings.DB_SCHEMA
 
+# review_issue 写入列（不含 review_type / provenance / batch_id / batch_ordinal；视库表能力追加）
+_ISSUE_FIELDS = [
+    "version_id", "run_id", "issue_type", "severity", "title", "description",
+    "suggestion", "confidence", "status", "page_no",
+    "evidence_block_ids", "evidence_quotes", "anchor_rects", "checkpoint_code",
+]
+
+_issue_columns: frozenset[str] | None = None
+_issue_columns_lock = threading.Lock()
+
 
 def create_review_run(version_id: int, run_type: str) -> int:
     sql = f"""
@@ -38,10 +51,73 @@ def update_run_status(run_id: int, status: str, progress: int | None = None, err
         parts.append("started_at = COALESCE(started_at, now())")
     elif status in ("DONE", "FAILED", "CANCELED"):
         parts.append("finished_at = now()")
-    sql = f"UPDATE {_schema}.review_run SET {', '.join(parts)} WHERE id = %(run_id)s"
+    # 已取消的运行保持 CANCELED，执行方后续的进度/完成更新不再覆盖
+    sql = f"UPDATE {_schema}.review_run SET {', '.join(parts)} WHERE id = %(run_id)s AND status <> 'CANCELED'"
     db.execute(sql, params)
 
 
+def cancel_run(run_id: int) -> bool:
+    """
+    取消排队中或执行中的审查运行：状态置为 CANCELED 并写入取消标记，
+    执行方在批次之间及进行中的 AI 请求内检查标记后停止。
+    """
+    row = db.fetch_one(
+        f"""
+        UPDATE {_schema}.review_run
+        SET status = 'CANCELED', finished_at = now(), updated_at = now()
+        WHERE id = %(run_id)s AND status IN ('PENDING', 'RUNNING')
+        RETURNING id
+        """,
+        {"run_id": run_id},
+    )
+    if row is None:
+        return False
+    from ..utils.cancellation import RUN, request_cancel
+    request_cancel(RUN, run_id)
+    return True
+
+
+def cancel_version_runs(version_id: int) -> list[int]:
+    """取消某版本所有排队中或执行中的审查运行，返回被取消的运行 id。"""
+    rows = db.fetch_all(
+        f"SELECT id FROM {_schema}.review_run WHERE version_id = %(v)s AND status IN ('PENDING', 'RUNNING')",
+        {"v": version_id},
+    )
+    return [r["id"] for r in rows if cancel_run(r["id"])]
+
+
+def list_run_issues_since(run_id: int, after_id: int = 0, limit: int = 200) -> list[dict]:
+    """增量获取某次运行中 id > after_id 的问题（SSE 推送用）。"""
+    sql = f"""
+    SELECT id, issue_type, severity, title, page_no, checkpoint_code, created_at
+    FROM {_schema}.review_issue
+    WHERE run_id = %(run_id)s AND id > %(after_id)s
+    ORDER BY id
+    LIMIT %(limit)s
+    """
+    return db.fetch_all(sql, {"run_id": run_id, "after_id": after_id, "limit": limit})
+
+
+def review_issue_columns() -> frozenset[str]:
+    """
+    当前用户可写的 review_issue 列集合（进程内只查一次）。
+    information_schema.columns 只列出有权限的列，review_type 未迁移或无权限时自然不在其中。
+    """
+    global _issue_columns
+    if _issue_columns is None:
+        with _issue_columns_lock:
+            if _issue_columns is None:
+                rows = db.fetch_all(
+                    """
+                    SELECT column_name FROM information_schema.columns
+                    WHERE table_schema = %(schema)s AND table_name = 'review_issue'
+                    """,
+                    {"schema": _schema},
+                )
+                _issue_columns = frozenset(r["column_name"] for r in rows)
+    return _issue_columns
+
+
 def insert_issue(
     version_id: int,
     run_id: int | None,
@@ -58,69 +134,146 @@ def insert_issue(
     checkpoint_code: str | None = None,
     review_type: str | None = None,
 ) -> int:
-    import json
+    ids = insert_issues_bulk(version_id, run_id, [{
+        "issue_type": issue_type,
+        "severity": severity,
+        "title": title,
+        "description": description,
+        "suggestion": suggestion,
+        "confidence": confidence,
+        "page_no": page_no,
+        "evidence_block_ids": evidence_block_ids,
+        "evidence_quotes": evidence_quotes,
+        "anchor_rects": anchor_rects,
+        "checkpoint_code": checkpoint_code,
+        "review_type": review_type,
+    }])
+    return ids[0]
+
+
+def insert_issues_bulk(version_id: int, run_id: int | None, issues: list[dict]) -> list[int]:
+    """
+    批量写入问题，返回新 id 列表（与 issues 顺序一致）。
+    issues 每项键同 insert_issue 参数（issue_type, severity, title, ...）。
+    - 缺 page_no / anchor_rects 的问题，按其首个 evidence block 一次性查询 block_page_anchor 补齐
+    - 单条多行 INSERT ... RETURNING 写入，共用一个连接
+    - review_type 列是否可写由 review_issue_columns() 判断，不再靠异常降级
+    - 带 batch_id / batch_ordinal 的问题按 (run_id, batch_id, batch_ordinal) 幂等写入，重复写入返回已有 id
+    """
+    if not issues:
+        return []
     from .block_service import get_block_page_info
 
-    # 如果page_no未提供，从evidence_block_ids的第一个block的anchor反查
-    if page_no is None and evidence_block_ids:
-        page_info = get_block_page_info(evidence_block_ids[:1])
-        if page_info and evidence_block_ids[0] in page_info:
-            page_no = page_info[evidence_block_ids[0]]["page_no"]
-            # 如果anchor_rects也未提供，从anchor获取
-            if anchor_rects is None:
-                anchor_rects = page_info[evidence_block_ids[0]].get("anchor_rects")
-
-    # 如果还是没有page_no，默认设为1（向后兼容）
-    if page_no is None:
-        page_no = 1
-
-    # 基础字段（不含 review_type）；review_type 可选，若表中无该列则自动降级
-    fields_base = [
-        "version_id", "run_id", "issue_type", "severity", "title", "description",
-        "suggestion", "confidence", "status", "page_no",
-        "evidence_block_ids", "evidence_quotes", "anchor_rects", "checkpoint_code",
-    ]
-    values_base = [
-        "%(version_id)s", "%(run_id)s", "%(issue_type)s", "%(severity)s",
-        "%(title)s", "%(description)s", "%(suggestion)s", "%(confidence)s",
-        "'NEW'", "%(page_no)s",
-        "%(evidence_block_ids)s", "%(evidence_quotes)s", "%(anchor_rects)s", "%(checkpoint_code)s",
-    ]
-    params = {
-        "version_id": version_id, "run_id": run_id, "issue_type": issue_type,
-        "severity": severity, "title": title, "description": description,
-        "suggestion": suggestion, "confidence": confidence, "page_no": page_no,
-        "evidence_block_ids": json.dumps(evidence_block_ids or []),
-        "evidence_quotes": json.dumps(evidence_quotes or []),
-        "anchor_rects": json.dumps(anchor_rects or []),
-        "checkpoint_code": checkpoint_code,
+    need_ids = {
+        (it.get("evidence_block_ids") or [None])[0]
+        for it in issues
+        if it.get("evidence_block_ids") and (it.get("page_no") is None or it.get("anchor_rects") is None)
     }
+    need_ids.discard(None)
+    page_info = get_block_page_info(sorted(need_ids)) if need_ids else {}
+
+    columns = review_issue_columns()
+    with_rt = "review_type" in columns
+    with_prov = "provenance" in columns
+    with_batch = "batch_ordinal" in columns
+    fields = (
+        _ISSUE_FIELDS
+        + (["review_type"] if with_rt else [])
+        + (["provenance"] if with_prov else [])
+        + (["batch_id", "batch_ordinal"] if with_batch else [])
+    )
+    params: dict = {"version_id": version_id, "run_id": run_id}
+    rows_sql = []
+    for i, it in enumerate(issues):
+        block_ids = it.get("evidence_block_ids") or []
+        page_no = it.get("page_no")
+        anchor_rects = it.get("anchor_rects")
+        info = page_info.get(block_ids[0]) if block_ids else None
+        if info:
+            # 如果page_no未提供，从evidence_block_ids的第一个block的anchor反查；anchor_rects同理
+            if page_no is None:
+                page_no = info["page_no"]
+            if anchor_rects is None:
+                anchor_rects = info.get("anchor_rects")
+        # 如果还是没有page_no，默认设为1（向后兼容）
+        if page_no is None:
+            page_no = 1
+        row = {
+            "issue_type": it["issue_type"],
+            "severity": it["severity"],
+            "title": it["title"],
+            "description": it.get("description"),
+            "suggestion": it.get("suggestion"),
+            "confidence": it.get("confidence", 0.5),
+            "page_no": page_no,
+            "evidence_block_ids": json.dumps(block_ids),
+            "evidence_quotes": json.dumps(it.get("evidence_quotes") or []),
+            "anchor_rects": json.dumps(anchor_rects or []),
+            "checkpoint_code": it.get("checkpoint_code"),
+        }
+        if with_rt:
+            row["review_type"] = it.get("review_type")
+        if with_prov:
+            row["provenance"] = json.dumps(it.get("provenance") or [])
+        if with_batch:
+            row["batch_id"] = it.get("batch_id")
+            row["batch_ordinal"] = it.get("batch_ordinal")
+        values = []
+        for f in fields:
+            if f in ("version_id", "run_id"):
+                values.append(f"%({f})s")
+            elif f == "status":
+                values.append("'NEW'")
+            else:
+                values.append(f"%({f}_{i})s")
+                params[f"{f}_{i}"] = row[f]
+        rows_sql.append(f"({', '.join(values)})")
 
+    # 幂等键冲突时做空更新，使 RETURNING 仍返回已有行 id，保持与 issues 顺序一致
+    on_conflict = (
+        "ON CONFLICT (run_id, batch_id, batch_ordinal) DO UPDATE SET updated_at = review_issue.updated_at"
+        if with_batch else ""
+    )
+    sql = f"""
+    INSERT INTO {_schema}.review_issue ({', '.join(fields)})
+    VALUES {', '.join(rows_sql)}
+    {on_conflict}
+    RETURNING id
+    """
     with db.pool.connection() as conn:
         with conn.cursor() as cur:
-            # 若传入 review_type，先尝试带 review_type 插入；列不存在或无权限时降级为不含 review_type
-            if review_type is not None:
-                fields = fields_base + ["review_type"]
-                values = values_base + ["%(review_type)s"]
-                params_with_rt = {**params, "review_type": review_type}
-                sql_with_rt = f"""
-                INSERT INTO {_schema}.review_issue ({', '.join(fields)})
-                VALUES ({', '.join(values)})
-                RETURNING id
-                """
-                try:
-                    cur.execute(sql_with_rt, params_with_rt)
-                    return cur.fetchone()[0]
-                except Exception as e:
-                    err = str(e).lower()
-                    if "review_type" in err or "column" in err or "属主" in err or "owner" in err or "permission" in err:
-                        pass  # 降级：不带 review_type 再插一次
-                    else:
-                        raise
-            sql = f"""
-            INSERT INTO {_schema}.review_issue ({', '.join(fields_base)})
-            VALUES ({', '.join(values_base)})
-            RETURNING id
-            """
             cur.execute(sql, params)
-            return cur.fetchone()[0]
+            # 多行 VALUES 的 RETURNING 按插入顺序返回
+            return [r[0] for r in cur.fetchall()]
+
+
+def update_issues_provenance(updates: list[dict]) -> None:
+    """
+    回写去重合并后的问题：updates 每项 {id, provenance, confidence}。
+    provenance 列未迁移时只更新置信度。
+    """
+    if not updates:
+        return
+    if "provenance" in review_issue_columns():
+        sql = f"""
+        UPDATE {_schema}.review_issue
+        SET provenance = %(provenance)s, confidence = GREATEST(confidence, %(confidence)s), updated_at = now()
+        WHERE id = %(id)s
+        """
+    else:
+        sql = f"""
+        UPDATE {_schema}.review_issue
+        SET confidence = GREATEST(confidence, %(confidence)s), updated_at = now()
+        WHERE id = %(id)s
+        """
+    db.executemany(sql, [
+        {"id": u["id"], "provenance": json.dumps(u.get("provenance") or []), "confidence": u.get("confidence") or 0}
+        for u in updates
+    ])
+
+
+def delete_issues(issue_ids: list[int]) -> None:
+    """删除问题（运行结束整体去重时删除被合并的重复行）。"""
+    if not issue_ids:
+        return
+    db.execute(f"DELETE FROM {_schema}.review_issue WHERE id = ANY(%(ids)s)", {"ids": list(issue_ids)})
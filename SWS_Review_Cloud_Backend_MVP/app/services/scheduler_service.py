@@ -0,0 +1,252 @@
+"""
+处理管道与审查运行的按项目公平调度（Redis）：
+- 每个项目两条等待队列：interactive（用户发起的重新审查）优先于 bulk（上传解析、解析后自动审查）
+- 项目间按加权差额轮转（DRR）出队，单个项目批量上传不会饿死其他项目
+- 每个项目同时在跑的作业数不超过 SCHED_PROJECT_CONCURRENCY，全局不超过 SCHED_MAX_RUNNING，
+  超出的作业留在调度队列而不是堆进 Celery broker
+在跑作业的释放以库内状态为准（版本不再 PROCESSING、运行不再 PENDING/RUNNING），无需完成回调；
+pump() 在提交时、作业结束时及 celery beat 定时触发。Redis 不可用时直接投递 Celery（不做公平调度）。
+"""
+import json
+import logging
+import time
+import uuid
+
+from .. import db
+from ..settings import settings
+from ..utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+_schema = settings.DB_SCHEMA
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BULK)
+
+JOB_PIPELINE = "pipeline"
+JOB_REVIEW = "review"
+
+# 每个作业的 DRR 成本（按作业计数）
+JOB_COST = 1
+# 每个项目保留的最近等待时长样本数（用于 p50/p95）
+WAIT_SAMPLES = 200
+
+_PREFIX = "sws:sched"
+_ACTIVE = f"{_PREFIX}:active"          # 有等待作业的项目（按入队先后轮转的 list）
+_DEFICIT = f"{_PREFIX}:deficit"        # project_id -> DRR 余额
+_PUMP_LOCK = f"{_PREFIX}:pump_lock"
+
+
+def _queue_key(project_id: int, priority: str) -> str:
+    return f"{_PREFIX}:q:{project_id}:{priority}"
+
+
+def _running_key(project_id: int) -> str:
+    return f"{_PREFIX}:running:{project_id}"
+
+
+def _waits_key(project_id: int) -> str:
+    return f"{_PREFIX}:waits:{project_id}"
+
+
+def _weights() -> dict[int, float]:
+    """SCHED_PROJECT_WEIGHTS 形如 "12:3,15:0.5"；未列出的项目权重为 1。"""
+    weights = {}
+    for part in (settings.SCHED_PROJECT_WEIGHTS or "").split(","):
+        pid, _, w = part.partition(":")
+        try:
+            weights[int(pid)] = float(w)
+        except ValueError:
+            continue
+    return weights
+
+
+def project_of_version(version_id: int) -> int | None:
+    row = db.fetch_one(
+        f"""
+        SELECT d.project_id FROM {_schema}.document_version v
+        JOIN {_schema}.document d ON d.id = v.document_id
+        WHERE v.id = %(version_id)s
+        """,
+        {"version_id": version_id},
+    )
+    return row["project_id"] if row else None
+
+
+def submit_pipeline(project_id: int, version_id: int, priority: str = PRIORITY_BULK) -> None:
+    """提交文档处理管道作业。"""
+    _submit(project_id, {"kind": JOB_PIPELINE, "version_id": version_id}, priority)
+
+
+def submit_review(project_id: int, version_id: int, run_id: int, priority: str = PRIORITY_INTERACTIVE) -> None:
+    """提交 AI 审查运行作业。"""
+    _submit(project_id, {"kind": JOB_REVIEW, "version_id": version_id, "run_id": run_id}, priority)
+
+
+def _submit(project_id: int | None, job: dict, priority: str) -> None:
+    if not settings.SCHED_ENABLED or project_id is None:
+        _dispatch(job)
+        return
+    job = {**job, "id": uuid.uuid4().hex, "project_id": project_id, "priority": priority, "enqueued_at": time.time()}
+    try:
+        r = get_redis()
+        pipe = r.pipeline()
+        pipe.rpush(_queue_key(project_id, priority), json.dumps(job))
+        pipe.lrem(_ACTIVE, 0, project_id)
+        pipe.rpush(_ACTIVE, project_id)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"调度队列不可用，直接投递 {job['kind']} 作业: {e}")
+        _dispatch(job)
+        return
+    logger.info(f"[项目 {project_id}] {job['kind']} 作业入队（{priority}）")
+    pump()
+
+
+def _dispatch(job: dict) -> None:
+    if job["kind"] == JOB_PIPELINE:
+        from ..worker.tasks import pipeline_chain
+        pipeline_chain.delay(job["version_id"])
+    else:
+        from ..worker.ai_review_tasks import run_ai_review_task
+        run_ai_review_task.delay(job["version_id"], job["run_id"])
+
+
+def _job_running(job: dict) -> bool:
+    """作业是否仍在执行（以库内状态为准）。"""
+    if job["kind"] == JOB_PIPELINE:
+        row = db.fetch_one(
+            f"SELECT status FROM {_schema}.document_version WHERE id = %(id)s", {"id": job["version_id"]}
+        )
+        return bool(row) and row["status"] == "PROCESSING"
+    row = db.fetch_one(f"SELECT status FROM {_schema}.review_run WHERE id = %(id)s", {"id": job["run_id"]})
+    return bool(row) and row["status"] in ("PENDING", "RUNNING")
+
+
+def _job_still_wanted(job: dict) -> bool:
+    """等待中的作业出队时确认仍需执行（版本/运行未被取消或删除）。"""
+    if job["kind"] == JOB_PIPELINE:
+        return _job_running(job)
+    row = db.fetch_one(f"SELECT status FROM {_schema}.review_run WHERE id = %(id)s", {"id": job["run_id"]})
+    return bool(row) and row["status"] == "PENDING"
+
+
+def _reap_running(r, project_id: int) -> int:
+    """释放已结束的在跑作业，返回该项目仍在跑的作业数。"""
+    key = _running_key(project_id)
+    for raw in r.hvals(key):
+        job = json.loads(raw)
+        if not _job_running(job):
+            r.hdel(key, job["id"])
+    return r.hlen(key)
+
+
+def pump() -> int:
+    """
+    按 DRR 从各项目队列出队并投递 Celery，直到没有可投递作业或达到并发上限；返回本次投递数。
+    多进程并发调用时用 Redis 锁保证只有一个在出队。
+    """
+    if not settings.SCHED_ENABLED:
+        return 0
+    try:
+        r = get_redis()
+        if not r.set(_PUMP_LOCK, "1", nx=True, ex=30):
+            return 0
+    except Exception as e:
+        logger.warning(f"调度队列不可用: {e}")
+        return 0
+    try:
+        return _pump(r)
+    finally:
+        r.delete(_PUMP_LOCK)
+
+
+def _pump(r) -> int:
+    projects = [int(p) for p in r.lrange(_ACTIVE, 0, -1)]
+    with_running = {int(k.rsplit(":", 1)[1]) for k in r.scan_iter(f"{_PREFIX}:running:*")}
+    running = {pid: _reap_running(r, pid) for pid in set(projects) | with_running}
+    total_running = sum(running.values())
+    weights = _weights()
+    dispatched = 0
+    # interactive 先于 bulk：先只出 interactive 队列，再出 bulk 队列
+    for priority in PRIORITIES:
+        progress = True
+        while progress and total_running < settings.SCHED_MAX_RUNNING:
+            progress = False
+            for pid in projects:
+                if total_running >= settings.SCHED_MAX_RUNNING:
+                    break
+                weight = weights.get(pid, 1.0)
+                if running[pid] >= settings.SCHED_PROJECT_CONCURRENCY or weight <= 0:
+                    continue
+                queue = _queue_key(pid, priority)
+                if not r.llen(queue):
+                    continue
+                # 有等待作业且有余量的项目每轮累加额度，权重 < 1 的项目隔几轮才出队一次
+                progress = True
+                deficit = float(r.hget(_DEFICIT, pid) or 0) + settings.SCHED_QUANTUM * weight
+                while deficit >= JOB_COST and running[pid] < settings.SCHED_PROJECT_CONCURRENCY \
+                        and total_running < settings.SCHED_MAX_RUNNING:
+                    raw = r.lpop(queue)
+                    if raw is None:
+                        break
+                    job = json.loads(raw)
+                    if not _job_still_wanted(job):
+                        continue
+                    try:
+                        _dispatch(job)
+                    except Exception as e:
+                        # broker 不可用：放回队首，下次 pump 再投
+                        r.lpush(queue, raw)
+                        logger.warning(f"[项目 {pid}] 投递 {job['kind']} 作业失败，保留在队列: {e}")
+                        return dispatched
+                    wait_ms = int((time.time() - job["enqueued_at"]) * 1000)
+                    pipe = r.pipeline()
+                    pipe.hset(_running_key(pid), job["id"], raw)
+                    pipe.lpush(_waits_key(pid), wait_ms)
+                    pipe.ltrim(_waits_key(pid), 0, WAIT_SAMPLES - 1)
+                    pipe.execute()
+                    logger.info(f"[项目 {pid}] 投递 {job['kind']} 作业（{priority}），排队 {wait_ms}ms")
+                    deficit -= JOB_COST
+                    running[pid] += 1
+                    total_running += 1
+                    dispatched += 1
+                r.hset(_DEFICIT, pid, deficit if r.llen(queue) else 0)
+    # 两条队列都空的项目移出轮转，余额清零
+    for pid in projects:
+        if not any(r.llen(_queue_key(pid, p)) for p in PRIORITIES):
+            r.lrem(_ACTIVE, 0, pid)
+            r.hdel(_DEFICIT, pid)
+    return dispatched
+
+
+def _percentile(values: list[int], pct: float) -> int | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct * (len(values) - 1))))]
+
+
+def project_queue_stats(project_id: int) -> dict:
+    """项目调度状态：各优先级等待数、最久等待时长、在跑作业数，以及最近出队作业等待时长的 p50/p95（毫秒）。"""
+    r = get_redis()
+    now = time.time()
+    queues = {}
+    for priority in PRIORITIES:
+        key = _queue_key(project_id, priority)
+        head = r.lindex(key, 0)
+        queues[priority] = {
+            "depth": r.llen(key),
+            "oldest_wait_ms": int((now - json.loads(head)["enqueued_at"]) * 1000) if head else 0,
+        }
+    waits = [int(w) for w in r.lrange(_waits_key(project_id), 0, -1)]
+    return {
+        "project_id": project_id,
+        "queues": queues,
+        "running": r.hlen(_running_key(project_id)),
+        "concurrency_cap": settings.SCHED_PROJECT_CONCURRENCY,
+        "weight": _weights().get(project_id, 1.0),
+        "wait_ms_p50": _percentile(waits, 0.5),
+        "wait_ms_p95": _percentile(waits, 0.95),
+        "wait_samples": len(waits),
+    }
@@ -26,8 +26,12 @@ def upload_docx(
     filename: str,
     content_type: str | None,
     trigger_pipeline: bool = True,
+    priority: str = "bulk",
 ) -> dict:
-    """Validate, store, create file_object and document_version. Optionally trigger pipeline (when worker exists)."""
+    """
+    Validate, store, create file_object and document_version. Optionally trigger pipeline (when worker exists).
+    管道作业经 scheduler_service 按项目公平调度，priority 为 interactive / bulk。
+    """
     if len(file_content) > MAX_DOCX_SIZE:
         raise ValueError("File too large")
     if content_type and content_type not in ALLOWED_CONTENT:
@@ -64,10 +68,10 @@ def upload_docx(
     # 触发处理管道
     if trigger_pipeline:
         try:
-            from ..worker.tasks import pipeline_chain
+            from .scheduler_service import submit_pipeline
             logger.info(f"[版本 {version_id}] 触发处理管道")
-            result = pipeline_chain.delay(version_id)
-            logger.info(f"[版本 {version_id}] ✅ 任务已提交到 Celery，任务ID: {result.id if result else 'N/A'}")
+            submit_pipeline(project_id, version_id, priority)
+            logger.info(f"[版本 {version_id}] ✅ 处理管道已提交调度队列（项目 {project_id}）")
         except ImportError as e:
             error_msg = f"无法导入 Celery 任务模块: {e}"
             logger.error(f"[版本 {version_id}] ❌ {error_msg}")
@@ -0,0 +1,257 @@
+"""
+kb_chunk.embedding 向量索引管理：
+- 索引类型 KB_VECTOR_INDEX（hnsw / ivfflat），批量写入向量后按行数重建（ivfflat 的 lists 随行数调整，
+  行数 ≤ 100 万取 rows/1000，否则取 sqrt(rows)），新索引 CONCURRENTLY 建好后替换旧索引，不阻塞检索
+- 查询时按延迟预算设置 hnsw.ef_search / ivfflat.probes（SET LOCAL，仅作用于本次查询的事务）：
+  有基准测试结果时取 p95 延迟不超过预算的召回率最高的参数，否则用默认值
+- 召回基准：抽样已有向量作为查询，与精确检索（不走索引）的 top-k 比较，得到各参数的 recall@k 与延迟
+"""
+import json
+import logging
+import math
+import time
+
+from .. import db
+from ..settings import settings
+from ..utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+_schema = settings.DB_SCHEMA
+
+INDEX_NAME = "idx_kb_chunk_embedding"
+HNSW = "hnsw"
+IVFFLAT = "ivfflat"
+
+# 基准测试扫描的参数取值
+EF_SEARCH_GRID = (10, 20, 40, 80, 160, 320)
+PROBES_GRID = (1, 2, 4, 8, 16, 32, 64)
+# ivfflat 的 lists 偏离推荐值超过此倍数时重建
+LISTS_DRIFT = 2.0
+
+# 查询参数（索引信息 + 基准结果）在进程内的缓存时长（秒）
+SETTING_TTL = 60
+
+_BENCH_KEY = "sws:kb:vector_bench"
+_setting_cache: dict[float, tuple[float, tuple[str, int] | None]] = {}
+
+
+def index_info() -> dict | None:
+    """当前向量索引：{name, method, lists, definition}；不存在时返回 None。"""
+    row = db.fetch_one(
+        """
+        SELECT indexname, indexdef FROM pg_indexes
+        WHERE schemaname = %(schema)s AND tablename = 'kb_chunk' AND indexname = %(name)s
+        """,
+        {"schema": _schema, "name": INDEX_NAME},
+    )
+    if not row:
+        return None
+    definition = row["indexdef"]
+    method = HNSW if " USING hnsw " in definition else IVFFLAT
+    lists = None
+    if method == IVFFLAT and "lists=" in definition.replace(" ", ""):
+        try:
+            lists = int(definition.replace(" ", "").split("lists=")[1].split(")")[0].strip("'"))
+        except ValueError:
+            pass
+    return {"name": row["indexname"], "method": method, "lists": lists, "definition": definition}
+
+
+def embedded_rows() -> int:
+    row = db.fetch_one(f"SELECT count(*) AS n FROM {_schema}.kb_chunk WHERE embedding IS NOT NULL")
+    return row["n"] if row else 0
+
+
+def recommended_lists(rows: int) -> int:
+    """pgvector 建议：行数 ≤ 100 万时 rows/1000，否则 sqrt(rows)；最少 10。"""
+    lists = rows // 1000 if rows <= 1_000_000 else int(math.sqrt(rows))
+    return max(10, lists)
+
+
+def rebuild_index(method: str | None = None) -> dict:
+    """按当前行数重建向量索引（新建后替换旧索引），返回新索引信息。"""
+    method = method or settings.KB_VECTOR_INDEX
+    rows = embedded_rows()
+    if method == HNSW:
+        with_params = f"m = {settings.KB_VECTOR_HNSW_M}, ef_construction = {settings.KB_VECTOR_HNSW_EF_CONSTRUCTION}"
+    elif method == IVFFLAT:
+        with_params = f"lists = {recommended_lists(rows)}"
+    else:
+        raise ValueError(f"不支持的向量索引类型: {method}")
+    t0 = time.perf_counter()
+    tmp_name = f"{INDEX_NAME}_new"
+    # CONCURRENTLY 需在事务外执行（连接池为 autocommit）
+    db.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {_schema}.{tmp_name}")
+    db.execute(
+        f"""
+        CREATE INDEX CONCURRENTLY {tmp_name} ON {_schema}.kb_chunk
+        USING {method} (embedding vector_cosine_ops) WITH ({with_params})
+        """
+    )
+    db.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {_schema}.{INDEX_NAME}")
+    db.execute(f"ALTER INDEX {_schema}.{tmp_name} RENAME TO {INDEX_NAME}")
+    # 旧基准结果对应旧索引，作废
+    _setting_cache.clear()
+    try:
+        get_redis().delete(_BENCH_KEY)
+    except Exception as e:
+        logger.warning(f"清除向量检索基准结果失败: {e}")
+    logger.info(f"向量索引重建完成：{method}（{with_params}），{rows} 行，耗时 {time.perf_counter() - t0:.1f}s")
+    return index_info() or {}
+
+
+def maybe_rebuild() -> bool:
+    """批量写入向量后调用：索引缺失、类型与配置不符或 ivfflat 的 lists 偏离推荐值过多时重建，返回是否重建。"""
+    info = index_info()
+    method = settings.KB_VECTOR_INDEX
+    if info is not None and info["method"] == method:
+        if method == HNSW:
+            return False
+        target = recommended_lists(embedded_rows())
+        lists = info.get("lists") or 1
+        if 1 / LISTS_DRIFT <= target / lists <= LISTS_DRIFT:
+            return False
+    rebuild_index(method)
+    return True
+
+
+def _load_bench() -> dict | None:
+    try:
+        raw = get_redis().get(_BENCH_KEY)
+    except Exception:
+        return None
+    return json.loads(raw) if raw else None
+
+
+def query_setting(latency_ms: float | None = None) -> tuple[str, int] | None:
+    """
+    本次查询的索引参数 (GUC 名, 值)：按基准结果取 p95 ≤ 预算且召回率最高的取值；无基准时用默认值。
+    无向量索引时返回 None。结果按预算在进程内缓存 SETTING_TTL 秒。
+    """
+    budget = latency_ms or settings.KB_VECTOR_LATENCY_MS
+    now = time.monotonic()
+    cached = _setting_cache.get(budget)
+    if cached is not None and now - cached[0] < SETTING_TTL:
+        return cached[1]
+    setting = _query_setting(budget)
+    _setting_cache[budget] = (now, setting)
+    return setting
+
+
+def _query_setting(budget: float) -> tuple[str, int] | None:
+    bench = _load_bench()
+    if bench:
+        fitting = [r for r in bench["results"] if r["p95_ms"] <= budget] or bench["results"][:1]
+        best = max(fitting, key=lambda r: (r["recall"], -r["p95_ms"]))
+        return bench["guc"], best["value"]
+    info = index_info()
+    if info is None:
+        return None
+    if info["method"] == HNSW:
+        return "hnsw.ef_search", settings.KB_VECTOR_EF_SEARCH
+    return "ivfflat.probes", settings.KB_VECTOR_PROBES or max(1, int(math.sqrt(info.get("lists") or 100)))
+
+
+def search(
+    vector_literal: str,
+    top_k: int,
+    kb_source_ids: list[int] | None = None,
+    latency_ms: float | None = None,
+    exact: bool = False,
+) -> list[dict]:
+    """
+    余弦距离 top-k（结果带 distance）。索引参数按延迟预算 SET LOCAL；exact=True 时关闭索引扫描做精确检索（基准用）。
+    """
+    where = ["c.embedding IS NOT NULL"]
+    params = {"vec": vector_literal, "top_k": top_k}
+    if kb_source_ids:
+        where.append("c.kb_source_id = ANY(%(ids)s)")
+        params["ids"] = kb_source_ids
+    sql = f"""
+    SELECT c.id, c.kb_source_id, c.chunk_text, c.meta_json, c.hash, c.embedding <=> %(vec)s::vector AS distance
+    FROM {_schema}.kb_chunk c
+    JOIN {_schema}.kb_source s ON s.id = c.kb_source_id AND s.status = 'READY'
+    WHERE {' AND '.join(where)}
+    ORDER BY c.embedding <=> %(vec)s::vector
+    LIMIT %(top_k)s
+    """
+    setting = None if exact else query_setting(latency_ms)
+    with db.pool.connection() as conn:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                if exact:
+                    cur.execute("SET LOCAL enable_indexscan = off")
+                    cur.execute("SET LOCAL enable_bitmapscan = off")
+                elif setting:
+                    cur.execute(f"SET LOCAL {setting[0]} = {int(setting[1])}")
+                cur.execute(sql, params)
+                cols = [d.name for d in cur.description]
+                return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+
+def benchmark(sample: int = 50, top_k: int = 10) -> dict:
+    """
+    召回基准：抽样 sample 条已有向量作查询，精确检索结果为标准答案，
+    对当前索引类型扫描 ef_search / probes，记录各取值的 recall@k 与 p50/p95 延迟，结果写入 Redis 供 query_setting 使用。
+    """
+    info = index_info()
+    if info is None:
+        raise ValueError("kb_chunk.embedding 上没有向量索引")
+    guc, grid = ("hnsw.ef_search", EF_SEARCH_GRID) if info["method"] == HNSW else ("ivfflat.probes", PROBES_GRID)
+    queries = db.fetch_all(
+        f"""
+        SELECT embedding::text AS vec FROM {_schema}.kb_chunk
+        WHERE embedding IS NOT NULL
+        ORDER BY random()
+        LIMIT %(n)s
+        """,
+        {"n": sample},
+    )
+    truth = [{r["id"] for r in search(q["vec"], top_k, exact=True)} for q in queries]
+    results = []
+    for value in grid:
+        if guc == "ivfflat.probes" and info.get("lists") and value > info["lists"]:
+            break
+        latencies, hits = [], 0
+        for q, expected in zip(queries, truth):
+            t0 = time.perf_counter()
+            with db.pool.connection() as conn:
+                with conn.transaction():
+                    with conn.cursor() as cur:
+                        cur.execute(f"SET LOCAL {guc} = {value}")
+                        cur.execute(
+                            f"""
+                            SELECT c.id FROM {_schema}.kb_chunk c
+                            JOIN {_schema}.kb_source s ON s.id = c.kb_source_id AND s.status = 'READY'
+                            WHERE c.embedding IS NOT NULL
+                            ORDER BY c.embedding <=> %(vec)s::vector LIMIT %(k)s
+                            """,
+                            {"vec": q["vec"], "k": top_k},
+                        )
+                        found = {r[0] for r in cur.fetchall()}
+            latencies.append((time.perf_counter() - t0) * 1000)
+            hits += len(found & expected)
+        latencies.sort()
+        total = sum(len(e) for e in truth) or 1
+        results.append({
+            "value": value,
+            "recall": round(hits / total, 4),
+            "p50_ms": round(latencies[len(latencies) // 2], 2) if latencies else 0,
+            "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2) if latencies else 0,
+        })
+    report = {
+        "method": info["method"],
+        "lists": info.get("lists"),
+        "rows": embedded_rows(),
+        "guc": guc,
+        "top_k": top_k,
+        "sample": len(queries),
+        "results": results,
+        "at": time.time(),
+    }
+    try:
+        get_redis().set(_BENCH_KEY, json.dumps(report))
+    except Exception as e:
+        logger.warning(f"保存向量检索基准结果失败: {e}")
+    _setting_cache.clear()
+    return report
@@ -60,7 +60,8 @@ def update_version_status(
     status: str, 
     error_message: str | None = None,
     progress: int | None = None,
-    current_step: str | None = None
+    current_step: str | None = None,
+    override_canceled: bool = False,
 ) -> None:
     """
     更新版本状态
@@ -71,6 +72,7 @@ def update_version_status(
         error_message: 错误消息（可选）
         progress: 进度百分比 0-100（可选）
         current_step: 当前步骤描述（可选）
+        override_canceled: 是否允许改写已取消的版本（仅重新处理时使用）
     """
     sql = f"""
     UPDATE {_schema}.document_version
@@ -87,6 +89,9 @@ def update_version_status(
         sql += ", current_step = %(current_step)s"
         params["current_step"] = current_step
     sql += " WHERE id = %(version_id)s"
+    if not override_canceled:
+        # 已取消的版本保持 CANCELED，管道步骤后续的进度/就绪更新不再覆盖
+        sql += " AND status <> 'CANCELED'"
     db.execute(sql, params)
     
     # 输出日志
@@ -125,7 +130,11 @@ def set_version_page_map_file(version_id: int, file_id: int) -> None:
 
 
 def cancel_version(version_id: int) -> bool:
-    """取消版本（处理中、待审查、已完成均可取消，将状态改为 CANCELED）"""
+    """
+    取消版本（处理中、待审查、已完成均可取消，将状态改为 CANCELED）。
+    同时写入取消标记：管道排队中的步骤被撤销、执行中的步骤在下次进度更新时停止，
+    该版本进行中的审查运行一并取消。
+    """
     sql = f"""
     UPDATE {_schema}.document_version
     SET status = 'CANCELED', updated_at = now(), error_message = NULL
@@ -134,7 +143,13 @@ def cancel_version(version_id: int) -> bool:
     with db.pool.connection() as conn:
         with conn.cursor() as cur:
             cur.execute(sql, {"version_id": version_id})
-            return cur.rowcount > 0
+            canceled = cur.rowcount > 0
+    if canceled:
+        from ..utils.cancellation import VERSION, request_cancel
+        from .review_run_service import cancel_version_runs
+        request_cancel(VERSION, version_id)
+        cancel_version_runs(version_id)
+    return canceled
 
 
 def can_reprocess_version(version_id: int) -> bool:
@@ -156,17 +171,21 @@ def reprocess_version(version_id: int) -> bool:
     if not can_reprocess_version(version_id):
         return False
     
-    # 更新状态为 PROCESSING
-    update_version_status(version_id, "PROCESSING", error_message=None)
+    # 更新状态为 PROCESSING，清除上次取消留下的标记
+    from ..utils.cancellation import VERSION, clear_cancel
+    clear_cancel(VERSION, version_id)
+    update_version_status(version_id, "PROCESSING", error_message=None, override_canceled=True)
     
-    # 触发 pipeline
+    # 触发 pipeline（用户手动重新处理，按 interactive 优先级调度）
     try:
-        from ..worker.tasks import pipeline_chain
-        pipeline_chain.delay(version_id)
+        from .scheduler_service import PRIORITY_INTERACTIVE, project_of_version, submit_pipeline
+        submit_pipeline(project_of_version(version_id), version_id, PRIORITY_INTERACTIVE)
         return True
     except Exception:
         # 如果 Celery 不可用，将状态改回原状态
-        update_version_status(version_id, v["status"], error_message="Celery worker not available")
+        update_version_status(
+            version_id, v["status"], error_message="Celery worker not available", override_canceled=True
+        )
         return False
 
 
@@ -37,7 +37,100 @@ class Settings(BaseSettings):
     # Qwen / DashScope (AI review)
     QWEN_API_KEY: str = ""
     QWEN_MODEL: str = "qwen-plus"
+    # 简单规则（格式/标点/正则/单位写法）使用的小模型，如 qwen-turbo；留空则全部使用 QWEN_MODEL
+    QWEN_MODEL_SMALL: str = ""
+    # priority 不低于此值的规则始终使用大模型
+    AI_ROUTE_LARGE_PRIORITY: int = 90
+    # 小模型结果平均自评置信度低于此值时升级到大模型重跑本批
+    AI_ESCALATE_MIN_CONFIDENCE: float = 0.6
+    # OpenAI 兼容接口地址；压测/回放时可指向本地 Mock（见 app/ai/mock_llm.py），如 http://localhost:8001/v1
+    DASHSCOPE_BASE: str = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+    # 流式返回：逐条解析“规则校验结果”并立即落库，缩短首条问题出现时间
+    AI_STREAM_RESPONSES: bool = True
+    # 单次审查运行 token 预算（0 表示不限制），超出后中止运行并标记 FAILED
+    AI_RUN_TOKEN_BUDGET: int = 0
+    # 规范库确定性规则（正则/合计/缺失章节/字段比对等）本地执行，仅语义规则请求大模型
+    AI_LOCAL_RULES: bool = True
+    # 规则分批的单次请求提示 token 上限（含系统提示与文档），0 表示沿用固定每批 5～7 条
+    AI_BATCH_TOKEN_BUDGET: int = 100000
+    # 单批预计输出 token 上限（每条规则按 RULE_OUTPUT_TOKENS 估算）
+    AI_BATCH_OUTPUT_TOKENS: int = 6000
+    # 对各批共用的文档前缀启用 DashScope 显式上下文缓存（cache_control），缓存命中部分按缓存价计费
+    AI_CONTEXT_CACHE: bool = False
+    # 审查运行心跳超时（秒）：RUNNING 且超过此时长未更新的运行由 reap_stalled_runs 重新投递续跑
+    AI_RUN_STALL_SECONDS: int = 600
+    # 同一批次执行中断达到此次数后不再续跑，运行标记 FAILED
+    AI_RUN_MAX_ATTEMPTS: int = 3
+    # reap_stalled_runs 定时检查间隔（秒，需启动 celery beat）
+    AI_RUN_REAP_INTERVAL: int = 120
+    # 规则批次作为独立 Celery 任务分发到 ai 队列（worker 需监听：-Q celery,ai），关闭时在单个任务内用线程池执行
+    AI_FANOUT: bool = False
+    # 分发模式 chord 在途标记的有效期（秒）：期间 reaper 不重投该运行，每个批次任务开始时刷新；worker 全部退出时过期后再续跑
+    AI_FANOUT_CHORD_TTL: int = 3600
+    # 文档分窗审查：按大纲章节切成不超过此 token 数的上下文窗口（含表格），规则批次逐窗口执行；0 表示整篇拼接（超过 10 万字截断）
+    AI_DOC_WINDOW_TOKENS: int = 30000
+    # 分窗审查时全文类规则（缺失/跨章节一致性）整篇文档的 token 上限（应小于模型上下文长度），超出时改为逐窗口执行并附全文目录
+    AI_DOC_WIDE_MAX_TOKENS: int = 100000
+    # 每批请求附上知识库（NORM）中与本批规则相关的规范条文：每条规则检索条数（0 为不附）与每批总数上限
+    # （分批时按每批上限在 AI_BATCH_TOKEN_BUDGET 中预留条文 token）
+    AI_NORM_REFS_PER_RULE: int = 2
+    AI_NORM_REFS_MAX: int = 8
     
+    # 按项目公平调度处理管道与审查运行（Redis 队列，DRR 轮转；见 app/services/scheduler_service.py）
+    SCHED_ENABLED: bool = True
+    # 全局同时在跑的管道/审查作业上限，超出的留在调度队列
+    SCHED_MAX_RUNNING: int = 8
+    # 单个项目同时在跑的作业上限
+    SCHED_PROJECT_CONCURRENCY: int = 2
+    # DRR 每轮额度（作业数）
+    SCHED_QUANTUM: float = 1.0
+    # 项目权重，形如 "12:3,15:0.5"，未列出的为 1
+    SCHED_PROJECT_WEIGHTS: str = ""
+    # 调度定时出队间隔（秒，需启动 celery beat）
+    SCHED_PUMP_INTERVAL: int = 10
+
+    # 规范知识库 PDF 文本提取：超过 KB_PDF_SUBTASK_PAGES 页的 PDF 按页段拆成子任务并行入库（0 为不拆分）
+    KB_PDF_SUBTASK_PAGES: int = 300
+    # 进程内按页段分片并行提取（每片页数、进程数，0 为 CPU 核数；celery 子进程内不能派生进程池时顺序提取）
+    KB_PDF_SHARD_PAGES: int = 50
+    KB_PDF_WORKERS: int = 0
+
+    # 知识库包导入（POST /api/kb/import、导入知识库包.py）：API 只允许导入此目录下的包
+    KB_IMPORT_ROOT: str = "kb_packages"
+
+    # 规范知识库检索结果在 Redis 中的缓存时长（秒，0 为只用进程内缓存）；知识库变化时按代号自动失效
+    KB_CACHE_TTL: int = 3600
+
+    # 规范知识库检索使用 worker 本地 BM25 索引（numpy mmap，见 app/ai/kb_bm25.py），未发布索引时走数据库全文检索
+    KB_LOCAL_INDEX: bool = True
+    # 本地索引目录（多机部署可挂共享卷，避免每台机器各自构建）
+    KB_INDEX_DIR: str = "kb_index"
+    # 进程比对索引版本（Redis）的间隔（秒）
+    KB_INDEX_CHECK_SECONDS: int = 30
+
+    # 规范知识库本地向量化（ONNX 句向量模型，CPU；见 app/ai/kb_embedding.py），入库时计算 kb_chunk.embedding
+    KB_EMBED_ENABLED: bool = False
+    # 模型目录：model.onnx + tokenizer.json
+    KB_EMBED_MODEL_DIR: str = "models/bge-m3-onnx"
+    # 向量维度，须与 kb_chunk.embedding 的 vector(N) 一致
+    KB_EMBED_DIM: int = 1024
+    # 每次推理的文本条数与单条最大 token 数
+    KB_EMBED_BATCH: int = 32
+    KB_EMBED_MAX_TOKENS: int = 512
+    # 句向量池化方式：cls（bge-m3 / bge 系列）/ mean（按 attention_mask 平均，如 m3e、text2vec）；更换后需清空 embedding 重新回填
+    KB_EMBED_POOLING: str = "cls"
+    # onnxruntime 算子内线程数（0 为按 CPU 核数）
+    KB_EMBED_THREADS: int = 0
+    # kb_chunk.embedding 向量索引类型：hnsw / ivfflat（见 app/services/vector_index_service.py）
+    KB_VECTOR_INDEX: str = "hnsw"
+    KB_VECTOR_HNSW_M: int = 16
+    KB_VECTOR_HNSW_EF_CONSTRUCTION: int = 64
+    # 单次向量检索延迟预算（毫秒），有基准结果时据此选 ef_search / probes
+    KB_VECTOR_LATENCY_MS: float = 50.0
+    # 无基准结果时的默认 hnsw.ef_search 与 ivfflat.probes（0 为 sqrt(lists)）
+    KB_VECTOR_EF_SEARCH: int = 40
+    KB_VECTOR_PROBES: int = 0
+
     # Review
     AUTO_TRIGGER_REVIEW: bool = True  # 版本处理完成后是否自动触发规则审查
 
@@ -0,0 +1,78 @@
+"""
+协作式取消：取消版本处理或审查运行时在 Redis 写入取消标记，
+执行方（ProgressReporter.update、管道各步骤入口、AI 批次之间、进行中的 AI 请求）检查标记后尽快停止。
+Redis 不可用时视为未取消（库内状态仍为 CANCELED，后续步骤按状态自然结束）。
+"""
+import logging
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+VERSION = "version"
+RUN = "run"
+
+# 取消标记保留时长（秒）
+CANCEL_TTL = 86400
+
+
+class Canceled(Exception):
+    """当前版本处理或审查运行已被取消。"""
+
+
+def _key(kind: str, obj_id: int) -> str:
+    return f"sws:cancel:{kind}:{obj_id}"
+
+
+def _tasks_key(kind: str, obj_id: int) -> str:
+    return f"sws:tasks:{kind}:{obj_id}"
+
+
+def request_cancel(kind: str, obj_id: int) -> None:
+    """写入取消标记，并撤销登记过的尚未执行的 Celery 任务。"""
+    try:
+        r = get_redis()
+        r.set(_key(kind, obj_id), "1", ex=CANCEL_TTL)
+        task_ids = list(r.smembers(_tasks_key(kind, obj_id)))
+    except Exception as e:
+        logger.warning(f"写入取消标记失败（{kind} {obj_id}）: {e}")
+        return
+    if task_ids:
+        from ..worker.app import app
+        # 未开始的任务直接撤销；已在执行的任务靠取消标记协作退出
+        app.control.revoke(task_ids)
+        logger.info(f"已撤销 {kind} {obj_id} 的 {len(task_ids)} 个排队任务")
+
+
+def clear_cancel(kind: str, obj_id: int) -> None:
+    """重新处理 / 重新执行前清除旧的取消标记与任务登记。"""
+    try:
+        get_redis().delete(_key(kind, obj_id), _tasks_key(kind, obj_id))
+    except Exception as e:
+        logger.warning(f"清除取消标记失败（{kind} {obj_id}）: {e}")
+
+
+def register_tasks(kind: str, obj_id: int, task_ids: list[str]) -> None:
+    """登记某版本/运行已投递的 Celery 任务 ID，取消时据此撤销。"""
+    if not task_ids:
+        return
+    try:
+        r = get_redis()
+        r.sadd(_tasks_key(kind, obj_id), *task_ids)
+        r.expire(_tasks_key(kind, obj_id), CANCEL_TTL)
+    except Exception as e:
+        logger.warning(f"登记任务失败（{kind} {obj_id}）: {e}")
+
+
+def is_canceled(kind: str, obj_id: int | None) -> bool:
+    if obj_id is None:
+        return False
+    try:
+        return bool(get_redis().exists(_key(kind, obj_id)))
+    except Exception:
+        return False
+
+
+def raise_if_canceled(kind: str, obj_id: int | None) -> None:
+    if is_canceled(kind, obj_id):
+        raise Canceled(f"{kind} {obj_id} 已取消")
@@ -3,10 +3,16 @@
 """
 import logging
 import sys
+import time
 from typing import Optional
 
+from .cancellation import VERSION, raise_if_canceled
+
 logger = logging.getLogger(__name__)
 
+# update() 检查取消标记的最小间隔（秒），避免逐块处理时每次都访问 Redis
+CANCEL_CHECK_INTERVAL = 0.5
+
 
 class ProgressReporter:
     """进度报告器 - 输出到日志和控制台"""
@@ -23,9 +29,14 @@ class ProgressReporter:
         self.description = description
         self.version_id = version_id
         self._log_prefix = f"[版本 {version_id}] " if version_id else ""
+        self._last_cancel_check = 0.0
     
     def update(self, n: int = 1, message: str = ""):
-        """更新进度"""
+        """更新进度；版本已被取消时抛 Canceled，中止当前步骤"""
+        now = time.monotonic()
+        if self.version_id and now - self._last_cancel_check >= CANCEL_CHECK_INTERVAL:
+            self._last_cancel_check = now
+            raise_if_canceled(VERSION, self.version_id)
         self.current += n
         percentage = int((self.current / self.total) * 100) if self.total > 0 else 0
         status_msg = f"{self._log_prefix}{self.description}: {self.current}/{self.total} ({percentage}%)"
@@ -0,0 +1,20 @@
+"""
+进程内共享的 Redis 客户端（REDIS_URL），用于运行进度计数等跨 worker 的轻量状态。
+"""
+import threading
+
+import redis
+
+from ..settings import settings
+
+_client: redis.Redis | None = None
+_lock = threading.Lock()
+
+
+def get_redis() -> redis.Redis:
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _client
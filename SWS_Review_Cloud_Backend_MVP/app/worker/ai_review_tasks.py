@@ -3,17 +3,73 @@ AI 审查任务：全部使用规则校验引擎（AI），基于文档内容与
 - 单次请求最多重试 3 次后视为失败
 - 允许 2～3 批并发请求
 - 失败的批次规则重新加入处理队列再跑一轮
+- 流式返回时每条“规则校验结果”解析完成即落库，中途失败已落库的结果保留
+- 规范库中可确定性执行的规则（正则/合计/缺失章节/字段比对等）先在本地解释执行，
+  只有 ai_gap_check 等语义规则及本地取不到输入的规则才请求大模型（AI_LOCAL_RULES）
+- 每批状态记入 review_run_batch，worker 崩溃后由 reap_stalled_runs 重新投递并从未完成批次续跑
+- AI_FANOUT 时每批作为独立 Celery 任务投递到 ai 队列，由 chord 回调收尾，一次运行可用满所有 worker
+- AI_DOC_WINDOW_TOKENS > 0 时文档按大纲章节切成上下文窗口（含表格），规则批次逐窗口执行后经问题去重合并
 """
+import hashlib
 import json
 import logging
 import re
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from celery import chord
 from .. import db
 from ..settings import settings
-from ..services.review_run_service import get_review_run, update_run_status, insert_issue
-from ..ai.rule_engine_prompt import load_norm_lib, get_rule_batches, build_rule_engine_messages_batch
-from ..ai.qwen_client import chat_json
+from ..services.review_run_service import (
+    get_review_run,
+    update_run_status,
+    insert_issues_bulk,
+    review_issue_columns,
+    update_issues_provenance,
+    delete_issues,
+)
+from ..services.ai_usage_service import get_run_tokens
+from ..ai.rule_engine_prompt import (
+    RULE_ENGINE_SYSTEM,
+    load_norm_lib,
+    get_rule_batches,
+    pack_rule_batches,
+    estimate_tokens,
+    build_rule_engine_messages_batch,
+    NORM_REF_TOKENS,
+)
+from ..ai.qwen_client import chat_json, chat_json_stream
+from ..ai.rag import norm_refs_for_rules, prefetch_rule_refs
+from ..ai.model_router import TIER_LARGE, TIER_SMALL, batch_tier, split_by_tier, tier_model, output_problem
+from ..ai.evidence_index import EvidenceIndex
+from ..ai.issue_dedup import IssueDeduper
+from ..ai.doc_chunker import DocWindow, build_windows, render_document, render_outline, render_table
+from ..ai import telemetry
+from ..ai.telemetry import TokenBudgetExceeded
+from ..rule_engine.base import IssueDraft
+from ..rule_engine.norm_lib_interpreter import NormLibInterpreter
+from ..services.checkpoint_runner import build_context
+from ..services.review_batch_service import (
+    ROUND_FIRST,
+    ROUND_LOCAL,
+    ROUND_RETRY,
+    claim_run,
+    create_run_batches,
+    find_stalled_runs,
+    get_run_batch,
+    list_run_batches,
+    list_run_issues_for_dedup,
+    mark_batch_done,
+    mark_batch_failed,
+    mark_batch_running,
+    requeue_run,
+    reset_inflight_batches,
+    touch_run,
+)
+from ..utils.redis_client import get_redis
+from ..utils.cancellation import RUN, Canceled, is_canceled, raise_if_canceled
 from .app import app
+from .scheduler_tasks import pump_scheduler_task
 
 _schema = settings.DB_SCHEMA
 logger = logging.getLogger(__name__)
@@ -22,6 +78,10 @@ logger = logging.getLogger(__name__)
 MAX_REQUEST_RETRIES = 3
 # 并发批次数（2～3）
 CONCURRENT_BATCHES = 3
+# 规则引擎输出中问题数组的键名
+ISSUES_KEY = "规则校验结果"
+# 每批请求中除文档与系统提示外的固定说明（批次头、输出要求）预估 token
+BATCH_INSTRUCTION_TOKENS = 600
 
 # 问题类型枚举（AI/用户） -> 库内 issue_type（含 sum_check_row/col、percentage_sum、punctuation、missing_section、ai_gap 等）
 ISSUE_TYPE_MAP = {
@@ -55,156 +115,931 @@ SEVERITY_MAP = {
 }
 
 
-def _run_one_batch_with_retries(doc_content: str, rules_batch: list, batch_index: int, total_batches: int):
+def _run_one_batch_with_retries(
+    doc_content: str,
+    rules_batch: list,
+    batch_index: int,
+    total_batches: int,
+    sink: "_RunIssueSink | None" = None,
+    tier: str = TIER_LARGE,
+    batch_id: int | None = None,
+    window_label: str | None = None,
+):
     """
-    执行单批 AI 请求，最多重试 MAX_REQUEST_RETRIES 次。
+    执行单批 AI 请求，最多重试 MAX_REQUEST_RETRIES 次；运行被取消时抛 Canceled（进行中的请求被中断）。
+    传入 sink 且开启流式时，每条问题解析完成即经 sink 落库（重试时 sink 去重，不会重复写入），
+    batch_id 为 review_run_batch 行 id，用作问题的幂等写入键；分窗审查时 doc_content 为窗口正文，window_label 为窗口说明。
+    tier 为小模型档位时，结果先缓冲并校验（output_problem），非法 JSON 或低置信度时本批升级到大模型重跑，
+    校验通过后才落库。
+    每次尝试的 token/耗时按 (run_id, 本批规则, 尝试序号) 记入 ai_request_log；超出运行 token 预算时抛 TokenBudgetExceeded。
     返回 (rules_batch, out_dict or None)，失败时 out 为 None。
     """
+    norm_chunks = None
+    if settings.AI_NORM_REFS_PER_RULE > 0:
+        norm_chunks = norm_refs_for_rules(rules_batch, settings.AI_NORM_REFS_PER_RULE, settings.AI_NORM_REFS_MAX)
     messages = build_rule_engine_messages_batch(
-        doc_content, rules_batch, batch_index, total_batches
+        doc_content,
+        rules_batch,
+        batch_index,
+        total_batches,
+        context_cache=settings.AI_CONTEXT_CACHE,
+        window_label=window_label,
+        norm_chunks=norm_chunks,
     )
+    rule_by_id = _rule_index(rules_batch)
+    run_id = sink.run_id if sink is not None else None
+    rule_ids = [r.get("rule_id") for r in rules_batch]
     for attempt in range(MAX_REQUEST_RETRIES):
+        raise_if_canceled(RUN, run_id)
+        telemetry.check_budget(run_id)
+        model = tier_model(tier)
         try:
-            out = chat_json(messages)
-            return (rules_batch, out)
+            with telemetry.call_context(run_id, rule_ids, attempt + 1):
+                if tier == TIER_SMALL:
+                    out = chat_json(messages, model=model)
+                elif sink is not None and settings.AI_STREAM_RESPONSES:
+                    out = chat_json_stream(
+                        messages, ISSUES_KEY, lambda item: sink.persist(item, rule_by_id, batch_id), model=model
+                    )
+                else:
+                    out = chat_json(messages, model=model)
+        except json.JSONDecodeError as e:
+            if tier == TIER_SMALL:
+                logger.info(f"AI batch {batch_index + 1}/{total_batches} 小模型返回非法 JSON，升级大模型: {e}")
+                tier = TIER_LARGE
+                continue
+            logger.warning(
+                f"AI batch {batch_index + 1}/{total_batches} attempt {attempt + 1}/{MAX_REQUEST_RETRIES} failed: {e}"
+            )
+            continue
+        except (TokenBudgetExceeded, Canceled):
+            raise
         except Exception as e:
             logger.warning(
                 f"AI batch {batch_index + 1}/{total_batches} attempt {attempt + 1}/{MAX_REQUEST_RETRIES} failed: {e}"
             )
+            continue
+        if tier == TIER_SMALL:
+            problem = output_problem(out, rules_batch, ISSUES_KEY)
+            if problem:
+                logger.info(f"AI batch {batch_index + 1}/{total_batches} 小模型结果不可靠（{problem}），升级大模型")
+                tier = TIER_LARGE
+                continue
+        return (rules_batch, out)
     return (rules_batch, None)
 
 
-def _process_batch_result(out, blocks, version_id, run_id, rules_batch: list[dict]):
-    """解析单批 AI 返回的 JSON，写入 issues 表；review_type 来自本批规则，用于形式/技术统计。返回本批写入条数。"""
-    raw_issues = out.get("规则校验结果") or out.get("issues") or []
-    if not isinstance(raw_issues, list):
-        raw_issues = []
-    rule_by_id = {r.get("rule_id"): r for r in (rules_batch or []) if r.get("rule_id")}
-    count = 0
-    for item in raw_issues:
-        try:
-            rule_id = (item.get("rule_definition") or {}).get("rule_id") or item.get("checkpoint_code")
-            rule = rule_by_id.get(rule_id) if rule_id else None
-            mapped = _map_engine_issue_to_db(item, blocks, rule=rule)
-            if not mapped:
+def _rule_index(rules_batch: list[dict] | None) -> dict:
+    return {r.get("rule_id"): r for r in (rules_batch or []) if r.get("rule_id")}
+
+
+def _issue_key(item: dict) -> tuple:
+    """同一次运行内识别同一条问题（流式已落库 / 整体解析 / 重试返回），避免重复写入。"""
+    rule_id = (item.get("rule_definition") or {}).get("rule_id") or item.get("checkpoint_code") or ""
+    title = (item.get("issue_title") or item.get("title") or "").strip()
+    snippets = (item.get("evidence") or {}).get("snippets") or []
+    first = snippets[0] if isinstance(snippets, list) and snippets else snippets
+    return (rule_id, title, re.sub(r"\s+", "", str(first or ""))[:100])
+
+
+def _issue_row_key(row: dict) -> tuple:
+    """已映射问题行的内容键（调用方未给去重键时使用）。"""
+    quotes = row.get("evidence_quotes") or []
+    quote = quotes[0].get("quote") if quotes and isinstance(quotes[0], dict) else ""
+    return (row.get("checkpoint_code") or "", row.get("title") or "", re.sub(r"\s+", "", quote or "")[:100])
+
+
+def _content_ordinal(key: tuple) -> int:
+    """问题内容键 -> batch_ordinal（sha256 前 31 位，落在 int 列范围内）。"""
+    digest = hashlib.sha256(json.dumps(key, ensure_ascii=False, default=str).encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") & 0x7FFFFFFF
+
+
+class _RunIssueSink:
+    """
+    单次审查运行的问题写入器，供多个并发批次共享：
+    先按 _issue_key 精确去重，再经 IssueDeduper 跨批次聚类（同一证据位置 + 同类型 + 标题相似），
+    重复报告合并进已有问题的 provenance，不再新增行。
+    """
+
+    def __init__(self, blocks: list[dict], version_id: int, run_id: int):
+        self.blocks = blocks
+        self.index = EvidenceIndex(blocks)
+        self.version_id = version_id
+        self.run_id = run_id
+        self.count = 0
+        self.merged = 0
+        self._seen: set[tuple] = set()
+        self._lock = threading.Lock()
+        self._deduper = IssueDeduper()
+        # 聚类与写库串行：簇的 issue_id 在写库后回填，避免并发批次把同一问题各写一行
+        self._write_lock = threading.Lock()
+        # batch_id -> 本批新写入条数
+        self.batch_counts: dict[int, int] = {}
+
+    def restore(self, rows: list[dict]) -> None:
+        """续跑时载入本运行已落库的问题，重跑批次的相同问题合并到已有行。"""
+        with self._write_lock:
+            for row in rows:
+                self._deduper.restore(row, row["id"])
+
+    def persist(self, item: dict, rule_by_id: dict, batch_id: int | None = None) -> bool:
+        """映射并写入一条问题（流式逐条回调用）；已写过或无法映射时返回 False。"""
+        return self.persist_many([item], rule_by_id, batch_id) == 1
+
+    def persist_many(self, items: list, rule_by_id: dict, batch_id: int | None = None) -> int:
+        """映射并批量写入多条问题（一次页码/锚点查询 + 一条多行 INSERT），返回新写入条数。"""
+        rows, keys = [], []
+        for item in items:
+            if not isinstance(item, dict):
                 continue
-            insert_issue(
-                version_id=version_id,
-                run_id=run_id,
-                issue_type=mapped["issue_type"],
-                severity=mapped["severity"],
-                title=mapped["title"],
-                description=mapped["description"],
-                suggestion=mapped["suggestion"],
-                confidence=mapped.get("confidence", 0.7),
-                page_no=mapped.get("page_no"),
-                evidence_block_ids=mapped.get("evidence_block_ids") or [],
-                evidence_quotes=mapped.get("evidence_quotes") or [],
-                anchor_rects=None,
-                checkpoint_code=mapped.get("checkpoint_code"),
-                review_type=mapped.get("review_type"),
-            )
-            count += 1
+            key = _issue_key(item)
+            with self._lock:
+                if key in self._seen:
+                    continue
+                self._seen.add(key)
+            try:
+                rule_id = (item.get("rule_definition") or {}).get("rule_id") or item.get("checkpoint_code")
+                rule = rule_by_id.get(rule_id) if rule_id else None
+                mapped = _map_engine_issue_to_db(item, self.blocks, rule=rule, index=self.index)
+            except Exception as e:
+                logger.warning(f"Skip issue item: {e}", exc_info=False)
+                continue
+            if mapped:
+                rows.append({**mapped, "anchor_rects": None})
+                keys.append(key)
+        return self._write(rows, "ai", batch_id, keys)
+
+    def persist_drafts(self, drafts: list[tuple[IssueDraft, dict]], batch_id: int | None = None) -> int:
+        """写入本地解释执行规范库规则得到的问题（checkpoint_code 为规则 ID），返回新写入条数。"""
+        rows, keys = [], []
+        for draft, rule in drafts:
+            quotes = draft.evidence_quotes or []
+            key = (rule.get("rule_id") or "", draft.title, re.sub(r"\s+", "", (quotes[0].get("quote") if quotes else "") or "")[:100])
+            with self._lock:
+                if key in self._seen:
+                    continue
+                self._seen.add(key)
+            rows.append(_draft_to_issue(draft, rule))
+            keys.append(key)
+        return self._write(rows, "local", batch_id, keys)
+
+    def _unsee(self, keys: list[tuple]) -> None:
+        """未能落库的问题移出已写集合，重试/整体解析再次返回时仍可写入。"""
+        with self._lock:
+            self._seen.difference_update(keys)
+
+    def _insert(self, rows: list[dict]) -> list[int | None]:
+        """一条多行 INSERT 写入；失败时逐行重写，仍失败的行对应 None（一行坏数据不拖累整批）。"""
+        if not rows:
+            return []
+        try:
+            return insert_issues_bulk(self.version_id, self.run_id, rows)
         except Exception as e:
-            logger.warning(f"Skip issue item: {e}", exc_info=False)
-    return count
+            logger.warning(f"Insert {len(rows)} issues failed, retry one by one: {e}", exc_info=False)
+        ids: list[int | None] = []
+        for row in rows:
+            try:
+                ids.append((insert_issues_bulk(self.version_id, self.run_id, [row]) or [None])[0])
+            except Exception as e:
+                logger.warning(f"Insert issue failed: {e}", exc_info=False)
+                ids.append(None)
+        return ids
+
+    def _write(self, rows: list[dict], source: str, batch_id: int | None = None, keys: list[tuple] | None = None) -> int:
+        """
+        聚类后写入新问题，并回写被合并的已落库问题的 provenance；返回新写入条数。
+        带 batch_id 时 batch_ordinal 取自问题内容（去重键）的哈希，(run_id, batch_id, batch_ordinal) 为幂等写入键：
+        重跑批次报告的相同问题写回已有行，不同问题不会因续跑后序号从头编起而撞上已有行。
+        keys 为各行的去重键（与 rows 一一对应），写库失败的行据此移出已写集合。
+        """
+        if not rows:
+            return 0
+        with self._write_lock:
+            if batch_id is not None:
+                for i, row in enumerate(rows):
+                    row["batch_id"] = batch_id
+                    row["batch_ordinal"] = _content_ordinal(keys[i] if keys else _issue_row_key(row))
+            new_rows, new_clusters, merged = [], [], {}
+            # 本次新建簇 -> 并入该簇的全部行（含首行），簇写库失败时这些行一并视为未写入
+            members: dict[int, list[dict]] = {}
+            for row in rows:
+                cluster, is_new = self._deduper.add(row, source)
+                if is_new:
+                    new_rows.append(row)
+                    new_clusters.append(cluster)
+                    members[id(cluster)] = [row]
+                elif cluster.issue_id is not None:
+                    merged[cluster.issue_id] = cluster
+                elif id(cluster) in members:
+                    members[id(cluster)].append(row)
+            ids = self._insert(new_rows)
+            failed_rows = []
+            for cluster, issue_id in zip(new_clusters, ids):
+                if issue_id is None:
+                    # 未落库的簇移出聚类器，避免后续重复报告并入这条不存在的问题而被静默丢弃
+                    self._deduper.discard(cluster)
+                    failed_rows.extend(members[id(cluster)])
+                    continue
+                cluster.issue_id = issue_id
+                cluster.dirty = False
+            if failed_rows and keys:
+                key_of = {id(row): key for row, key in zip(rows, keys)}
+                self._unsee([key_of[id(row)] for row in failed_rows if id(row) in key_of])
+            written = sum(1 for i in ids if i is not None)
+            if merged:
+                try:
+                    update_issues_provenance([
+                        {"id": issue_id, "provenance": c.provenance, "confidence": c.row.get("confidence")}
+                        for issue_id, c in merged.items()
+                    ])
+                except Exception as e:
+                    logger.warning(f"Merge {len(merged)} duplicate issues failed: {e}", exc_info=False)
+                for c in merged.values():
+                    c.dirty = False
+            with self._lock:
+                self.count += written
+                self.merged += len(rows) - len(new_rows) - (len(failed_rows) - (len(ids) - written))
+                if batch_id is not None:
+                    self.batch_counts[batch_id] = self.batch_counts.get(batch_id, 0) + written
+            return written
+
+
+def _draft_to_issue(draft: IssueDraft, rule: dict) -> dict:
+    return {
+        "issue_type": draft.issue_type,
+        "severity": draft.severity,
+        "title": draft.title,
+        "description": draft.description,
+        "suggestion": draft.suggestion,
+        "confidence": draft.confidence,
+        "page_no": draft.page_no,
+        "evidence_block_ids": draft.evidence_block_ids,
+        "evidence_quotes": draft.evidence_quotes,
+        "anchor_rects": draft.anchor_rects,
+        "checkpoint_code": (rule.get("rule_id") or "NORM_RULE")[:64],
+        "review_type": rule.get("review_type"),
+    }
+
+
+def _make_batches(rules: list[dict], doc_content: str) -> list[list[dict]]:
+    """
+    规则分批：先按模型档位（model_router）拆开，同档规则再分批，保证每批只走一个模型。
+    AI_BATCH_TOKEN_BUDGET > 0 时按 token 预算装箱（系统提示 + 文档为每批共有成本），否则沿用固定每批 5～7 条。
+    附规范条文时每批最多 AI_NORM_REFS_MAX 条、每条不超过 NORM_REF_TOKENS，按上限预留在共有成本中。
+    """
+    tiers = split_by_tier(rules)
+    if len(tiers) > 1:
+        return [b for tier in (TIER_LARGE, TIER_SMALL) for b in _make_batches(tiers.get(tier) or [], doc_content)]
+    if settings.AI_BATCH_TOKEN_BUDGET <= 0:
+        return get_rule_batches(rules, batch_size=6)
+    fixed = estimate_tokens(RULE_ENGINE_SYSTEM) + estimate_tokens(doc_content[:120000]) + BATCH_INSTRUCTION_TOKENS
+    if settings.AI_NORM_REFS_PER_RULE > 0:
+        fixed += settings.AI_NORM_REFS_MAX * NORM_REF_TOKENS
+    return pack_rule_batches(
+        rules,
+        prompt_budget=settings.AI_BATCH_TOKEN_BUDGET,
+        fixed_tokens=fixed,
+        output_budget=settings.AI_BATCH_OUTPUT_TOKENS,
+    )
+
+
+def _run_local_rules(version_id: int, norm_lib: list[dict]) -> tuple[list[tuple[IssueDraft, dict]], list[dict]]:
+    """本地解释执行规范库中可确定性判断的规则，返回 (问题草稿, 仍需大模型判断的规则)。"""
+    if not settings.AI_LOCAL_RULES:
+        return [], norm_lib
+    try:
+        interpreter = NormLibInterpreter(build_context(version_id))
+        drafts, llm_rules = interpreter.run(norm_lib)
+    except Exception as e:
+        logger.error(f"[版本 {version_id}] 规范库本地执行失败，全部规则改走 AI: {e}", exc_info=True)
+        return [], norm_lib
+    logger.info(
+        f"[版本 {version_id}] 本地执行 {len(norm_lib) - len(llm_rules)} 条规范库规则，得到 {len(drafts)} 条问题；"
+        f"{len(llm_rules)} 条规则交给 AI"
+    )
+    return drafts, llm_rules
+
+
+def _result_hash(out) -> str:
+    """批次结果哈希（sha256），写入 review_run_batch.result_hash 便于核对重跑结果是否一致。"""
+    return hashlib.sha256(json.dumps(out, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _window_batches(state: "_RunState", rules: list[dict], window_no: int | None, tier: str | None = None) -> list[dict]:
+    """
+    规则在一个窗口（window_no 为 None 时为整篇文档）上的批次计划，每项 {rule_ids, tier, window_no}；
+    tier 为空时按本批规则路由模型档位。
+    """
+    if window_no is None:
+        content = state.full_content()
+    else:
+        content = state.window_content(window_no, doc_wide=any(_is_doc_wide(r) for r in rules))
+    return [
+        {"rule_ids": [r.get("rule_id") for r in rb], "tier": tier or batch_tier(rb), "window_no": window_no}
+        for rb in _make_batches(rules, content)
+    ]
+
+
+# 需要看全文才能判断的校验模式，分窗审查时仍在整篇文档上执行：
+# 缺失/差距类（只看一个窗口会误报缺失）与跨章节一致性类（比对的字段、表格常分布在不同窗口，拆开后无从比对）
+DOC_WIDE_MODES = frozenset({
+    "ai_gap_check",
+    "missing_section_check",
+    "all_equal",
+    "fuzzy_equal",
+    "numeric_equal",
+    "key_field_crosscheck",
+    "catalog_match",
+    "formula_balance_check",
+})
+
+
+def _is_doc_wide(rule: dict) -> bool:
+    return (rule.get("compare") or {}).get("mode") in DOC_WIDE_MODES
+
+
+def _plan_run(state: "_RunState") -> tuple[list[dict], list[tuple[IssueDraft, dict]]]:
+    """
+    首次执行时生成并落库批次计划：round 0 为本地执行的规则，round 1 为 AI 批次。
+    分窗审查时 AI 规则在每个窗口上各分一组批次（map），结果经运行内去重合并（reduce）；
+    缺失/差距类与跨章节一致性类规则（DOC_WIDE_MODES）不分窗，在整篇文档上执行；
+    全文超过 AI_DOC_WIDE_MAX_TOKENS 时改为逐窗口执行，每个窗口前附全文目录。
+    返回 (全部批次行, 本地规则问题草稿)。
+    """
+    version_id, run_id, norm_lib = state.version_id, state.run_id, state.norm_lib
+    drafts, llm_rules = _run_local_rules(version_id, norm_lib)
+    llm_ids = {r.get("rule_id") for r in llm_rules}
+    local_ids = [r.get("rule_id") for r in norm_lib if r.get("rule_id") not in llm_ids]
+    if local_ids:
+        create_run_batches(run_id, ROUND_LOCAL, [{"rule_ids": local_ids, "tier": None}])
+    if len(state.windows) > 1:
+        doc_rules = [r for r in llm_rules if _is_doc_wide(r)]
+        window_rules = [r for r in llm_rules if not _is_doc_wide(r)]
+        batches = [b for w in state.windows for b in _window_batches(state, window_rules, w.index)]
+        if doc_rules and state.doc_wide_fits():
+            batches += _window_batches(state, doc_rules, None)
+        elif doc_rules:
+            logger.warning(
+                f"[版本 {version_id}] 全文约 {estimate_tokens(state.full_content())} tokens，"
+                f"超过 AI_DOC_WIDE_MAX_TOKENS={settings.AI_DOC_WIDE_MAX_TOKENS}，"
+                f"{len(doc_rules)} 条全文规则改为逐窗口执行（附全文目录）"
+            )
+            batches += [b for w in state.windows for b in _window_batches(state, doc_rules, w.index)]
+    elif state.windows:
+        batches = _window_batches(state, llm_rules, 0)
+    else:
+        batches = _window_batches(state, llm_rules, None)
+    create_run_batches(run_id, ROUND_FIRST, batches)
+    return list_run_batches(run_id), drafts
+
+
+def _process_batch_result(out, sink: _RunIssueSink, rules_batch: list[dict], batch_id: int | None = None):
+    """
+    解析单批 AI 返回的 JSON，批量写入 issues 表；review_type 来自本批规则，用于形式/技术统计。
+    流式已落库的条目由 sink 去重跳过。返回本批新写入条数。
+    """
+    raw_issues = out.get(ISSUES_KEY) or out.get("issues") or []
+    if not isinstance(raw_issues, list):
+        raw_issues = []
+    return sink.persist_many(raw_issues, _rule_index(rules_batch), batch_id)
+
+
+class _RunState:
+    """
+    单次审查运行执行所需的共享数据：文档块、文档内容（或分窗后的上下文窗口）、规则索引与问题写入器。
+    """
+
+    def __init__(
+        self,
+        version_id: int,
+        run_id: int,
+        blocks: list[dict],
+        windows: list[DocWindow] | None = None,
+        window_blocks: list[dict] | None = None,
+        outline_nodes: list[dict] | None = None,
+    ):
+        self.version_id = version_id
+        self.run_id = run_id
+        self.blocks = blocks
+        self.windows = windows or []
+        self.window_blocks = window_blocks or blocks
+        self.outline_nodes = outline_nodes or []
+        self.doc_content = "" if self.windows else _build_doc_content(blocks)
+        self.norm_lib = load_norm_lib()
+        self.rules_by_id = _rule_index(self.norm_lib)
+        self.sink = _RunIssueSink(blocks, version_id, run_id)
+
+    def rules_of(self, batch_row: dict) -> list[dict]:
+        return [self.rules_by_id[r] for r in batch_row["rule_ids"] or [] if r in self.rules_by_id]
+
+    def full_content(self) -> str:
+        """
+        整篇文档内容。分窗审查时首次用到才渲染，格式与窗口相同（含章节标题与表格）、不截断，
+        放不下时由 doc_wide_fits 判定后改走“目录 + 窗口”。
+        """
+        if not self.doc_content:
+            self.doc_content = render_document(self.window_blocks, self.outline_nodes)
+        return self.doc_content
+
+    def doc_wide_fits(self) -> bool:
+        """整篇文档是否能在一次请求内放下（AI_DOC_WIDE_MAX_TOKENS）。"""
+        return estimate_tokens(self.full_content()) <= settings.AI_DOC_WIDE_MAX_TOKENS
+
+    def window_content(self, window_no: int, doc_wide: bool = False) -> str:
+        """窗口正文；全文规则在全文放不下时逐窗口执行，窗口前附全文目录以便判断缺失与跨章节关系。"""
+        window = self.windows[min(window_no, len(self.windows) - 1)]
+        if not doc_wide or len(self.windows) == 1:
+            return window.text
+        outline = render_outline(self.outline_nodes)
+        return f"【全文目录】\n{outline}\n\n{window.text}" if outline else window.text
+
+    def content_of(self, batch_row: dict) -> tuple[str, str | None]:
+        """批次对应的 (文档内容, 窗口说明)；未分窗的批次为整篇文档，只有一个窗口时窗口即全文、不加说明。"""
+        window_no = batch_row.get("window_no")
+        if window_no is None or not self.windows:
+            return self.full_content(), None
+        window = self.windows[min(window_no, len(self.windows) - 1)]
+        if len(self.windows) == 1:
+            return window.text, None
+        doc_wide = any(_is_doc_wide(r) for r in self.rules_of(batch_row))
+        path = " > ".join(window.heading_path)
+        label = f"第 {window.index + 1}/{len(self.windows)} 段" + (f"，起始章节 {path}" if path else "")
+        if doc_wide:
+            label += "，前附全文目录；本段未出现的内容可能在其他章节"
+        return self.window_content(window.index, doc_wide), label
+
+
+def _load_run_state(version_id: int, run_id: int) -> _RunState | None:
+    """读取文档块构造运行数据；无文档块时返回 None。"""
+    # 写入前先确认 review_issue 可写列（进程内缓存，后续批量写入不再试错）
+    review_issue_columns()
+    blocks = _get_all_blocks_with_page(version_id)
+    if not blocks:
+        logger.warning(f"No blocks found for version {version_id}")
+        return None
+    if settings.AI_DOC_WINDOW_TOKENS <= 0:
+        return _RunState(version_id, run_id, blocks)
+    window_blocks = _get_window_blocks(version_id, blocks)
+    outline_nodes = _get_outline_nodes(version_id)
+    windows = build_windows(window_blocks, outline_nodes, settings.AI_DOC_WINDOW_TOKENS)
+    return _RunState(version_id, run_id, blocks, windows, window_blocks, outline_nodes)
+
+
+def _prepare_run(state: _RunState) -> list[dict]:
+    """
+    首次执行时生成批次计划；续跑时重置中断批次并载入已落库问题供去重。
+    随后执行（未完成的）本地规则批次，返回全部批次行。
+    """
+    version_id, run_id = state.version_id, state.run_id
+    batch_rows = list_run_batches(run_id)
+    drafts = None
+    if batch_rows:
+        reset = reset_inflight_batches(run_id)
+        batch_rows = list_run_batches(run_id)
+        existing = list_run_issues_for_dedup(run_id)
+        state.sink.restore(existing)
+        done = sum(1 for b in batch_rows if b["status"] == "DONE")
+        logger.info(
+            f"[版本 {version_id}] 续跑审查运行 {run_id}：{done}/{len(batch_rows)} 批已完成，"
+            f"{len(reset)} 批中断后重跑，已有 {len(existing)} 条问题"
+        )
+    else:
+        batch_rows, drafts = _plan_run(state)
+
+    for b in batch_rows:
+        if b["round"] == ROUND_LOCAL and b["status"] != "DONE":
+            mark_batch_running(b["id"])
+            if drafts is None:
+                drafts, _ = _run_local_rules(version_id, state.rules_of(b))
+            cnt = state.sink.persist_drafts(drafts, b["id"])
+            mark_batch_done(b["id"], None, cnt)
+            logger.info(f"[版本 {version_id}] 本地规则问题写入 {cnt} 条")
+    return batch_rows
+
+
+def _prefetch_norm_refs(state: _RunState, batch_rows: list[dict]) -> None:
+    """运行开始时预取各规则的规范条文检索（写入进程内与 Redis 缓存），批次执行时直接命中。"""
+    if settings.AI_NORM_REFS_PER_RULE <= 0:
+        return
+    rules = [r for b in batch_rows if b["status"] != "DONE" for r in state.rules_of(b)]
+    t0 = time.perf_counter()
+    n = prefetch_rule_refs(rules, settings.AI_NORM_REFS_PER_RULE)
+    logger.info(f"[版本 {state.version_id}] 预取规范条文检索 {n} 条，耗时 {time.perf_counter() - t0:.2f}s")
+
+
+def _run_batch(state: _RunState, batch_row: dict, n_batches: int, round_name: str) -> bool:
+    """
+    执行一批并记录检查点（RUNNING -> DONE / FAILED），返回是否成功。
+    超出 token 预算时抛 TokenBudgetExceeded、运行被取消时抛 Canceled，批次保持 RUNNING，续跑时重置
+    （分发模式下超出预算的批次由 run_ai_batch_task 置 FAILED）。
+    """
+    batch_id, batch_index = batch_row["id"], batch_row["batch_no"]
+    mark_batch_running(batch_id)
+    touch_run(state.run_id)
+    doc_content, window_label = state.content_of(batch_row)
+    try:
+        rules_batch, out = _run_one_batch_with_retries(
+            doc_content,
+            state.rules_of(batch_row),
+            batch_index,
+            n_batches,
+            state.sink,
+            batch_row["tier"] or TIER_LARGE,
+            batch_id,
+            window_label,
+        )
+    except (TokenBudgetExceeded, Canceled):
+        raise
+    except Exception as e:
+        logger.error(f"Batch {batch_index + 1} error: {e}", exc_info=True)
+        mark_batch_failed(batch_id, str(e))
+        return False
+    if out is None:
+        mark_batch_failed(batch_id, f"failed after {MAX_REQUEST_RETRIES} retries")
+        logger.warning(f"Batch {batch_index + 1}/{n_batches} failed after {MAX_REQUEST_RETRIES} retries")
+        return False
+    cnt = _process_batch_result(out, state.sink, rules_batch, batch_id)
+    mark_batch_done(batch_id, _result_hash(out), state.sink.batch_counts.get(batch_id, 0))
+    logger.info(
+        f"[版本 {state.version_id}] {round_name} 第 {batch_index + 1}/{n_batches} 批完成，"
+        f"整体解析补写 {cnt} 条，累计 {state.sink.count} 条结果"
+    )
+    return True
+
+
+def _retry_round(state: _RunState) -> list[dict]:
+    """
+    首轮失败批次的规则重新分批（全部走大模型）作为重试轮，分窗审查时仍在原窗口上重试；已生成过则直接返回。
+    """
+    batch_rows = list_run_batches(state.run_id)
+    retry_rows = [b for b in batch_rows if b["round"] == ROUND_RETRY]
+    if retry_rows:
+        return retry_rows
+    failed_by_window: dict[int | None, list[dict]] = {}
+    for b in batch_rows:
+        if b["round"] == ROUND_FIRST and b["status"] == "FAILED":
+            window_no = b.get("window_no") if state.windows else None
+            failed_by_window.setdefault(window_no, []).extend(state.rules_of(b))
+    if not failed_by_window:
+        return []
+    retry_batches = [
+        b for window_no, rules in failed_by_window.items() for b in _window_batches(state, rules, window_no, TIER_LARGE)
+    ]
+    n_failed = sum(len(rules) for rules in failed_by_window.values())
+    logger.info(
+        f"[版本 {state.version_id}] 将 {n_failed} 条失败规则重新入队，分 {len(retry_batches)} 批重试"
+    )
+    return create_run_batches(state.run_id, ROUND_RETRY, retry_batches)
+
+
+def _log_round_plan(state: _RunState, round_rows: list[dict]) -> None:
+    sizes = [len(b["rule_ids"] or []) for b in round_rows]
+    windows = f"，文档分 {len(state.windows)} 个窗口" if state.windows else ""
+    logger.info(
+        f"[版本 {state.version_id}] 共 {sum(sizes)} 条规则{'次' if state.windows else ''}，分 {len(round_rows)} 批请求"
+        f"（每批 {min(sizes)}～{max(sizes)} 条）{windows}"
+        + ("，分发到 ai 队列" if settings.AI_FANOUT else f"，并发 {CONCURRENT_BATCHES} 批")
+    )
+
+
+def _claim(version_id: int, run: dict) -> bool:
+    """占用运行；已结束（DONE / CANCELED）的运行不会重新执行，明确告警，需重新审查时应新建审查运行。"""
+    if claim_run(run["id"], settings.AI_RUN_STALL_SECONDS):
+        return True
+    if run["status"] in ("DONE", "CANCELED"):
+        logger.warning(
+            f"[版本 {version_id}] 审查运行 {run['id']} 已结束（{run['status']}），不会重新执行；如需重新审查请新建审查运行"
+        )
+    else:
+        logger.info(f"[版本 {version_id}] 审查运行 {run['id']} 状态为 {run['status']}，已由其他 worker 执行，跳过")
+    return False
 
 
 def _execute_ai_review(version_id: int, run_id: int):
     """
-    执行 AI 规则校验：按批请求，每批 5～7 条规则；单次请求最多重试 3 次；
+    执行 AI 规则校验：按 token 预算分批请求（见 _make_batches）；单次请求最多重试 3 次；
     允许 2～3 批并发；失败批次的规则重新入队再跑一轮。
+    每批在 review_run_batch 中记录检查点：worker 中途退出后重新执行本函数（reaper 重新投递）时，
+    已完成批次直接跳过，中断时在跑的批次清掉部分结果后重跑。
     """
     run = get_review_run(run_id)
     if not run or run["version_id"] != version_id:
         return
+    if not _claim(version_id, run):
+        return
 
     update_run_status(run_id, "RUNNING", progress=0)
-
-    blocks = _get_all_blocks_with_page(version_id)
-    if not blocks:
-        logger.warning(f"No blocks found for version {version_id}")
+    state = _load_run_state(version_id, run_id)
+    if state is None:
         update_run_status(run_id, "DONE", progress=100)
         return
 
-    doc_content = _build_doc_content(blocks)
-    norm_lib = load_norm_lib()
-    batches = get_rule_batches(norm_lib, batch_size=6)
-    total_batches = len(batches)
-
-    if total_batches == 0:
-        logger.warning("No rules in norm lib, skip AI review")
+    batch_rows = _prepare_run(state)
+    first_round = [b for b in batch_rows if b["round"] == ROUND_FIRST]
+    if not first_round:
+        logger.warning("No rules left for AI, skip AI requests")
         update_run_status(run_id, "DONE", progress=100)
         return
+    _log_round_plan(state, first_round)
+    _prefetch_norm_refs(state, first_round)
 
-    logger.info(
-        f"[版本 {version_id}] 共 {len(norm_lib)} 条规则，分 {total_batches} 批请求（每批 5～7 条），并发 {CONCURRENT_BATCHES} 批"
-    )
-
-    total_issues = 0
-    failed_rules = []
+    budget_error = None
+    canceled = False
 
-    def run_round(batches_list: list[list], round_name: str):
-        """并发执行多批（最多 CONCURRENT_BATCHES 批同时请求），收集成功条数与失败规则。"""
-        nonlocal total_issues
-        n_batches = len(batches_list)
-        round_issues = 0
-        round_failed = []
-        completed = 0
+    def run_round(round_rows: list[dict], round_name: str):
+        """
+        并发执行本轮未完成的批次（最多 CONCURRENT_BATCHES 批同时请求），逐批记录检查点；
+        超出 token 预算或运行被取消时取消未开始的批次。批次的模型档位在计划时确定（重试轮全部为大模型）。
+        """
+        nonlocal budget_error, canceled
+        n_batches = len(round_rows)
+        pending = [b for b in round_rows if b["status"] == "PENDING"]
+        completed = n_batches - len(pending)
         with ThreadPoolExecutor(max_workers=CONCURRENT_BATCHES) as executor:
-            futures = {
-                executor.submit(
-                    _run_one_batch_with_retries,
-                    doc_content,
-                    rb,
-                    batch_index,
-                    n_batches,
-                ): (batch_index, rb)
-                for batch_index, rb in enumerate(batches_list)
-            }
+            futures = [executor.submit(_run_batch, state, b, n_batches, round_name) for b in pending]
             for fut in as_completed(futures):
-                batch_index, rules_batch = futures[fut]
+                if fut.cancelled():
+                    continue
                 try:
-                    _, out = fut.result()
-                except Exception as e:
-                    logger.error(f"Batch {batch_index + 1} error: {e}", exc_info=True)
-                    round_failed.extend(rules_batch)
-                    completed += 1
-                    update_run_status(run_id, "RUNNING", progress=int(completed / n_batches * 100))
+                    fut.result()
+                except TokenBudgetExceeded as e:
+                    if budget_error is None:
+                        budget_error = str(e)
+                        logger.error(f"[版本 {version_id}] {budget_error}，中止审查")
+                        for f in futures:
+                            f.cancel()
+                    continue
+                except Canceled:
+                    if not canceled:
+                        canceled = True
+                        logger.info(f"[版本 {version_id}] 审查运行 {run_id} 已取消，停止后续批次")
+                        for f in futures:
+                            f.cancel()
                     continue
-                if out is None:
-                    round_failed.extend(rules_batch)
-                    logger.warning(
-                        f"Batch {batch_index + 1}/{n_batches} failed after {MAX_REQUEST_RETRIES} retries"
-                    )
-                else:
-                    cnt = _process_batch_result(out, blocks, version_id, run_id, rules_batch)
-                    round_issues += cnt
-                    logger.info(
-                        f"[版本 {version_id}] {round_name} 第 {batch_index + 1}/{n_batches} 批完成，本批 {cnt} 条结果"
-                    )
                 completed += 1
                 update_run_status(run_id, "RUNNING", progress=int(completed / n_batches * 100))
-        total_issues += round_issues
-        return round_failed
 
-    failed_rules = run_round(batches, "首轮")
+    if settings.AI_RUN_TOKEN_BUDGET > 0:
+        # 续跑时以库内已记录的用量起算，预算按整个运行累计检查，而非每次续跑重新计数
+        telemetry.seed_run(run_id, get_run_tokens(run_id))
+    try:
+        run_round(first_round, "首轮")
+        if budget_error is None and not canceled:
+            retry_rows = _retry_round(state)
+            if retry_rows:
+                # 重试轮仍失败的批次只记 FAILED，不再无限重试
+                run_round(retry_rows, "重试轮")
+    finally:
+        used_tokens = telemetry.run_tokens(run_id)
+        cache_ratio = telemetry.run_cache_ratio(run_id)
+        telemetry.clear_run(run_id)
 
-    if failed_rules:
-        retry_batches = get_rule_batches(failed_rules, batch_size=6)
-        logger.info(f"[版本 {version_id}] 将 {len(failed_rules)} 条失败规则重新入队，分 {len(retry_batches)} 批重试")
-        run_round(retry_batches, "重试轮")
-        # 若重试轮仍有失败，仅打日志，不再无限重试
-        # （run_round 内未把“重试轮”的 failed 再收集，这里如需可再扩展）
+    if canceled:
+        logger.info(f"[版本 {version_id}] 审查运行 {run_id} 已取消，已写入 {state.sink.count} 条问题，消耗 {used_tokens} tokens")
+        return
+    if budget_error:
+        update_run_status(run_id, "FAILED", error_message=budget_error)
+        return
 
     update_run_status(run_id, "DONE", progress=100)
-    logger.info(f"AI rule engine review completed: {total_batches} batches, {total_issues} issues found")
+    logger.info(
+        f"AI rule engine review completed: {len(first_round)} batches, {state.sink.count} issues found "
+        f"({state.sink.merged} duplicates merged), {used_tokens} tokens, "
+        f"cached prompt ratio {cache_ratio:.1%}"
+    )
+
+
+# ---------- 批次分发执行（AI_FANOUT）：每批一个 Celery 任务，chord 回调收尾 ----------
+
+def _progress_key(run_id: int) -> str:
+    return f"sws:review_run:{run_id}:progress"
+
+
+def _progress_start(run_id: int, total: int, done: int) -> None:
+    """在 Redis 中初始化本轮进度计数（各批任务完成时原子递增）。"""
+    try:
+        r = get_redis()
+        key = _progress_key(run_id)
+        r.hset(key, mapping={"total": total, "done": done})
+        r.expire(key, 86400)
+    except Exception as e:
+        logger.warning(f"Init run progress in Redis failed: {e}")
+
+
+def _progress_incr(run_id: int) -> int | None:
+    """本轮完成批次数 +1，返回进度百分比；Redis 不可用时返回 None。"""
+    try:
+        r = get_redis()
+        key = _progress_key(run_id)
+        pipe = r.pipeline()
+        pipe.hincrby(key, "done", 1)
+        pipe.hget(key, "total")
+        done, total = pipe.execute()
+    except Exception as e:
+        logger.warning(f"Update run progress in Redis failed: {e}")
+        return None
+    total = int(total or 0)
+    return min(100, int(done / total * 100)) if total else None
+
+
+def _chord_key(run_id: int) -> str:
+    return f"sws:review_run:{run_id}:chord"
+
+
+def _chord_mark(run_id: int) -> None:
+    """标记本运行有 chord 在途（批次可能仍在 ai 队列中排队），reaper 据此跳过；超过 AI_FANOUT_CHORD_TTL 未刷新自动失效。"""
+    try:
+        get_redis().set(_chord_key(run_id), 1, ex=settings.AI_FANOUT_CHORD_TTL)
+    except Exception as e:
+        logger.warning(f"Mark run chord in Redis failed: {e}")
+
+
+def _chord_clear(run_id: int) -> None:
+    try:
+        get_redis().delete(_chord_key(run_id))
+    except Exception as e:
+        logger.warning(f"Clear run chord in Redis failed: {e}")
+
+
+def _chord_pending(run_id: int) -> bool:
+    """本运行是否有未回调的 chord；Redis 不可用时返回 False（退回按心跳判定）。"""
+    try:
+        return bool(get_redis().exists(_chord_key(run_id)))
+    except Exception as e:
+        logger.warning(f"Check run chord in Redis failed: {e}")
+        return False
+
+
+def _dispatch_round(version_id: int, run_id: int, round_no: int, round_rows: list[dict]) -> None:
+    """本轮未完成批次各作为一个 run_ai_batch_task 投递到 ai 队列，全部结束后由 finalize_ai_round_task 收尾。"""
+    pending = [b for b in round_rows if b["status"] == "PENDING"]
+    _progress_start(run_id, len(round_rows), len(round_rows) - len(pending))
+    callback = finalize_ai_round_task.s(version_id, run_id, round_no)
+    if not pending:
+        callback.delay([])
+        return
+    _chord_mark(run_id)
+    chord([run_ai_batch_task.s(version_id, run_id, b["id"], len(round_rows)) for b in pending])(callback)
+
+
+def _dispatch_ai_review(version_id: int, run_id: int) -> None:
+    """分发模式入口：占用运行、生成/续用批次计划并执行本地规则，然后把首轮 AI 批次分发出去。"""
+    run = get_review_run(run_id)
+    if not run or run["version_id"] != version_id:
+        return
+    if not _claim(version_id, run):
+        return
+    update_run_status(run_id, "RUNNING", progress=0)
+    state = _load_run_state(version_id, run_id)
+    if state is None:
+        update_run_status(run_id, "DONE", progress=100)
+        pump_scheduler_task.delay()
+        return
+    batch_rows = _prepare_run(state)
+    first_round = [b for b in batch_rows if b["round"] == ROUND_FIRST]
+    if not first_round:
+        logger.warning("No rules left for AI, skip AI requests")
+        update_run_status(run_id, "DONE", progress=100)
+        pump_scheduler_task.delay()
+        return
+    _log_round_plan(state, first_round)
+    _prefetch_norm_refs(state, first_round)
+    _dispatch_round(version_id, run_id, ROUND_FIRST, first_round)
+
+
+@app.task
+def run_ai_batch_task(version_id: int, run_id: int, batch_id: int, n_batches: int) -> dict:
+    """
+    分发模式下执行单个规则批次（ai 队列）。不抛异常，chord 回调总能触发；
+    结果 {"batch_id", "ok", "budget_error"}。已完成的批次（重复投递）直接跳过。
+    """
+    batch_row = get_run_batch(batch_id)
+    if batch_row is None or batch_row["status"] == "DONE":
+        return {"batch_id": batch_id, "ok": True, "budget_error": None}
+    if is_canceled(RUN, run_id):
+        return {"batch_id": batch_id, "ok": False, "budget_error": None}
+    state = _load_run_state(version_id, run_id)
+    if state is None:
+        return {"batch_id": batch_id, "ok": False, "budget_error": None}
+    # 其他 worker 已写入的问题先载入，本批相同问题合并而非新增
+    state.sink.restore(list_run_issues_for_dedup(run_id))
+    if settings.AI_RUN_TOKEN_BUDGET > 0:
+        telemetry.seed_run(run_id, get_run_tokens(run_id))
+    _chord_mark(run_id)
+    round_name = "重试轮" if batch_row["round"] == ROUND_RETRY else "首轮"
+    try:
+        ok = _run_batch(state, batch_row, n_batches, round_name)
+    except TokenBudgetExceeded as e:
+        # 批次置 FAILED（而非留在 RUNNING），chord 回调据 budget_error 终止运行，不会等 reaper 反复续跑
+        logger.error(f"[版本 {version_id}] {e}，本批中止")
+        mark_batch_failed(batch_id, str(e))
+        return {"batch_id": batch_id, "ok": False, "budget_error": str(e)}
+    except Canceled:
+        logger.info(f"[版本 {version_id}] 审查运行 {run_id} 已取消，批次 {batch_id} 中止")
+        return {"batch_id": batch_id, "ok": False, "budget_error": None}
+    except Exception as e:
+        logger.error(f"[版本 {version_id}] 批次 {batch_id} 执行异常: {e}", exc_info=True)
+        mark_batch_failed(batch_id, str(e))
+        ok = False
+    finally:
+        telemetry.clear_run(run_id)
+    progress = _progress_incr(run_id)
+    if progress is not None:
+        update_run_status(run_id, "RUNNING", progress=progress)
+    return {"batch_id": batch_id, "ok": ok, "budget_error": None}
+
+
+@app.task
+def finalize_ai_round_task(results: list, version_id: int, run_id: int, round_no: int) -> None:
+    """
+    chord 回调：首轮结束后分发失败规则的重试轮；全部结束后对多个 worker 并行写入的问题整体去重，标记运行 DONE。
+    任一批次超出 token 预算时运行直接标记 FAILED；否则本轮仍有未结束批次（旧 chord 在续跑后才回调）时不做处理。
+    """
+    run = get_review_run(run_id)
+    if not run or run["status"] != "RUNNING":
+        return
+    budget_error = next((r.get("budget_error") for r in results or [] if r and r.get("budget_error")), None)
+    if budget_error:
+        _chord_clear(run_id)
+        update_run_status(run_id, "FAILED", error_message=budget_error)
+        pump_scheduler_task.delay()
+        return
+    round_rows = [b for b in list_run_batches(run_id) if b["round"] == round_no]
+    if any(b["status"] in ("PENDING", "RUNNING") for b in round_rows):
+        logger.info(f"[版本 {version_id}] 审查运行 {run_id} 第 {round_no} 轮仍有批次未结束，忽略本次回调")
+        return
+    _chord_clear(run_id)
+    state = _load_run_state(version_id, run_id)
+    if state is None:
+        update_run_status(run_id, "DONE", progress=100)
+        pump_scheduler_task.delay()
+        return
+    if round_no == ROUND_FIRST:
+        retry_rows = _retry_round(state)
+        if retry_rows:
+            _dispatch_round(version_id, run_id, ROUND_RETRY, retry_rows)
+            return
+    merged = _merge_duplicate_issues(run_id)
+    update_run_status(run_id, "DONE", progress=100)
+    logger.info(f"[版本 {version_id}] AI 规则校验完成（分发执行），整体去重合并 {merged} 条重复问题")
+    # 运行结束（DONE / FAILED 各路径都要），释放项目调度配额
+    pump_scheduler_task.delay()
+
+
+def _merge_duplicate_issues(run_id: int) -> int:
+    """按 IssueDeduper 规则对本运行已落库问题整体去重：重复行并入最早一行的 provenance 后删除。返回删除条数。"""
+    deduper = IssueDeduper()
+    primaries, duplicates = {}, []
+    for row in list_run_issues_for_dedup(run_id):
+        cluster = deduper.absorb(row, row["id"])
+        if cluster is not None:
+            duplicates.append(row["id"])
+            primaries[cluster.issue_id] = cluster
+    if duplicates:
+        update_issues_provenance([
+            {"id": issue_id, "provenance": c.provenance, "confidence": c.row.get("confidence")}
+            for issue_id, c in primaries.items()
+        ])
+        delete_issues(duplicates)
+    return len(duplicates)
+
+
+@app.task
+def reap_stalled_runs():
+    """
+    定时任务：心跳（review_run.updated_at）超过 AI_RUN_STALL_SECONDS 的 RUNNING 运行视为 worker 已退出，
+    置回 PENDING 并重新投递，从未完成批次续跑；中断批次执行次数达到 AI_RUN_MAX_ATTEMPTS 的运行标记 FAILED。
+    分发模式下 chord 仍在途（批次在 ai 队列排队或执行中）的运行不算停滞：刷新心跳后跳过，
+    避免续跑时重置仍在其他 worker 上执行的批次。
+    """
+    stall = settings.AI_RUN_STALL_SECONDS
+    for run in find_stalled_runs(stall):
+        if _chord_pending(run["id"]):
+            touch_run(run["id"])
+            continue
+        if run["max_inflight_attempts"] >= settings.AI_RUN_MAX_ATTEMPTS:
+            update_run_status(
+                run["id"], "FAILED", error_message=f"批次执行 {run['max_inflight_attempts']} 次均中断，停止续跑"
+            )
+            logger.error(f"审查运行 {run['id']} 批次反复中断，标记 FAILED")
+            continue
+        if requeue_run(run["id"], stall):
+            logger.warning(f"审查运行 {run['id']} 心跳超时（{run['updated_at']}），重新投递续跑")
+            run_ai_review_task.delay(run["version_id"], run["id"])
 
 
 @app.task(bind=True)
 def run_ai_review_task(self, version_id: int, run_id: int):
-    """Celery 任务包装"""
-    _execute_ai_review(version_id, run_id)
+    """Celery 任务包装：AI_FANOUT 时各批分发到 ai 队列并行执行，否则在本任务内用线程池执行。"""
+    if settings.AI_FANOUT:
+        _dispatch_ai_review(version_id, run_id)
+    else:
+        try:
+            _execute_ai_review(version_id, run_id)
+        finally:
+            # 运行结束，释放项目调度配额
+            pump_scheduler_task.delay()
 
 
 def _get_all_blocks_with_page(version_id: int) -> list[dict]:
@@ -222,7 +1057,7 @@ def _get_all_blocks_with_page(version_id: int) -> list[dict]:
     )
     if not blocks:
         return []
-    # 可选：从 doc_block_page_anchor 查页码，简化起见先用 order_index 估算或默认 1
+    # 从 block_page_anchor 查页码，无锚点的 block 默认 1
     block_ids = [b["id"] for b in blocks]
     page_by_block = _get_page_by_blocks(version_id, block_ids)
     for b in blocks:
@@ -230,18 +1065,65 @@ def _get_all_blocks_with_page(version_id: int) -> list[dict]:
     return blocks
 
 
+def _get_outline_nodes(version_id: int) -> list[dict]:
+    return db.fetch_all(
+        f"""
+        SELECT id, node_no, title, level, parent_id, order_index
+        FROM {_schema}.doc_outline_node
+        WHERE version_id = %(v)s
+        ORDER BY order_index
+        """,
+        {"v": version_id},
+    )
+
+
+def _get_window_blocks(version_id: int, blocks: list[dict]) -> list[dict]:
+    """分窗用的 block 序列：段落/标题块加上表格块（rendered 为 TSV），按文档顺序排列。"""
+    table_blocks = db.fetch_all(
+        f"""
+        SELECT b.id, b.order_index, b.outline_node_id, b.block_type, b.table_id,
+               t.table_no, t.title
+        FROM {_schema}.doc_block b
+        JOIN {_schema}.doc_table t ON t.id = b.table_id
+        WHERE b.version_id = %(v)s AND b.block_type = 'TABLE'
+        ORDER BY b.order_index
+        """,
+        {"v": version_id},
+    )
+    if not table_blocks:
+        return blocks
+    cells = db.fetch_all(
+        f"""
+        SELECT table_id, r, c, text
+        FROM {_schema}.doc_table_cell
+        WHERE table_id = ANY(%(ids)s)
+        ORDER BY table_id, r, c
+        """,
+        {"ids": [b["table_id"] for b in table_blocks]},
+    )
+    cells_by_table: dict[int, list[dict]] = {}
+    for cell in cells:
+        cells_by_table.setdefault(cell["table_id"], []).append(cell)
+    page_by_block = _get_page_by_blocks(version_id, [b["id"] for b in table_blocks])
+    for b in table_blocks:
+        b["rendered"] = render_table(b, cells_by_table.get(b["table_id"], []))
+        b["page_no"] = page_by_block.get(b["id"], 1)
+    return sorted(blocks + table_blocks, key=lambda b: b["order_index"])
+
+
 def _get_page_by_blocks(version_id: int, block_ids: list[int]) -> dict[int, int]:
-    """根据 block 的 page_anchor 查页码。"""
+    """根据 block 的 page_anchor 查页码（每个 block 取置信度最高的锚点）。"""
     if not block_ids:
         return {}
     try:
         rows = db.fetch_all(
             f"""
-            SELECT block_id, page_no
-            FROM {_schema}.doc_block_page_anchor
-            WHERE version_id = %(v)s AND block_id = ANY(%(ids)s)
+            SELECT DISTINCT ON (block_id) block_id, page_no
+            FROM {_schema}.block_page_anchor
+            WHERE block_id = ANY(%(ids)s)
+            ORDER BY block_id, confidence DESC
             """,
-            {"v": version_id, "ids": block_ids},
+            {"ids": block_ids},
         )
         return {r["block_id"]: r["page_no"] for r in rows}
     except Exception:
@@ -266,14 +1148,19 @@ def _build_doc_content(blocks: list[dict], max_chars: int = 100000) -> str:
     return "\n\n".join(parts)
 
 
-def _map_engine_issue_to_db(item: dict, blocks: list[dict], rule: dict | None = None) -> dict | None:
+def _map_engine_issue_to_db(
+    item: dict,
+    blocks: list[dict],
+    rule: dict | None = None,
+    index: EvidenceIndex | None = None,
+) -> dict | None:
     """
     将规则引擎输出的一条问题映射为 insert_issue 所需格式。
     - issue_title -> title
     - issue_type -> 一致性/CONSISTENCY 等（含 sum_check_row/col、percentage_sum、punctuation、missing_section、ai_gap）
     - severity -> 致命/S1 等
     - location.page -> page_no
-    - evidence.snippets -> evidence_quotes
+    - evidence.snippets -> evidence_quotes（经 index 定位到 block_id 与块内偏移）
     - fix_suggestion -> suggestion
     - rule.review_type -> review_type（形式/技术统计用）
     """
@@ -289,12 +1176,26 @@ def _map_engine_issue_to_db(item: dict, blocks: list[dict], rule: dict | None =
 
     loc = item.get("location") or {}
     evidence = item.get("evidence") or {}
+    snippets = evidence.get("snippets") or []
+    if isinstance(snippets, str):
+        snippets = [snippets]
+    anchor_text = (loc.get("anchor_text") or "").strip()
+
+    # 证据定位：anchor_text 与各 snippet 经索引定位到 block（同一运行共用索引，调用方未传则临时构建）
+    if index is None:
+        index = EvidenceIndex(blocks)
+    anchor_match = index.locate(anchor_text) if anchor_text else None
+    snippet_matches = [index.locate(s) if isinstance(s, str) else None for s in snippets[:10]]
+    first_match = anchor_match or next((m for m in snippet_matches if m), None)
+
     page_refs = evidence.get("page_refs") or []
     if isinstance(page_refs, str):
         page_refs = [page_refs]
-    # 页码优先：evidence.page_refs[0] -> location.page -> 匹配到的 block.page_no -> 1
+    # 页码优先：精确定位到的 block.page_no -> evidence.page_refs[0] -> location.page -> 模糊定位的 block.page_no -> 1
     page_no = None
-    if page_refs:
+    if first_match and first_match.exact:
+        page_no = first_match.page_no
+    if page_no is None and page_refs:
         try:
             p = page_refs[0]
             page_no = int(p) if p is not None else None
@@ -307,25 +1208,18 @@ def _map_engine_issue_to_db(item: dict, blocks: list[dict], rule: dict | None =
             page_no = int(page_no)
         except (TypeError, ValueError):
             page_no = None
-    if page_no is None and blocks:
-        # 用 anchor_text/snippet 匹配到的 block 的 page_no
-        snippets = evidence.get("snippets") or []
-        anchor_text = (loc.get("anchor_text") or "").strip() or (snippets[0] if snippets else "")
-        if anchor_text:
-            anchor_clean = re.sub(r"\s+", "", anchor_text)[:50]
-            for b in blocks:
-                t = (b.get("text") or "").strip()
-                if anchor_clean and re.sub(r"\s+", "", t)[:100].find(anchor_clean) >= 0:
-                    page_no = b.get("page_no", 1)
-                    break
+    if page_no is None and first_match:
+        page_no = first_match.page_no
     if page_no is None:
         page_no = 1
 
-    snippets = evidence.get("snippets") or []
-    if isinstance(snippets, str):
-        snippets = [snippets]
-    # evidence_quotes：前端展示用，传字符串列表或 [{"quote": s}]
-    evidence_quotes = [s[:500] if isinstance(s, str) else str(s)[:500] for s in snippets[:10]]
+    # evidence_quotes：前端展示用，[{"quote": s}]，定位成功时附带 block_id 与块内偏移
+    evidence_quotes = []
+    for s, m in zip(snippets[:10], snippet_matches):
+        q = {"quote": s[:500] if isinstance(s, str) else str(s)[:500]}
+        if m:
+            q.update({"block_id": m.block_id, "char_start": m.char_start, "char_end": m.char_end})
+        evidence_quotes.append(q)
 
     fix = item.get("fix_suggestion") or {}
     if isinstance(fix, str):
@@ -344,18 +1238,21 @@ def _map_engine_issue_to_db(item: dict, blocks: list[dict], rule: dict | None =
         desc_parts.append(f"依据：{norm.get('basis_text')}")
     description = "\n".join(desc_parts)[:2000]
 
-    # 尝试用 anchor_text 或 snippet 匹配 block_id（用于证据定位；页码已在上面从 page_refs/location/block 取）
+    # 证据 block：anchor_text 与全部 snippet 定位到的 block（去重保序），均未定位时兜底为首个 block
     evidence_block_ids = []
-    anchor_text = (loc.get("anchor_text") or "").strip() or (snippets[0] if snippets else "")
-    if anchor_text:
-        anchor_clean = re.sub(r"\s+", "", anchor_text)[:50]
-        for b in blocks:
-            t = (b.get("text") or "").strip()
-            if anchor_clean and re.sub(r"\s+", "", t)[:100].find(anchor_clean) >= 0:
-                evidence_block_ids.append(b["id"])
-                break
-        if not evidence_block_ids and blocks:
-            evidence_block_ids.append(blocks[0]["id"])
+    for m in [anchor_match] + snippet_matches:
+        if not m:
+            continue
+        for bid in m.block_ids:
+            if bid not in evidence_block_ids:
+                evidence_block_ids.append(bid)
+    if not evidence_block_ids and (anchor_text or snippets) and blocks:
+        evidence_block_ids.append(blocks[0]["id"])
+
+    # 模型自评置信度（0～1）优先，缺省 0.75
+    confidence = item.get("confidence")
+    if not isinstance(confidence, (int, float)) or not 0 <= confidence <= 1:
+        confidence = 0.75
 
     # review_type 来自规范库规则，用于按 形式/技术 统计（未来可按 review_type 枚举统计）
     review_type = None
@@ -368,7 +1265,7 @@ def _map_engine_issue_to_db(item: dict, blocks: list[dict], rule: dict | None =
         "title": title,
         "description": description,
         "suggestion": suggestion,
-        "confidence": 0.75,
+        "confidence": confidence,
         "page_no": page_no,
         "evidence_block_ids": evidence_block_ids[:5],
         "evidence_quotes": evidence_quotes,
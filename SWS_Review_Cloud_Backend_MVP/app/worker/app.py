@@ -6,13 +6,30 @@ app = Celery(
     "sws_worker",
     broker=settings.CELERY_BROKER_URL,
     backend=settings.REDIS_URL,
-    include=["app.worker.tasks", "app.worker.review_tasks", "app.worker.kb_tasks", "app.worker.ai_review_tasks"],
+    include=["app.worker.tasks", "app.worker.review_tasks", "app.worker.kb_tasks", "app.worker.ai_review_tasks", "app.worker.scheduler_tasks"],
 )
 app.conf.task_serializer = "json"
 app.conf.result_serializer = "json"
 app.conf.accept_content = ["json"]
 app.conf.timezone = "UTC"
 app.conf.enable_utc = True
+# AI 规则批次走独立的 ai 队列（AI_FANOUT），worker 每次只预取一个任务，长批次不会堆在单个 worker 上
+app.conf.task_routes = {
+    "app.worker.ai_review_tasks.run_ai_batch_task": {"queue": "ai"},
+}
+app.conf.worker_prefetch_multiplier = 1
+# 定时任务（celery -A app.worker.app beat）：重新投递心跳超时的审查运行、公平调度出队
+app.conf.beat_schedule = {
+    "reap-stalled-review-runs": {
+        "task": "app.worker.ai_review_tasks.reap_stalled_runs",
+        "schedule": float(settings.AI_RUN_REAP_INTERVAL),
+    },
+    # 公平调度：在跑作业结束后释放项目配额并出队下一批
+    "pump-scheduler": {
+        "task": "app.worker.scheduler_tasks.pump_scheduler_task",
+        "schedule": float(settings.SCHED_PUMP_INTERVAL),
+    },
+}
 
 # Windows 上使用 solo 池（prefork 在 Windows 上有权限问题）
 if sys.platform == "win32":
@@ -1,105 +1,96 @@
-import hashlib
 import io
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
 import fitz  # PyMuPDF
+from celery import chord
 from docx import Document as DocxDocument
 from .. import db
+from ..ai.kb_chunker import iter_chunks, page_lines, text_lines
 from ..settings import settings
 from ..services.file_service import get_file_object
 from ..services import kb_service
 from ..storage import get_storage
+from ..utils.progress import ProgressReporter
 from .app import app
 
 _schema = settings.DB_SCHEMA
+logger = logging.getLogger(__name__)
 
 
-def _chunk_text(text: str, chunk_size: int = 800, overlap: int = 100, page_boundaries: list[tuple[int, int, int]] | None = None) -> list[tuple[str, dict]]:
+def _chunk_text(text: str, chunk_size: int = 800, overlap: int = 100, page_boundaries: list[tuple[int, int, int]] | None = None) -> Iterator[tuple[str, dict]]:
     """
-    切分文本为chunks，返回(chunk_text, meta)列表。
-    meta包含page_start, page_end等信息。
+    按条款/标题边界流式切分文本，逐个产出(chunk_text, meta)，见 kb_chunker。
+    meta包含page_start, page_end、heading_path、clause_no等信息。
     
     Args:
         text: 要切分的文本
         chunk_size: chunk大小
-        overlap: 重叠长度
+        overlap: 条款内切分时的重叠长度
         page_boundaries: 页边界列表 [(char_start, char_end, page_no), ...]，用于PDF分页映射
     """
-    import bisect
-    
-    parts = []
-    start = 0
-    chunk_idx = 0
-    
-    while start < len(text):
-        end = min(start + chunk_size, len(text))
-        chunk_text = text[start:end]
-        meta = {
-            "chunk_index": chunk_idx,
-            "char_start": start,
-            "char_end": end,
-        }
-        
-        # 使用页边界+二分查找确定page_start和page_end
-        if page_boundaries:
-            # 查找start所在的页
-            page_start = None
-            page_end = None
-            
-            # 二分查找：找到start所在的页
-            idx = bisect.bisect_right([b[0] for b in page_boundaries], start) - 1
-            if idx >= 0 and idx < len(page_boundaries):
-                boundary_start, boundary_end, page_no = page_boundaries[idx]
-                if boundary_start <= start < boundary_end:
-                    page_start = page_no
-            
-            # 查找end所在的页
-            idx = bisect.bisect_right([b[0] for b in page_boundaries], end) - 1
-            if idx >= 0 and idx < len(page_boundaries):
-                boundary_start, boundary_end, page_no = page_boundaries[idx]
-                if boundary_start <= end < boundary_end:
-                    page_end = page_no
-            
-            if page_start:
-                meta["page_start"] = page_start
-            if page_end:
-                meta["page_end"] = page_end
-        
-        parts.append((chunk_text, meta))
-        start = end - overlap if end < len(text) else len(text)
-        chunk_idx += 1
-    
-    return parts
+    return iter_chunks(text_lines(text, page_boundaries), chunk_size, overlap)
+
+
+_shard_raw: bytes | None = None
+
+
+def _pdf_page_count(raw: bytes) -> int:
+    with fitz.open(stream=raw, filetype="pdf") as doc_pdf:
+        return len(doc_pdf)
+
+
+def _extract_pdf_pages(raw: bytes, start: int, end: int) -> list[tuple[int, str]]:
+    """提取 [start, end) 页（从 0 计）的文本，返回 [(page_no, text), ...]，page_no 从 1 计。"""
+    with fitz.open(stream=raw, filetype="pdf") as doc_pdf:
+        return [(i + 1, doc_pdf[i].get_text()) for i in range(start, min(end, len(doc_pdf)))]
+
 
+def _init_shard_worker(raw: bytes) -> None:
+    """进程池初始化：PDF 字节每个子进程只传一次。"""
+    global _shard_raw
+    _shard_raw = raw
 
-def _extract_text_from_pdf(raw: bytes, filename: str) -> tuple[str, list[tuple[int, int, int]]]:
+
+def _extract_shard(page_range: tuple[int, int]) -> list[tuple[int, str]]:
+    return _extract_pdf_pages(_shard_raw, *page_range)
+
+
+def _can_use_process_pool() -> bool:
+    """celery prefork 子进程为 daemon 进程，不能再派生进程池。"""
+    return not multiprocessing.current_process().daemon
+
+
+def _iter_pdf_pages(raw: bytes, start: int, end: int) -> Iterator[tuple[int, str]]:
     """
-    从PDF提取文本，返回(完整文本, 页边界列表)。
-    页边界列表用于二分查找：[(char_start, char_end, page_no), ...]
-    
-    Returns:
-        (full_text, page_boundaries)
-        page_boundaries: [(char_start, char_end, page_no), ...]
+    按页段分片提取 [start, end) 页的文本，按页序逐页产出 (page_no, text)，全文不拼接。
+    页数超过一个分片且允许派生进程时分片分发到进程池并行提取，否则逐片顺序提取。
     """
-    doc_pdf = fitz.open(stream=raw, filetype="pdf")
-    full_text_parts = []
-    page_boundaries = []
-    
-    char_offset = 0
-    
-    for page_no in range(len(doc_pdf)):
-        page = doc_pdf[page_no]
-        page_text = page.get_text()
-        
-        # 记录页边界
-        page_start = char_offset
-        page_end = char_offset + len(page_text)
-        page_boundaries.append((page_start, page_end, page_no + 1))
-        
-        full_text_parts.append(page_text)
-        char_offset = page_end + 2  # +2 for "\n\n"
-    
-    doc_pdf.close()
-    full_text = "\n\n".join(full_text_parts)
-    return full_text, page_boundaries
+    shard = max(1, settings.KB_PDF_SHARD_PAGES)
+    ranges = [(i, min(i + shard, end)) for i in range(start, end, shard)]
+    workers = min(settings.KB_PDF_WORKERS or os.cpu_count() or 1, len(ranges))
+    if workers > 1 and _can_use_process_pool():
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_shard_worker, initargs=(raw,)) as pool:
+            for pages in pool.map(_extract_shard, ranges):
+                yield from pages
+        return
+    for r in ranges:
+        yield from _extract_pdf_pages(raw, *r)
+
+
+def _track_pages(pages: Iterator[tuple[int, str]], progress: ProgressReporter, every: int = 20) -> Iterator[tuple[int, str]]:
+    """逐页透传，每 every 页更新一次进度。"""
+    n = 0
+    for page in pages:
+        yield page
+        n += 1
+        if n % every == 0:
+            progress.update(every, f"第 {page[0]} 页")
+    if n % every:
+        progress.update(n % every)
 
 
 def _extract_text_from_docx(raw: bytes, filename: str) -> tuple[str, None]:
@@ -132,52 +123,106 @@ def _extract_text_from_docx(raw: bytes, filename: str) -> tuple[str, None]:
     return full_text, []
 
 
-@app.task(bind=True)
-def index_kb_source_task(self, source_id: int):
+def _load_source_raw(source_id: int) -> tuple[bytes, dict] | None:
+    """读取知识库源文件字节与文件信息；失败时将知识库置为 FAILED 并返回 None。"""
     src = kb_service.get_kb_source(source_id)
     if not src or src["status"] != "PROCESSING":
-        return
+        return None
     fo = get_file_object(src["file_id"])
     if not fo:
         kb_service.set_kb_source_failed(source_id, "File not found")
-        return
+        return None
     
     storage = get_storage()
     try:
         stream = storage.get_object(fo["object_key"])
         if not stream:
             kb_service.set_kb_source_failed(source_id, "Object not found")
-            return
+            return None
         raw = stream.read()
         if hasattr(stream, "close"):
             stream.close()
     except Exception as e:
         kb_service.set_kb_source_failed(source_id, str(e))
-        return
+        return None
+    return raw, fo
+
+
+def _is_pdf(fo: dict) -> bool:
+    return (fo.get("content_type") or "") == "application/pdf" or (fo.get("filename") or "").lower().endswith(".pdf")
+
+
+def _ingest_chunks(source_id: int, filename: str, chunks: Iterator[tuple[str, dict]], progress: ProgressReporter | None = None) -> int:
+    """chunk 流补上文档名后批量入库（内存去重 + COPY，分批提交），返回新写入条数。"""
+    def _with_doc():
+        for chunk_text, meta in chunks:
+            meta["doc"] = filename
+            meta["clause_hint"] = meta.get("clause_no") or ""
+            yield chunk_text, meta
     
+    return kb_service.insert_chunks_bulk(source_id, _with_doc(), progress=progress)
+
+
+def _finish_kb_source(source_id: int) -> None:
+    """全部 chunk 入库后：置为 READY、重建本地 BM25 索引、（启用时）本地向量化。"""
+    kb_service.set_kb_source_ready(source_id)
+    # 知识库内容变化，重建 worker 本地 BM25 索引
+    rebuild_kb_bm25_task.delay()
+
+    # 本地模型向量化（失败不影响知识库可用，可用回填脚本补算）
+    if settings.KB_EMBED_ENABLED:
+        from ..ai.kb_embedding import embed_pending
+        try:
+            n = embed_pending(source_id)
+            logger.info(f"知识库 {source_id} 写入 {n} 条 embedding")
+            if n:
+                # 行数变化较大时重建向量索引（ivfflat 重新训练 lists）
+                from ..services.vector_index_service import maybe_rebuild
+                maybe_rebuild()
+        except Exception as e:
+            logger.error(f"知识库 {source_id} 向量化失败: {e}", exc_info=True)
+
+
+@app.task(bind=True)
+def index_kb_source_task(self, source_id: int):
+    loaded = _load_source_raw(source_id)
+    if loaded is None:
+        return
+    raw, fo = loaded
     content_type = fo.get("content_type") or ""
     filename = fo.get("filename") or ""
+    t0 = time.perf_counter()
     
-    # 根据content_type选择提取方法
-    text = ""
-    page_infos = []
-    
-    page_boundaries = None
-    
-    if content_type == "application/pdf" or filename.lower().endswith(".pdf"):
+    # PDF：逐页提取、流式切分入库；页数多时按页段拆成子任务并行，全部完成后由 finalize_kb_source_task 收尾
+    if _is_pdf(fo):
         try:
-            text, page_boundaries = _extract_text_from_pdf(raw, filename)
+            n_pages = _pdf_page_count(raw)
         except Exception as e:
             kb_service.set_kb_source_failed(source_id, f"PDF extraction failed: {str(e)}")
             return
-    elif content_type in [
+        split = settings.KB_PDF_SUBTASK_PAGES
+        if split > 0 and n_pages > split:
+            ranges = [(i, min(i + split, n_pages)) for i in range(0, n_pages, split)]
+            logger.info(f"知识库 {source_id} 共 {n_pages} 页，拆分为 {len(ranges)} 个子任务")
+            chord([index_kb_pdf_pages_task.s(source_id, a, b) for a, b in ranges])(finalize_kb_source_task.s(source_id))
+            return
+        progress = ProgressReporter(n_pages, f"知识库 {source_id} 提取入库（页）")
+        try:
+            pages = _track_pages(_iter_pdf_pages(raw, 0, n_pages), progress)
+            inserted = _ingest_chunks(source_id, filename, iter_chunks(page_lines(pages)))
+        except Exception as e:
+            kb_service.set_kb_source_failed(source_id, f"PDF ingestion failed: {str(e)}")
+            return
+        progress.finish(f"完成，新写入 {inserted} 条，耗时 {time.perf_counter() - t0:.2f}s")
+        _finish_kb_source(source_id)
+        return
+    
+    if content_type in [
         "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
         "application/msword",
     ] or filename.lower().endswith((".docx", ".doc")):
         try:
             text, _ = _extract_text_from_docx(raw, filename)
-            # DOCX没有分页信息
-            page_boundaries = None
         except Exception as e:
             kb_service.set_kb_source_failed(source_id, f"DOCX extraction failed: {str(e)}")
             return
@@ -185,7 +230,6 @@ def index_kb_source_task(self, source_id: int):
         # 尝试作为纯文本解码
         try:
             text = raw.decode("utf-8", errors="ignore") if isinstance(raw, bytes) else str(raw)
-            page_boundaries = None
         except Exception as e:
             kb_service.set_kb_source_failed(source_id, f"Text extraction failed: {str(e)}")
             return
@@ -194,15 +238,83 @@ def index_kb_source_task(self, source_id: int):
         kb_service.set_kb_source_ready(source_id)
         return
     
-    # 切分chunks（传入page_boundaries用于二分查找）
-    chunks_with_meta = _chunk_text(text, page_boundaries=page_boundaries)
-    
-    # 入库chunks
-    for chunk_text, meta in chunks_with_meta:
-        meta["doc"] = filename
-        meta["clause_hint"] = ""  # 可以后续用AI提取
-        
-        h = hashlib.sha256(chunk_text.encode("utf-8")).hexdigest()
-        kb_service.insert_chunk(source_id, chunk_text, meta, h)
-    
-    kb_service.set_kb_source_ready(source_id)
+    # 切分并批量入库chunks（边切分边入库；总数按文本长度估算）
+    progress = ProgressReporter(max(1, len(text) // 800), f"知识库 {source_id} 入库")
+    try:
+        inserted = _ingest_chunks(source_id, filename, _chunk_text(text), progress)
+    except Exception as e:
+        kb_service.set_kb_source_failed(source_id, f"Chunk ingestion failed: {str(e)}")
+        return
+    progress.finish(f"完成，新写入 {inserted} 条，耗时 {time.perf_counter() - t0:.2f}s")
+    _finish_kb_source(source_id)
+
+
+@app.task
+def index_kb_pdf_pages_task(source_id: int, start: int, end: int) -> dict:
+    """
+    大 PDF 的一个页段 [start, end)（从 0 计）：提取、切分并入库。不抛异常，chord 回调总能触发；
+    结果 {"start", "end", "ok", "inserted", "error"}。页段边界处的条款按两段分别切分。
+    """
+    result = {"start": start, "end": end, "ok": False, "inserted": 0, "error": None}
+    loaded = _load_source_raw(source_id)
+    if loaded is None:
+        result["error"] = "知识库源文件不可用或状态不是 PROCESSING"
+        return result
+    raw, fo = loaded
+    t0 = time.perf_counter()
+    try:
+        pages = _iter_pdf_pages(raw, start, end)
+        result["inserted"] = _ingest_chunks(source_id, fo.get("filename") or "", iter_chunks(page_lines(pages)))
+        result["ok"] = True
+    except Exception as e:
+        logger.error(f"知识库 {source_id} 第 {start + 1}-{end} 页入库失败: {e}", exc_info=True)
+        result["error"] = f"第 {start + 1}-{end} 页: {e}"
+    logger.info(
+        f"知识库 {source_id} 第 {start + 1}-{end} 页：新写入 {result['inserted']} 条，耗时 {time.perf_counter() - t0:.2f}s"
+    )
+    return result
+
+
+@app.task
+def finalize_kb_source_task(results: list, source_id: int) -> None:
+    """chord 回调：所有页段入库成功时完成知识库（READY、重建索引、向量化），任一页段失败则置为 FAILED。"""
+    src = kb_service.get_kb_source(source_id)
+    if not src or src["status"] != "PROCESSING":
+        return
+    errors = [r.get("error") or "unknown error" for r in results or [] if not (r and r.get("ok"))]
+    if errors:
+        kb_service.set_kb_source_failed(source_id, f"PDF ingestion failed: {'; '.join(errors)[:1000]}")
+        return
+    logger.info(f"知识库 {source_id} 全部 {len(results)} 个页段入库完成，共新写入 {sum(r['inserted'] for r in results)} 条")
+    _finish_kb_source(source_id)
+
+
+@app.task
+def backfill_kb_search_terms_task() -> int:
+    """为 018 迁移前入库的 chunk 补写全文检索词，返回处理条数。"""
+    return kb_service.backfill_search_terms()
+
+
+@app.task
+def rebuild_kb_bm25_task() -> str | None:
+    """按当前 READY 知识库内容重建本地 BM25 索引并发布版本，返回内容哈希。"""
+    from ..ai import kb_bm25
+    return kb_bm25.rebuild()
+
+
+@app.task
+def import_kb_package_task(package: str, defer_indexes: bool = False, strict: bool = False, restart: bool = False) -> dict:
+    """导入 KB_IMPORT_ROOT 下的知识库包（见 kb_import_service），返回导入统计；中断后再次投递从断点续传。"""
+    from ..services import kb_import_service
+    package_dir = kb_import_service.package_path(package)
+    progress = None
+
+    def _report(stats: dict) -> None:
+        nonlocal progress
+        if progress is None:
+            progress = ProgressReporter(stats.get("expected") or 0, f"知识库包 {package} 导入")
+        progress.update(stats["rows"] - progress.current, f"新写入 {stats['inserted']} 条，{stats['rows_per_sec']} 行/秒")
+
+    return kb_import_service.import_package(
+        package_dir, resume=not restart, defer_indexes=defer_indexes, strict=strict, on_progress=_report
+    )
@@ -1154,7 +1154,7 @@ def finalize_ready(version_id: int) -> None:
     if settings.AUTO_TRIGGER_REVIEW:
         try:
             from ..services.review_run_service import create_review_run
-            from ..worker.ai_review_tasks import run_ai_review_task
+            from ..services.scheduler_service import PRIORITY_BULK, project_of_version, submit_review
             from ..utils.celery_diagnostics import can_use_celery
 
             log_step(version_id, "完成处理", "自动触发 AI 规则校验")
@@ -1162,8 +1162,8 @@ def finalize_ready(version_id: int) -> None:
             logger.info(f"[版本 {version_id}] 已创建审查运行，运行ID: {run_id}")
 
             if can_use_celery():
-                run_ai_review_task.delay(version_id, run_id)
-                logger.info(f"[版本 {version_id}] AI 规则校验任务已提交到 Celery")
+                submit_review(project_of_version(version_id), version_id, run_id, PRIORITY_BULK)
+                logger.info(f"[版本 {version_id}] AI 规则校验任务已提交调度队列")
             else:
                 logger.warning(f"[版本 {version_id}] Celery Worker 不可用，使用直接执行模式")
                 from ..worker.ai_review_tasks import _execute_ai_review
@@ -0,0 +1,8 @@
+from .app import app
+from ..services import scheduler_service
+
+
+@app.task
+def pump_scheduler_task():
+    """按公平调度从各项目队列出队投递（celery beat 定时触发，作业结束时也会触发）。"""
+    return scheduler_service.pump()
@@ -2,11 +2,13 @@ import json
 import logging
 import time
 from celery import chain
+from celery.exceptions import Ignore
 from .app import app
 from . import pipeline
 from .. import db
 from ..settings import settings
 from ..services.version_service import update_version_status
+from ..utils.cancellation import VERSION, Canceled, is_canceled, register_tasks
 
 _schema = settings.DB_SCHEMA
 logger = logging.getLogger(__name__)
@@ -23,10 +25,37 @@ def _agent_log(location, message, data, hypothesis_id):
 
 
 def _fail_version(version_id: int, error_message: str) -> None:
+    # 已取消的版本保持 CANCELED
     db.execute(
-        f"UPDATE {_schema}.document_version SET status = 'FAILED', error_message = %(msg)s, updated_at = now() WHERE id = %(version_id)s",
+        f"UPDATE {_schema}.document_version SET status = 'FAILED', error_message = %(msg)s, updated_at = now() WHERE id = %(version_id)s AND status <> 'CANCELED'",
         {"version_id": version_id, "msg": error_message[:2000]},
     )
+    _release_slot()
+
+
+def _stop_if_canceled(version_id: int) -> None:
+    """版本已取消时结束本任务（Ignore 使 chain 后续步骤不再执行），不改写版本状态。"""
+    if is_canceled(VERSION, version_id):
+        _stop_canceled(version_id)
+    # Redis 不可用时以库内状态为准
+    row = db.fetch_one(f"SELECT status FROM {_schema}.document_version WHERE id = %(id)s", {"id": version_id})
+    if row and row["status"] == "CANCELED":
+        _stop_canceled(version_id)
+
+
+def _stop_canceled(version_id: int) -> None:
+    logger.info(f"[版本 {version_id}] 版本已取消，停止处理")
+    _release_slot()
+    raise Ignore()
+
+
+def _release_slot() -> None:
+    """管道结束（完成或失败），触发公平调度出队下一个作业。"""
+    try:
+        from .scheduler_tasks import pump_scheduler_task
+        pump_scheduler_task.delay()
+    except Exception as e:
+        logger.warning(f"触发调度出队失败: {e}")
 
 
 @app.task(bind=True, max_retries=2)
@@ -35,6 +64,7 @@ def convert_docx_to_pdf_task(self, version_id: int):
     # #region agent log
     _agent_log("tasks.py:convert_docx_to_pdf_task:entry", "convert_docx_to_pdf_task entered", {"version_id": version_id}, "H4")
     # #endregion
+    _stop_if_canceled(version_id)
     try:
         logger.info(f"[版本 {version_id}] 开始任务: DOCX转PDF")
         update_version_status(version_id, "PROCESSING", progress=10, current_step="DOCX转PDF")
@@ -44,6 +74,8 @@ def convert_docx_to_pdf_task(self, version_id: int):
         _agent_log("tasks.py:convert_docx_to_pdf_task:exit", "convert_docx_to_pdf_task completed", {"version_id": version_id}, "H4")
         # #endregion
         return version_id
+    except Canceled:
+        _stop_canceled(version_id)
     except Exception as e:
         logger.error(f"[版本 {version_id}] DOCX转PDF失败: {e}")
         _fail_version(version_id, str(e))
@@ -53,12 +85,15 @@ def convert_docx_to_pdf_task(self, version_id: int):
 @app.task(bind=True, max_retries=2)
 def parse_docx_structure_task(self, version_id: int):
     """任务2/7: 解析DOCX结构"""
+    _stop_if_canceled(version_id)
     try:
         logger.info(f"[版本 {version_id}] 开始任务: 解析DOCX结构")
         update_version_status(version_id, "PROCESSING", progress=25, current_step="解析DOCX结构")
         pipeline.parse_docx_structure(version_id)
         logger.info(f"[版本 {version_id}] 完成任务: 解析DOCX结构")
         return version_id
+    except Canceled:
+        _stop_canceled(version_id)
     except Exception as e:
         logger.error(f"[版本 {version_id}] 解析DOCX结构失败: {e}")
         _fail_version(version_id, str(e))
@@ -68,12 +103,15 @@ def parse_docx_structure_task(self, version_id: int):
 @app.task(bind=True, max_retries=2)
 def extract_pdf_layout_task(self, version_id: int):
     """任务3/7: 提取PDF布局"""
+    _stop_if_canceled(version_id)
     try:
         logger.info(f"[版本 {version_id}] 开始任务: 提取PDF布局")
         update_version_status(version_id, "PROCESSING", progress=40, current_step="提取PDF布局")
         pipeline.extract_pdf_layout(version_id)
         logger.info(f"[版本 {version_id}] 完成任务: 提取PDF布局")
         return version_id
+    except Canceled:
+        _stop_canceled(version_id)
     except Exception as e:
         logger.error(f"[版本 {version_id}] 提取PDF布局失败: {e}")
         _fail_version(version_id, str(e))
@@ -83,12 +121,15 @@ def extract_pdf_layout_task(self, version_id: int):
 @app.task(bind=True, max_retries=2)
 def align_blocks_to_pdf_task(self, version_id: int):
     """任务4/7: 对齐块到PDF"""
+    _stop_if_canceled(version_id)
     try:
         logger.info(f"[版本 {version_id}] 开始任务: 对齐块到PDF")
         update_version_status(version_id, "PROCESSING", progress=55, current_step="对齐块到PDF")
         pipeline.align_blocks_to_pdf(version_id)
         logger.info(f"[版本 {version_id}] 完成任务: 对齐块到PDF")
         return version_id
+    except Canceled:
+        _stop_canceled(version_id)
     except Exception as e:
         logger.error(f"[版本 {version_id}] 对齐块到PDF失败: {e}")
         _fail_version(version_id, str(e))
@@ -98,12 +139,15 @@ def align_blocks_to_pdf_task(self, version_id: int):
 @app.task(bind=True, max_retries=2)
 def extract_facts_task(self, version_id: int):
     """任务5/7: 抽取事实"""
+    _stop_if_canceled(version_id)
     try:
         logger.info(f"[版本 {version_id}] 开始任务: 抽取事实")
         update_version_status(version_id, "PROCESSING", progress=70, current_step="抽取事实")
         count = pipeline.extract_facts(version_id)
         logger.info(f"[版本 {version_id}] 完成任务: 抽取事实 (共 {count} 条)")
         return version_id
+    except Canceled:
+        _stop_canceled(version_id)
     except Exception as e:
         # 事实抽取失败不影响主流程，记录日志即可
         logger.warning(f"[版本 {version_id}] 抽取事实失败（不影响主流程）: {e}")
@@ -113,11 +157,14 @@ def extract_facts_task(self, version_id: int):
 @app.task(bind=True)
 def build_chunks_task(self, version_id: int):
     """任务6/7: 构建块和索引（可选）"""
+    _stop_if_canceled(version_id)
     try:
         logger.info(f"[版本 {version_id}] 开始任务: 构建块和索引")
         update_version_status(version_id, "PROCESSING", progress=85, current_step="构建块和索引")
         pipeline.build_chunks_and_index(version_id)
         logger.info(f"[版本 {version_id}] 完成任务: 构建块和索引")
+    except Canceled:
+        _stop_canceled(version_id)
     except Exception as e:
         logger.warning(f"[版本 {version_id}] 构建块和索引失败（可选步骤）: {e}")
     return version_id
@@ -126,12 +173,16 @@ def build_chunks_task(self, version_id: int):
 @app.task(bind=True)
 def finalize_ready_task(self, version_id: int):
     """任务7/7: 完成处理"""
+    _stop_if_canceled(version_id)
     try:
         logger.info(f"[版本 {version_id}] 开始任务: 完成处理")
         update_version_status(version_id, "PROCESSING", progress=100, current_step="完成处理")
         pipeline.finalize_ready(version_id)
         logger.info(f"[版本 {version_id}] ✅ 所有任务完成，版本已就绪")
+        _release_slot()
         return version_id
+    except Canceled:
+        _stop_canceled(version_id)
     except Exception as e:
         logger.error(f"[版本 {version_id}] 完成处理失败: {e}")
         _fail_version(version_id, str(e))
@@ -156,6 +207,12 @@ def pipeline_chain(self, version_id: int):
         finalize_ready_task.s(),
     )
     ar = s.apply_async()
+    # 登记 chain 各步骤任务 ID，取消版本时撤销尚未执行的步骤
+    task_ids, node = [], ar
+    while node is not None:
+        task_ids.append(node.id)
+        node = node.parent
+    register_tasks(VERSION, version_id, task_ids)
     # #region agent log
     _agent_log("tasks.py:pipeline_chain:after_apply_async", "chain dispatched", {"version_id": version_id, "async_result_id": str(ar.id) if ar else None}, "H3")
     # #endregion
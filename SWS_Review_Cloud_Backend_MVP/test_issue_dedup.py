@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试审查问题去重（app/ai/issue_dedup.py）：同一表格内的不同问题不得被合并，真正的重复报告仍合并。
+可直接运行，也可用 pytest 执行。"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.ai.issue_dedup import IssueDeduper
+
+
+def _table_issue(title: str, quote: str) -> dict:
+    # 本地表格规则的问题：证据只有原文，没有 block 偏移，位置退回首个 evidence block
+    return {
+        "issue_type": "SUM_MISMATCH_COL",
+        "title": title,
+        "checkpoint_code": "CONS-039",
+        "evidence_block_ids": [101],
+        "evidence_quotes": [{"quote": quote}],
+        "confidence": 0.9,
+    }
+
+
+def _located_issue(title: str, start: int, end: int) -> dict:
+    return {
+        "issue_type": "FORMAT",
+        "title": title,
+        "checkpoint_code": "CONS-027",
+        "evidence_block_ids": [7],
+        "evidence_quotes": [{"quote": "2023年 11 月 15 日", "block_id": 7, "char_start": start, "char_end": end}],
+        "confidence": 0.8,
+    }
+
+
+def test_distinct_table_findings_survive():
+    deduper = IssueDeduper()
+    _, first_new = deduper.add(_table_issue("【表内计算】表3-1 列合计不符：合计=4，分项和=3", "表3-1 第5行第2列：合计=4，分项和=3"), "local")
+    _, second_new = deduper.add(_table_issue("【表内计算】表3-1 列合计不符：合计=7，分项和=6", "表3-1 第5行第3列：合计=7，分项和=6"), "local")
+    assert first_new and second_new
+
+
+def test_same_quote_merges_without_offsets():
+    deduper = IssueDeduper()
+    quote = "表3-1 第5行第2列：合计=4，分项和=3"
+    first, _ = deduper.add(_table_issue("【表内计算】表3-1 列合计不符：合计=4，分项和=3", quote), "local")
+    second, is_new = deduper.add(_table_issue("【表内计算】表3-1 列合计与分项和不符：合计=4，分项和=3", quote), "ai")
+    assert not is_new and second is first
+    assert len(first.provenance) == 2
+
+
+def test_overlapping_offsets_merge():
+    deduper = IssueDeduper()
+    first, _ = deduper.add(_located_issue("【格式】日期包含多余空格", 10, 26), "local")
+    second, is_new = deduper.add(_located_issue("日期包含多余空格", 12, 26), "ai")
+    assert not is_new and second is first
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, fn in list(globals().items()):
+        if name.startswith("test_") and callable(fn):
+            try:
+                fn()
+                print(f"✅ {name}")
+            except AssertionError:
+                failed += 1
+                print(f"❌ {name}")
+    sys.exit(1 if failed else 0)
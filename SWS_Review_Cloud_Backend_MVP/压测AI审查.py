@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI 审查压测：对指定版本同步执行完整的 AI 规则校验（不经 Celery），统计吞吐与开销。
+建议配合本地 Mock LLM 使用，避免消耗 DashScope 额度且结果可复现：
+    python -m uvicorn app.ai.mock_llm:app --port 8001
+    set DASHSCOPE_BASE=http://localhost:8001/v1
+    set QWEN_API_KEY=mock
+用法：
+    python 压测AI审查.py <版本ID> [--runs 3] [--concurrency 3] [--keep]
+输出：墙钟时间、请求数/秒、重试（失败请求）次数、问题写库耗时，以及 Mock 服务端统计。
+"""
+import sys
+import threading
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+import argparse
+import httpx
+from app import db
+from app.settings import settings
+from app.services import review_run_service
+from app.worker import ai_review_tasks
+
+# Windows控制台编码修复
+if sys.platform == "win32":
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding="utf-8")
+
+_schema = settings.DB_SCHEMA
+
+
+class BenchCounters:
+    """压测计数：LLM 请求次数/失败次数/耗时，问题写库次数/条数/耗时。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.request_failures = 0
+        self.request_seconds = 0.0
+        self.insert_calls = 0
+        self.insert_rows = 0
+        self.insert_seconds = 0.0
+
+
+counters = BenchCounters()
+
+
+def _instrument():
+    """包装 ai_review_tasks 中的 LLM 调用与批量写库函数，累计次数与耗时。"""
+    def wrap_llm(fn):
+        def inner(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                with counters.lock:
+                    counters.request_failures += 1
+                raise
+            finally:
+                with counters.lock:
+                    counters.requests += 1
+                    counters.request_seconds += time.perf_counter() - t0
+        return inner
+
+    def wrap_insert(fn):
+        def inner(version_id, run_id, issues):
+            t0 = time.perf_counter()
+            try:
+                return fn(version_id, run_id, issues)
+            finally:
+                with counters.lock:
+                    counters.insert_calls += 1
+                    counters.insert_rows += len(issues)
+                    counters.insert_seconds += time.perf_counter() - t0
+        return inner
+
+    ai_review_tasks.chat_json = wrap_llm(ai_review_tasks.chat_json)
+    ai_review_tasks.chat_json_stream = wrap_llm(ai_review_tasks.chat_json_stream)
+    ai_review_tasks.insert_issues_bulk = wrap_insert(ai_review_tasks.insert_issues_bulk)
+
+
+def _mock_stats_url() -> str:
+    base = settings.DASHSCOPE_BASE.rstrip("/")
+    for suffix in ("/compatible-mode/v1", "/v1"):
+        if base.endswith(suffix):
+            base = base[: -len(suffix)]
+            break
+    return f"{base}/stats"
+
+
+def _fetch_mock_stats(reset: bool = False) -> dict | None:
+    url = _mock_stats_url()
+    try:
+        if reset:
+            httpx.post(f"{url}/reset", timeout=5.0)
+            return None
+        return httpx.get(url, timeout=5.0).json()
+    except Exception:
+        return None
+
+
+def _cleanup(run_ids: list[int]):
+    if not run_ids:
+        return
+    db.execute(f"DELETE FROM {_schema}.review_issue WHERE run_id = ANY(%(ids)s)", {"ids": run_ids})
+    db.execute(f"DELETE FROM {_schema}.review_run WHERE id = ANY(%(ids)s)", {"ids": run_ids})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI 审查压测（建议配合 app/ai/mock_llm.py）")
+    parser.add_argument("version_id", type=int, help="版本ID（需已处理完成，存在 doc_block）")
+    parser.add_argument("--runs", type=int, default=1, help="顺序执行的审查次数，默认: 1")
+    parser.add_argument("--concurrency", type=int, default=None, help="覆盖并发批次数 CONCURRENT_BATCHES")
+    parser.add_argument("--no-stream", action="store_true", help="关闭流式返回（整批返回后解析）")
+    parser.add_argument("--keep", action="store_true", help="保留压测产生的 review_run / review_issue")
+    args = parser.parse_args()
+
+    if args.concurrency:
+        ai_review_tasks.CONCURRENT_BATCHES = args.concurrency
+    if args.no_stream:
+        settings.AI_STREAM_RESPONSES = False
+    _instrument()
+
+    print("=" * 60)
+    print(f"AI 审查压测：版本 {args.version_id}，{args.runs} 次")
+    print(f"LLM 地址: {settings.DASHSCOPE_BASE}")
+    print(f"并发批次: {ai_review_tasks.CONCURRENT_BATCHES}，流式: {settings.AI_STREAM_RESPONSES}")
+    print("=" * 60)
+
+    _fetch_mock_stats(reset=True)
+    run_ids = []
+    walls = []
+    total_wall = 0.0
+    for i in range(args.runs):
+        counters.reset()
+        run_id = review_run_service.create_review_run(args.version_id, "AI")
+        run_ids.append(run_id)
+        t0 = time.perf_counter()
+        ai_review_tasks._execute_ai_review(args.version_id, run_id)
+        wall = time.perf_counter() - t0
+        walls.append(wall)
+        total_wall += wall
+        rps = counters.requests / wall if wall > 0 else 0.0
+        avg_latency = counters.request_seconds / counters.requests if counters.requests else 0.0
+        per_row_ms = counters.insert_seconds / counters.insert_rows * 1000 if counters.insert_rows else 0.0
+        print(f"\n第 {i + 1}/{args.runs} 次（run_id={run_id}）")
+        print(f"  墙钟时间:     {wall:.2f}s")
+        print(f"  LLM 请求:     {counters.requests} 次，{rps:.2f} 次/秒，平均耗时 {avg_latency:.2f}s")
+        print(f"  失败/重试:    {counters.request_failures} 次")
+        print(
+            f"  问题写库:     {counters.insert_rows} 条 / {counters.insert_calls} 次，"
+            f"共 {counters.insert_seconds * 1000:.1f}ms，{per_row_ms:.2f}ms/条"
+        )
+
+    if args.runs > 1:
+        walls.sort()
+        print(f"\n汇总：共 {total_wall:.2f}s，中位数 {walls[len(walls) // 2]:.2f}s，最慢 {walls[-1]:.2f}s")
+
+    stats = _fetch_mock_stats()
+    if stats:
+        print("\nMock LLM 服务端统计：")
+        for k, v in stats.items():
+            print(f"  {k}: {v}")
+
+    if not args.keep:
+        _cleanup(run_ids)
+        print(f"\n已清理压测数据（run_id: {run_ids}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+@echo off
+REM 启动本地 Mock LLM（OpenAI 兼容），用于 AI 审查压测/回放
+REM 使用前在 .env 中设置 DASHSCOPE_BASE=http://localhost:8001/v1
+
+cd /d "%~dp0"
+if exist "env\Scripts\activate.bat" (
+    call env\Scripts\activate.bat
+) else if exist ".venv\Scripts\activate.bat" (
+    call .venv\Scripts\activate.bat
+)
+
+REM 模式：synth（合成） | replay（回放录制） | record（转发真实接口并录制）
+if "%MOCK_LLM_MODE%"=="" set MOCK_LLM_MODE=synth
+
+echo 启动 Mock LLM: http://localhost:8001/v1 （模式 %MOCK_LLM_MODE%）
+echo 统计: http://localhost:8001/stats
+python -m uvicorn app.ai.mock_llm:app --host 0.0.0.0 --port 8001 --log-level warning
+
+pause
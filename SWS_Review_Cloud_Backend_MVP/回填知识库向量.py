@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+为尚无 embedding 的知识库 chunk 计算向量（本地 ONNX 模型，见 app/ai/kb_embedding.py）
+用法：
+    python 回填知识库向量.py                     # 全部知识库
+    python 回填知识库向量.py --source <知识库ID>  # 指定知识库
+    python 回填知识库向量.py --workers 4          # 进程池并行推理
+    python 回填知识库向量.py --check              # 只校验模型维度与 embedding 列
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+import argparse
+from app.ai import kb_embedding
+from app.services import vector_index_service
+from app.settings import settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回填知识库 chunk 向量")
+    parser.add_argument("--source", type=int, default=None, help="知识库ID，缺省为全部")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="推理进程数")
+    parser.add_argument("--page-size", type=int, default=1000, help="每页读取/写入的 chunk 数")
+    parser.add_argument("--check", action="store_true", help="只校验维度")
+    args = parser.parse_args()
+
+    kb_embedding.validate_dimension()
+    probe = kb_embedding.encode(["水土保持方案"])
+    if probe.shape[1] != settings.KB_EMBED_DIM:
+        print(f"模型输出维度 {probe.shape[1]} 与 KB_EMBED_DIM={settings.KB_EMBED_DIM} 不一致")
+        sys.exit(1)
+    print(f"模型 {settings.KB_EMBED_MODEL_DIR} 输出 {probe.shape[1]} 维，与 embedding 列一致")
+    if args.check:
+        return
+
+    t0 = time.perf_counter()
+
+    def progress(done: int):
+        elapsed = time.perf_counter() - t0
+        print(f"已写入 {done} 条，{done / elapsed:.1f} 条/秒")
+
+    total = kb_embedding.embed_pending(args.source, workers=args.workers, page_size=args.page_size, on_progress=progress)
+    print(f"完成：共写入 {total} 条 embedding，耗时 {time.perf_counter() - t0:.1f}s")
+    if total and vector_index_service.maybe_rebuild():
+        print(f"已重建向量索引：{vector_index_service.index_info()}")
+
+
+if __name__ == "__main__":
+    main()
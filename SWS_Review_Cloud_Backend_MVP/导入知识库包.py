@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+导入知识库包（kb_sources.json + kb_chunks.jsonl，见 app/services/kb_import_service.py）
+流式读取、校验 hash、分批 COPY 入库；中断后重新执行即从断点续传。
+用法：
+    python 导入知识库包.py <知识库包目录>
+    python 导入知识库包.py <知识库包目录> --defer-indexes   # 导入期间删除二级索引，导入后重建（大包推荐）
+    python 导入知识库包.py <知识库包目录> --restart         # 忽略断点，从头导入
+    python 导入知识库包.py <知识库包目录> --strict          # hash 不符或坏行时中止
+"""
+import json
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+import argparse
+from app.services import kb_import_service
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导入知识库包")
+    parser.add_argument("package_dir", help="知识库包目录（含 kb_sources.json、kb_chunks.jsonl）")
+    parser.add_argument("--batch-size", type=int, default=kb_import_service.IMPORT_BATCH, help="每批 COPY 行数")
+    parser.add_argument("--defer-indexes", action="store_true", help="导入期间删除 kb_chunk 二级索引，导入后重建")
+    parser.add_argument("--restart", action="store_true", help="忽略断点，从头导入")
+    parser.add_argument("--strict", action="store_true", help="hash 不符或坏行时中止")
+    parser.add_argument("--storage", default="local", help="file_object.storage")
+    parser.add_argument("--bucket", default="kb", help="file_object.bucket")
+    args = parser.parse_args()
+
+    state = kb_import_service.load_state(args.package_dir)
+    if state and not state.get("done") and not args.restart:
+        print(f"从断点续传：字节偏移 {state['offset']}，已导入 {state['stats']['inserted']} 条")
+
+    def progress(stats: dict):
+        expected = f"/{stats['expected']}" if stats.get("expected") else ""
+        print(
+            f"已读 {stats['rows']}{expected} 行，新写入 {stats['inserted']} 条，重复 {stats['duplicates']}，"
+            f"hash 不符 {stats['bad_hash']}，坏行 {stats['bad_lines']}，{stats['rows_per_sec']} 行/秒"
+        )
+
+    try:
+        stats = kb_import_service.import_package(
+            args.package_dir,
+            batch_size=args.batch_size,
+            resume=not args.restart,
+            defer_indexes=args.defer_indexes,
+            strict=args.strict,
+            storage=args.storage,
+            bucket=args.bucket,
+            on_progress=progress,
+        )
+    except ValueError as e:
+        print(f"导入中止：{e}")
+        sys.exit(1)
+    print(f"完成：{json.dumps(stats, ensure_ascii=False)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -154,7 +154,10 @@ def trigger_review(version_id: int, run_type: str = "RULE", direct: bool = False
                 _execute_rule_review(version_id, run_id, publish_events=False)
                 print("   ✅ 规则审查任务已完成")
             
-            if run_type in ("AI", "MIXED"):
+            if run_type == "MIXED":
+                # 规则审查已转调 AI 规则校验，同一运行完成后不会再次执行
+                print("   规则审查已转调 AI 规则校验，MIXED 不再重复执行AI审查任务")
+            elif run_type == "AI":
                 print("   执行AI审查任务...")
                 _execute_ai_review(version_id, run_id)
                 print("   ✅ AI审查任务已完成")
@@ -174,7 +177,9 @@ def trigger_review(version_id: int, run_type: str = "RULE", direct: bool = False
                 run_rule_review_task.delay(version_id, run_id)
                 print("   ✅ 规则审查任务已提交到 Celery")
             
-            if run_type in ("AI", "MIXED"):
+            if run_type == "MIXED":
+                print("   规则审查已转调 AI 规则校验，MIXED 不再重复提交AI审查任务")
+            elif run_type == "AI":
                 print("   启动AI审查任务...")
                 run_ai_review_task.delay(version_id, run_id)
                 print("   ✅ AI审查任务已提交到 Celery")
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+知识库向量索引管理（见 app/services/vector_index_service.py）
+用法：
+    python 知识库向量索引.py --info                   # 查看当前索引、向量行数与基准结果
+    python 知识库向量索引.py --rebuild [--method hnsw] # 按当前行数重建索引
+    python 知识库向量索引.py --bench [--sample 50]     # 召回基准（与精确检索对比）
+"""
+import json
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+import argparse
+from app.services import vector_index_service as vis
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识库向量索引管理")
+    parser.add_argument("--info", action="store_true", help="查看当前索引")
+    parser.add_argument("--rebuild", action="store_true", help="重建索引")
+    parser.add_argument("--method", choices=[vis.HNSW, vis.IVFFLAT], default=None, help="索引类型，缺省取 KB_VECTOR_INDEX")
+    parser.add_argument("--bench", action="store_true", help="召回基准")
+    parser.add_argument("--sample", type=int, default=50, help="基准查询条数")
+    parser.add_argument("--top-k", type=int, default=10, help="基准 recall@k 的 k")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        info = vis.rebuild_index(args.method)
+        print(f"重建完成：{info.get('definition')}")
+    if args.bench:
+        report = vis.benchmark(args.sample, args.top_k)
+        print(f"{report['method']} 索引，{report['rows']} 行，{report['sample']} 条查询，recall@{report['top_k']}：")
+        for r in report["results"]:
+            print(f"  {report['guc']}={r['value']:<4} recall={r['recall']:.3f}  p50={r['p50_ms']}ms  p95={r['p95_ms']}ms")
+    if args.info or not (args.rebuild or args.bench):
+        print(f"向量行数：{vis.embedded_rows()}")
+        print(f"当前索引：{json.dumps(vis.index_info(), ensure_ascii=False)}")
+        print(f"推荐 ivfflat lists：{vis.recommended_lists(vis.embedded_rows())}")
+        print(f"当前查询参数：{vis.query_setting()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+-- 013: AI 请求遥测（token 用量、耗时、重试、HTTP 状态），按审查运行与规则批次聚合
+SET search_path = sws, public;
+
+create table if not exists ai_request_log (
+  id bigserial primary key,
+  run_id bigint references review_run(id) on delete cascade,
+  batch_key varchar(255),           -- 本批规则 ID（逗号拼接），用于按批聚合
+  rule_ids jsonb,                   -- 本批规则 ID 列表
+  attempt int not null default 1,   -- 第几次尝试（>1 即重试）
+  model varchar(64),
+  stream boolean not null default false,
+  http_status int,                  -- 无响应（超时/连接失败）时为空
+  success boolean not null default false,
+  prompt_tokens int,
+  completion_tokens int,
+  total_tokens int,
+  latency_ms int,
+  error_message text,
+  created_at timestamptz not null default now()
+);
+create index if not exists idx_ai_request_log_run on ai_request_log(run_id);
+create index if not exists idx_ai_request_log_batch on ai_request_log(batch_key);
+
+COMMENT ON TABLE ai_request_log IS 'AI 请求遥测：每次 chat/completions 调用一行，用于成本/耗时分析与 token 预算';
+COMMENT ON COLUMN ai_request_log.batch_key IS '本批规则 ID 拼接，按批统计最贵/最慢的规则组合';
@@ -0,0 +1,6 @@
+-- 014: AI 请求遥测记录命中前缀缓存的提示 token，用于统计缓存命中比例
+SET search_path = sws, public;
+
+alter table ai_request_log add column if not exists cached_tokens int;
+
+COMMENT ON COLUMN ai_request_log.cached_tokens IS '命中前缀/显式上下文缓存的提示 token（usage.prompt_tokens_details.cached_tokens）';
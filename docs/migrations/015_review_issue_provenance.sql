@@ -0,0 +1,7 @@
+-- 015: 问题来源追溯。同一运行内多个规则批次/重试轮/本地规则对同一处问题的重复报告合并为一条，
+-- provenance 记录各来源：[{rule_id, title, source(ai/local), block_id, char_start, char_end}]
+SET search_path = sws, public;
+
+alter table review_issue add column if not exists provenance jsonb;
+
+COMMENT ON COLUMN review_issue.provenance IS '合并来源列表：规则 ID、原标题、来源（ai/local）与证据位置';
@@ -0,0 +1,32 @@
+-- 016: AI 审查运行的批次检查点。worker 中途退出后从未完成批次续跑，问题按 (run_id, batch_id, batch_ordinal) 幂等写入
+SET search_path = sws, public;
+
+create table if not exists review_run_batch (
+  id bigserial primary key,
+  run_id bigint not null references review_run(id) on delete cascade,
+  round int not null default 1,                     -- 0 本地规则，1 首轮，2 失败规则重试轮
+  batch_no int not null,                            -- 轮内序号
+  tier varchar(16),                                 -- 模型档位 small / large（本地规则为空）
+  rule_ids jsonb not null default '[]'::jsonb,      -- 本批规则 ID
+  status varchar(16) not null default 'PENDING',    -- PENDING / RUNNING / DONE / FAILED
+  attempts int not null default 0,                  -- 执行次数（续跑重新执行时累加）
+  result_hash varchar(64),                          -- 本批 AI 输出的 sha256
+  issue_count int not null default 0,
+  error_message text,
+  started_at timestamptz,
+  finished_at timestamptz,
+  created_at timestamptz not null default now(),
+  updated_at timestamptz not null default now(),
+  unique (run_id, round, batch_no)
+);
+create index if not exists idx_review_run_batch_status on review_run_batch(run_id, status);
+
+alter table review_issue add column if not exists batch_id bigint references review_run_batch(id) on delete set null;
+alter table review_issue add column if not exists batch_ordinal int;
+create unique index if not exists uq_review_issue_batch_ordinal on review_issue(run_id, batch_id, batch_ordinal);
+
+-- reaper 按心跳（updated_at）查找停滞的 RUNNING 运行
+create index if not exists idx_review_run_status_updated on review_run(status, updated_at);
+
+COMMENT ON TABLE review_run_batch IS 'AI 审查运行的规则批次检查点：状态、执行次数、结果哈希，用于续跑';
+COMMENT ON COLUMN review_issue.batch_ordinal IS '问题在所属批次输出中的序号，与 run_id、batch_id 构成幂等写入键';
@@ -0,0 +1,6 @@
+-- 017: 分窗审查（AI_DOC_WINDOW_TOKENS）：批次记录所审查的文档窗口序号，续跑与重试轮沿用原窗口
+SET search_path = sws, public;
+
+alter table review_run_batch add column if not exists window_no int;
+
+COMMENT ON COLUMN review_run_batch.window_no IS '分窗审查时批次对应的文档上下文窗口序号（按大纲章节切分），未分窗为空';
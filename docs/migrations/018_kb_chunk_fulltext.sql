@@ -0,0 +1,16 @@
+-- 018: kb_chunk 全文检索。search_terms 为应用侧切分的检索词（中文字 bigram + 英文/数字词，见 app/ai/kb_tokenizer.py），
+-- search_tsv 由其生成并建 GIN 索引；term_count 为 BM25 文档长度。
+-- 已有数据执行迁移后需回填：celery -A app.worker.app call app.worker.kb_tasks.backfill_kb_search_terms_task
+SET search_path = sws, public;
+
+alter table kb_chunk add column if not exists search_terms text;
+alter table kb_chunk add column if not exists term_count int;
+alter table kb_chunk add column if not exists search_tsv tsvector
+  generated always as (to_tsvector('simple', coalesce(search_terms, ''))) stored;
+
+create index if not exists idx_kb_chunk_search_tsv on kb_chunk using gin (search_tsv);
+create index if not exists idx_kb_chunk_search_pending on kb_chunk(id) where search_terms is null;
+
+COMMENT ON COLUMN kb_chunk.search_terms IS '检索词（中文 bigram + 英文/数字词，空格分隔），用于生成 search_tsv';
+COMMENT ON COLUMN kb_chunk.term_count IS '检索词数量（BM25 文档长度）';
+COMMENT ON COLUMN kb_chunk.search_tsv IS '全文检索向量（simple 配置，GIN 索引）';
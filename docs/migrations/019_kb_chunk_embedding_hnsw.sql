@@ -0,0 +1,10 @@
+-- 019: 005 中的 ivfflat 索引建在空表上（lists = 100 的聚类中心未经训练），数据写入后召回率很差。
+-- 改为 HNSW（无需训练，随数据增量维护）；之后的重建与参数由 app/services/vector_index_service.py 管理
+-- （KB_VECTOR_INDEX=ivfflat 时批量写入向量后按行数重建 lists）。需 pgvector >= 0.5。
+SET search_path = sws, public;
+
+DROP INDEX IF EXISTS idx_kb_chunk_embedding;
+CREATE INDEX IF NOT EXISTS idx_kb_chunk_embedding
+ON kb_chunk
+USING hnsw (embedding vector_cosine_ops)
+WITH (m = 16, ef_construction = 64);
@@ -0,0 +1,5 @@
+-- 020: batch_ordinal 由“批次内到达序号”改为问题内容（去重键）的哈希（见 app/worker/ai_review_tasks.py _content_ordinal）。
+-- 续跑后序号从头编起时，不同问题会与重置时保留下来的行撞上唯一键而被静默替换；按内容取值后只有同一问题才会命中已有行。
+SET search_path = sws, public;
+
+COMMENT ON COLUMN review_issue.batch_ordinal IS '问题内容（规则、标题、首条证据）的哈希，与 run_id、batch_id 构成幂等写入键';